@@ -0,0 +1,183 @@
+"""Zoom-dependent point clustering, modelled on Mapbox's supercluster.
+
+Points are projected to unit Web Mercator coordinates. Starting from the raw
+points, each zoom level from max_zoom down to min_zoom greedily merges points
+that lie within `radius` pixels of each other at that zoom into a weighted
+centroid. A level builds a grid of its nodes the first time it is queried, so a
+viewport query only touches the cells it overlaps.
+"""
+import math
+from typing import List, Optional, Tuple
+
+
+def lng_x(lng: float) -> float:
+    return lng / 360 + 0.5
+
+
+def lat_y(lat: float) -> float:
+    # Web Mercator is undefined at the poles; clamp to its usual +/-85.05 deg
+    sin = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+    return min(max(y, 0.0), 1.0)
+
+
+def x_lng(x: float) -> float:
+    return (x - 0.5) * 360
+
+
+def y_lat(y: float) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+class _Level:
+    __slots__ = ("xs", "ys", "counts", "points", "cell", "_grid")
+
+    def __init__(self, cell: float):
+        self.xs: List[float] = []
+        self.ys: List[float] = []
+        self.counts: List[int] = []
+        self.points: List[Optional[int]] = []  # index into the source points for single-point nodes
+        self.cell = cell
+        self._grid = None
+
+    def add(self, x: float, y: float, count: int, point: Optional[int]) -> None:
+        self.xs.append(x)
+        self.ys.append(y)
+        self.counts.append(count)
+        self.points.append(point)
+
+    def _ensure_grid(self) -> dict:
+        # Built on first query; most zoom levels are never asked for
+        if self._grid is None:
+            grid = {}
+            cell = self.cell
+            for i, (x, y) in enumerate(zip(self.xs, self.ys)):
+                grid.setdefault((int(x / cell), int(y / cell)), []).append(i)
+            self._grid = grid
+        return self._grid
+
+    def range(self, min_x: float, min_y: float, max_x: float, max_y: float, limit: Optional[int] = None) -> List[int]:
+        grid = self._ensure_grid()
+        cell = self.cell
+        cx0, cx1 = int(min_x / cell), int(max_x / cell)
+        cy0, cy1 = int(min_y / cell), int(max_y / cell)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(grid):
+            # Box covers more cells than are occupied: walk the occupied ones
+            buckets = [ids for (cx, cy), ids in grid.items() if cx0 <= cx <= cx1 and cy0 <= cy <= cy1]
+        else:
+            buckets = [grid[(cx, cy)] for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1) if (cx, cy) in grid]
+        found = []
+        for ids in buckets:
+            for i in ids:
+                if min_x <= self.xs[i] <= max_x and min_y <= self.ys[i] <= max_y:
+                    found.append(i)
+                    if len(found) == limit:
+                        return found
+        return found
+
+
+class Supercluster:
+    def __init__(self, radius: int = 60, extent: int = 512, min_zoom: int = 0, max_zoom: int = 14, min_points: int = 2):
+        self.radius = radius
+        self.extent = extent
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.min_points = min_points
+        self.points: List[dict] = []
+        self._levels = {}
+
+    def _cell(self, zoom: int) -> float:
+        return self.radius / (self.extent * 2 ** zoom)
+
+    def load(self, points: List[Tuple[float, float, dict]]) -> "Supercluster":
+        """Index (latitude, longitude, properties) tuples."""
+        self.points = [props for _, _, props in points]
+        level = _Level(self._cell(self.max_zoom + 1))
+        for i, (lat, lng, _) in enumerate(points):
+            level.add(lng_x(lng), lat_y(lat), 1, i)
+        self._levels[self.max_zoom + 1] = level
+
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            level = self._cluster(level, zoom)
+            self._levels[zoom] = level
+        return self
+
+    def _cluster(self, prev: _Level, zoom: int) -> _Level:
+        r = self._cell(zoom)
+        out = _Level(r)
+        xs, ys, counts, points = prev.xs, prev.ys, prev.counts, prev.points
+        n = len(xs)
+        # Neighbour search over the previous level at this zoom's radius
+        keys = [(int(xs[i] / r) << 32) | int(ys[i] / r) for i in range(n)]
+        grid = {}
+        for i, key in enumerate(keys):
+            bucket = grid.get(key)
+            if bucket is None:
+                grid[key] = [i]
+            else:
+                bucket.append(i)
+        offsets = [(dx << 32) + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+        visited = bytearray(n)
+        r2 = r * r
+        for i in range(n):
+            if visited[i]:
+                continue
+            visited[i] = 1
+            x, y, key = xs[i], ys[i], keys[i]
+            neighbours = []
+            for off in offsets:
+                bucket = grid.get(key + off)
+                if bucket is None:
+                    continue
+                for j in bucket:
+                    if not visited[j] and (xs[j] - x) ** 2 + (ys[j] - y) ** 2 <= r2:
+                        neighbours.append(j)
+
+            if not neighbours:
+                out.add(x, y, counts[i], points[i])
+                continue
+            count = counts[i] + sum(counts[j] for j in neighbours)
+            if count < self.min_points:
+                out.add(x, y, counts[i], points[i])
+                continue
+            wx, wy = x * counts[i], y * counts[i]
+            for j in neighbours:
+                visited[j] = 1
+                wx += xs[j] * counts[j]
+                wy += ys[j] * counts[j]
+            out.add(wx / count, wy / count, count, None)
+        return out
+
+    def get_clusters(self, min_lng: float, min_lat: float, max_lng: float, max_lat: float, zoom: float,
+                     limit: Optional[int] = None) -> Tuple[List[dict], List[dict]]:
+        """(clusters, points) visible in the bbox at `zoom`; min_lng > max_lng crosses the antimeridian.
+
+        At most `limit` items in total. Above max_zoom every point is its own
+        node, so without a limit a wide box returns every point.
+        """
+        z = max(self.min_zoom, min(int(zoom), self.max_zoom + 1))
+        level = self._levels.get(z)
+        if level is None:
+            return [], []
+        min_y, max_y = lat_y(max_lat), lat_y(min_lat)
+        if min_lng > max_lng:
+            found = level.range(lng_x(min_lng), min_y, 1.0, max_y, limit)
+            if limit is None or len(found) < limit:
+                rest = None if limit is None else limit - len(found)
+                found += level.range(0.0, min_y, lng_x(max_lng), max_y, rest)
+        else:
+            found = level.range(lng_x(min_lng), min_y, lng_x(max_lng), max_y, limit)
+
+        clusters, points = [], []
+        for i in found:
+            if level.points[i] is not None:
+                points.append(self.points[level.points[i]])
+            else:
+                clusters.append({
+                    "latitude": y_lat(level.ys[i]),
+                    "longitude": x_lng(level.xs[i]),
+                    "count": level.counts[i],
+                    "expansion_zoom": min(z + 1, self.max_zoom + 1),
+                })
+        return clusters, points
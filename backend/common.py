@@ -0,0 +1,47 @@
+"""Settings and document helpers shared by server.py and manage.py.
+
+Keep this module free of app state: importing server.py builds the app, the
+Motor client and its worker pools, which the CLI and the process-pool workers
+of backfill-derivatives must not pay for.
+"""
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+
+# Load backend/.env before reading settings (server.py and db.py do the same)
+load_dotenv(Path(__file__).resolve().parent / ".env")
+
+# Photo derivatives: name -> longest edge in pixels
+DERIVATIVE_SIZES = {"thumb": 320, "card": 960, "full": 2048}
+DERIVATIVE_FORMAT = os.environ.get("DERIVATIVE_FORMAT", "WEBP").upper()  # WEBP or JPEG
+DERIVATIVE_QUALITY = int(os.environ.get("DERIVATIVE_QUALITY", 80))
+DERIVATIVE_WORKERS = int(os.environ.get("DERIVATIVE_WORKERS", 2))
+
+# Guests live only in their JWT until their first write
+GUEST_SESSION_HOURS = 24
+
+# Pins embed only the newest few comments; the rest are paged from `comments`
+COMMENT_PREVIEW_SIZE = 3
+
+# Conversations store the start of their latest message for the inbox
+MESSAGE_PREVIEW_CHARS = 140
+
+
+def geo_point(latitude: float, longitude: float) -> dict:
+    # GeoJSON stores coordinates as [longitude, latitude]
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+def conversation_id(user_a: str, user_b: str) -> str:
+    return ":".join(sorted((user_a, user_b)))
+
+
+def message_preview(message: dict) -> dict:
+    return {
+        "id": message['id'],
+        "sender_id": message['sender_id'],
+        "content": message['content'][:MESSAGE_PREVIEW_CHARS],
+        "created_at": message['created_at'],
+    }
@@ -0,0 +1,164 @@
+"""Typo-tolerant search over normalized words using trigram similarity.
+
+Two levels of sorted integer posting lists:
+
+* trigram -> ids of vocabulary words containing it. A misspelled query word
+  collects candidate words from its trigrams, and these are ranked by Jaccard
+  similarity of trigram sets.
+* word -> numbers of the documents containing it, with the best field weight of
+  each occurrence.
+
+Document numbers only grow, so every posting list stays sorted under appends.
+Multi-word queries intersect the per-word candidates, so a word with no close
+vocabulary word empties the result. A small candidate set is
+probed into the remaining lists by bisection; otherwise the lists are scanned.
+Removed documents are tombstoned until the next rebuild.
+"""
+import bisect
+import heapq
+from array import array
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+
+from suggest_index import normalize
+from text_search import STOPWORDS, words
+
+SIMILARITY_THRESHOLD = 0.3
+MAX_WORD_MATCHES = 8  # closest vocabulary words considered per query word
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = weights
+        self._word_ids: Dict[str, int] = {}
+        self._words: List[str] = []
+        self._gram_counts = array("H")  # word id -> number of distinct trigrams
+        self._grams: Dict[str, array] = {}  # trigram -> sorted word ids
+        self._docs: List[array] = []  # word id -> sorted document numbers
+        self._doc_weights: List[array] = []  # parallel to _docs
+        self._doc_ids: List[str] = []  # document number -> external id
+        self._doc_nums: Dict[str, int] = {}
+        self._deleted: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._doc_nums)
+
+    def _word_id(self, word: str) -> int:
+        wid = self._word_ids.get(word)
+        if wid is None:
+            wid = self._word_ids[word] = len(self._words)
+            self._words.append(word)
+            grams = trigrams(word)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                ids = self._grams.get(gram)
+                if ids is None:
+                    ids = self._grams[gram] = array("I")
+                ids.append(wid)
+            self._docs.append(array("I"))
+            self._doc_weights.append(array("B"))
+        return wid
+
+    def add(self, doc_id: str, doc: dict) -> None:
+        self.remove(doc_id)
+        best: Dict[str, int] = {}
+        for field, weight in self.weights.items():
+            for word in words(normalize(doc.get(field) or "")):
+                if word not in STOPWORDS and best.get(word, 0) < weight:
+                    best[word] = weight
+        num = len(self._doc_ids)
+        self._doc_ids.append(doc_id)
+        self._doc_nums[doc_id] = num
+        for word, weight in best.items():
+            wid = self._word_id(word)
+            self._docs[wid].append(num)
+            self._doc_weights[wid].append(min(weight, 255))
+
+    def remove(self, doc_id: str) -> None:
+        num = self._doc_nums.pop(doc_id, None)
+        if num is not None:
+            self._deleted.add(num)
+
+    def similar_words(self, word: str) -> List[Tuple[int, float]]:
+        """(word id, similarity) of the closest vocabulary words, best first."""
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            ids = self._grams.get(gram)
+            if ids is not None:
+                shared.update(ids)
+        q = len(grams)
+        counts = self._gram_counts
+        scored = []
+        for wid, n in shared.items():
+            similarity = n / (q + counts[wid] - n)
+            if similarity >= SIMILARITY_THRESHOLD:
+                scored.append((similarity, wid))
+        return [(wid, sim) for sim, wid in heapq.nlargest(MAX_WORD_MATCHES, scored)]
+
+    def _scan(self, matches: List[Tuple[int, float]]) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for wid, sim in matches:
+            for num, weight in zip(self._docs[wid], self._doc_weights[wid]):
+                score = sim * weight
+                if scores.get(num, 0) < score:
+                    scores[num] = score
+        return scores
+
+    def _probe(self, candidates: Dict[int, float], matches: List[Tuple[int, float]]) -> Dict[int, float]:
+        kept: Dict[int, float] = {}
+        for num, total in candidates.items():
+            best = 0.0
+            for wid, sim in matches:
+                docs = self._docs[wid]
+                i = bisect.bisect_left(docs, num)
+                if i < len(docs) and docs[i] == num:
+                    best = max(best, sim * self._doc_weights[wid][i])
+            if best:
+                kept[num] = total + best
+        return kept
+
+    def search(self, query: str, limit: int, offset: int = 0) -> List[str]:
+        """Ids of documents matching every query word (each allowing typos), best first.
+
+        Stop words and single letters are ignored; any other word with no close
+        vocabulary word means nothing matches.
+        """
+        per_word = []
+        for word in set(words(normalize(query))):
+            if word in STOPWORDS or len(word) < 2:
+                continue
+            matches = self.similar_words(word)
+            if not matches:
+                return []
+            per_word.append((sum(len(self._docs[wid]) for wid, _ in matches), matches))
+        if not per_word:
+            return []
+
+        # Start from the rarest word; probe the rest while the candidate set is small
+        per_word.sort(key=lambda item: item[0])
+        scores = self._scan(per_word[0][1])
+        for postings, matches in per_word[1:]:
+            if not scores:
+                break
+            if len(scores) * len(matches) * 16 < postings:
+                scores = self._probe(scores, matches)
+            else:
+                other = self._scan(matches)
+                scores = {num: total + other[num] for num, total in scores.items() if num in other}
+
+        deleted = self._deleted
+        ranked = heapq.nlargest(
+            offset + limit,
+            ((total, num) for num, total in scores.items() if num not in deleted)
+        )
+        return [self._doc_ids[num] for _, num in ranked[offset:]]
+
+    def memory_bytes(self) -> int:
+        arrays = [self._gram_counts, *self._grams.values(), *self._docs, *self._doc_weights]
+        return sum(a.itemsize * len(a) for a in arrays)
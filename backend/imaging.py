@@ -0,0 +1,45 @@
+"""Pillow helpers for photo derivatives.
+
+These run inside ProcessPoolExecutor workers, so this module must stay free of app
+state (no database clients, no FastAPI imports).
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+
+CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+
+def render_derivatives(data: bytes, sizes: dict, fmt: str = "WEBP", quality: int = 80) -> dict:
+    """Resize an image to each {name: longest_edge} in `sizes`.
+
+    Returns {name: {"data", "content_type", "width", "height"}}. Images are never
+    upscaled, and each size is produced from the previous larger one to keep
+    resampling cheap.
+    """
+    fmt = fmt.upper()
+    largest = max(sizes.values())
+    with Image.open(BytesIO(data)) as original:
+        # Lets the JPEG decoder skip straight to a smaller scale when possible
+        original.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(original)
+        if fmt == "JPEG" or img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB" if fmt == "JPEG" or "A" not in img.getbands() else "RGBA")
+
+        results = {}
+        for name, edge in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+            img = img.copy()
+            img.thumbnail((edge, edge), Image.LANCZOS)
+            buf = BytesIO()
+            if fmt == "WEBP":
+                img.save(buf, "WEBP", quality=quality, method=4)
+            else:
+                img.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+            results[name] = {
+                "data": buf.getvalue(),
+                "content_type": CONTENT_TYPES[fmt],
+                "width": img.width,
+                "height": img.height,
+            }
+    return results
@@ -0,0 +1,139 @@
+"""Every MongoDB index the API relies on, declared in one place.
+
+server.py applies INDEXES on startup and `python manage.py ensure-indexes` applies
+them from the command line. `python manage.py check-indexes` explains each entry in
+CANONICAL_QUERIES and fails if any of them would scan a whole collection.
+
+Keep this module free of app state so both the async server and the sync CLI can
+import it.
+"""
+from datetime import datetime, timezone
+from typing import Iterable, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, IndexModel
+
+
+# Relevance weights for search_pins and search_events; the in-memory fallback
+# index in text_search.py uses the same ones
+PIN_TEXT_WEIGHTS = {"title": 10, "description": 4}
+EVENT_TEXT_WEIGHTS = {"title": 10, "description": 4, "location_name": 2}
+
+
+# (collection, keys, options)
+INDEXES: List[Tuple[str, list, dict]] = [
+    # Lookups by public id, and account identity
+    ("users", [("id", ASCENDING)], {"unique": True}),
+    ("users", [("email", ASCENDING)], {"unique": True}),
+    ("users", [("username", ASCENDING)], {"unique": True}),
+    # search_users prefix matching
+    ("users", [("username_lower", ASCENDING)], {}),
+    ("pins", [("id", ASCENDING)], {"unique": True}),
+    ("media", [("id", ASCENDING)], {"unique": True}),
+    ("events", [("id", ASCENDING)], {"unique": True}),
+    ("comments", [("id", ASCENDING)], {"unique": True}),
+    ("messages", [("id", ASCENDING)], {"unique": True}),
+    ("conversations", [("id", ASCENDING)], {"unique": True}),
+
+    # get_pins viewport and get_nearby
+    ("pins", [("location", GEOSPHERE)], {}),
+    # get_pins keyset order; the visibility $or merges the privacy and user_id branches;
+    # get_trending scans recent public pins on the second
+    ("pins", [("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ("pins", [("privacy", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    # get_user_pins
+    ("pins", [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+
+    # search_pins / search_events
+    ("pins", [(field, TEXT) for field in PIN_TEXT_WEIGHTS], {"weights": PIN_TEXT_WEIGHTS, "name": "pins_text"}),
+    ("events", [(field, TEXT) for field in EVENT_TEXT_WEIGHTS], {"weights": EVENT_TEXT_WEIGHTS, "name": "events_text"}),
+
+    # get_comments and the comment preview refresh
+    ("comments", [("pin_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    # get_media and the batched media lookup in get_pins
+    ("media", [("pin_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {}),
+    # get_events
+    ("events", [("event_date", ASCENDING), ("id", ASCENDING)], {}),
+    # render_tile event layer
+    ("events", [("location", GEOSPHERE)], {}),
+    # Guest purge: expired guests, then what they created. The TTL is a backstop
+    # a day past expiry, in case the purge job has not run
+    ("users", [("expires_at", ASCENDING)], {"expireAfterSeconds": 24 * 3600}),
+    ("comments", [("user_id", ASCENDING)], {}),
+    ("events", [("user_id", ASCENDING)], {}),
+    ("users", [("friend_requests", ASCENDING)], {}),
+    # get_messages: the newest page of one conversation, then older pages
+    ("messages", [("conversation_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    # Stamping legacy messages, mark_messages_read, and the sent half of the /api/ws catch-up
+    ("messages", [("sender_id", ASCENDING), ("recipient_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {}),
+    # The received half of the /api/ws catch-up
+    ("messages", [("recipient_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    # MESSAGE_STORAGE=buckets: appends find the open bucket; history and catch-up read by end
+    ("message_buckets", [("conversation_id", ASCENDING), ("count", ASCENDING)], {}),
+    ("message_buckets", [("conversation_id", ASCENDING), ("end", DESCENDING)], {}),
+    # get_conversations (the inbox)
+    ("conversations", [("participants", ASCENDING), ("updated_at", DESCENDING), ("id", DESCENDING)], {}),
+]
+
+
+def index_models() -> Iterable[Tuple[str, IndexModel]]:
+    for collection, keys, options in INDEXES:
+        yield collection, IndexModel(keys, **options)
+
+
+# (route, collection, filter, sort) shaped like the query each route sends.
+# $text queries always use their text index, so they are not listed.
+_ME, _FRIEND, _ID = "check-user", "check-friend", "check-id"
+CANONICAL_QUERIES: List[Tuple[str, str, dict, list]] = [
+    ("get_current_user", "users", {"id": _ID}, []),
+    ("login", "users", {"email": "check@example.com"}, []),
+    ("register", "users", {"$or": [{"email": "check@example.com"}, {"username": "check"}]}, []),
+    ("get_friends", "users", {"id": {"$in": [_FRIEND], "$gt": ""}}, [("id", 1)]),
+    ("get_pin", "pins", {"id": _ID}, []),
+    ("get_pins", "pins", {"$or": [
+        {"privacy": "public", "user_id": {"$ne": _ME}},
+        {"user_id": _ME},
+        {"$and": [{"privacy": "friends"}, {"user_id": {"$in": [_FRIEND]}}]},
+    ]}, [("created_at", -1), ("id", -1)]),
+    ("get_pins (viewport)", "pins", {"location": {"$geoWithin": {"$geometry": {
+        "type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]],
+    }}}}, []),
+    ("get_user_pins", "pins", {"user_id": _ME}, [("created_at", -1), ("id", -1)]),
+    ("get_trending", "pins", {"privacy": "public", "created_at": {"$gte": ""}}, []),
+    ("get_comments", "comments", {"pin_id": _ID}, [("created_at", -1), ("id", -1)]),
+    ("delete_comment", "comments", {"id": _ID}, []),
+    ("get_media", "media", {"pin_id": _ID}, [("created_at", 1), ("id", 1)]),
+    ("get_pins (media)", "media", {"pin_id": {"$in": [_ID]}}, [("created_at", 1)]),
+    ("get_media_raw", "media", {"id": _ID}, []),
+    ("get_events", "events", {}, [("event_date", 1), ("id", 1)]),
+    ("attend_event", "events", {"id": _ID}, []),
+    ("render_tile (events)", "events", {"location": {"$geoWithin": {"$geometry": {
+        "type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]],
+    }}}}, [("event_date", 1)]),
+    ("get_messages", "messages", {"conversation_id": _ID}, [("created_at", -1), ("id", -1)]),
+    ("send_message (buckets)", "message_buckets", {"conversation_id": _ID, "count": {"$lt": 200}}, []),
+    ("get_messages (buckets)", "message_buckets", {"conversation_id": _ID, "start": {"$lte": ""}}, [("end", -1)]),
+    ("stamp_conversation", "messages", {"$or": [
+        {"sender_id": _ME, "recipient_id": _FRIEND},
+        {"sender_id": _FRIEND, "recipient_id": _ME},
+    ], "conversation_id": None}, []),
+    ("search_users", "users", {"$or": [{"username_lower": {"$regex": "^check"}}, {"email": "check@example.com"}]}, []),
+    ("mark_messages_read", "messages", {"sender_id": _FRIEND, "recipient_id": _ME, "read": False}, []),
+    ("get_conversations", "conversations", {"participants": _ME}, [("updated_at", -1), ("id", -1)]),
+    ("realtime_socket", "messages", {"$or": [{"sender_id": _ME}, {"recipient_id": _ME}]}, [("created_at", 1), ("id", 1)]),
+    ("purge_expired_guests", "users", {"is_guest": True, "expires_at": {"$lt": datetime(2000, 1, 1, tzinfo=timezone.utc)}}, []),
+    ("purge_guests (comments)", "comments", {"user_id": {"$in": [_ME]}}, []),
+    ("purge_guests (events)", "events", {"user_id": {"$in": [_ME]}}, []),
+    ("purge_guests (friend requests)", "users", {"friend_requests": {"$in": [_ME]}}, []),
+]
+
+
+def plan_stages(plan) -> Iterable[str]:
+    """Every `stage` name anywhere in an explain() document."""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
@@ -0,0 +1,341 @@
+"""Maintenance commands for the MapMoments database.
+
+Run from the backend directory, for example:
+
+    python manage.py backfill-pin-locations
+    python manage.py backfill-event-locations
+    python manage.py backfill-username-lower
+    python manage.py backfill-derivatives --batch-size 50
+    python manage.py backfill-like-counts
+    python manage.py split-comments
+    python manage.py expire-legacy-guests
+    python manage.py build-conversations
+    python manage.py stamp-conversations
+    python manage.py ensure-indexes
+    python manage.py check-indexes
+
+Commands use the synchronous client from db.py so they can run outside the API process.
+"""
+import argparse
+import inspect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from gridfs import GridFSBucket
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import PyMongoError
+
+from db import db
+from imaging import render_derivatives
+from indexes import CANONICAL_QUERIES, index_models, plan_stages
+from common import (
+    COMMENT_PREVIEW_SIZE,
+    DERIVATIVE_FORMAT,
+    DERIVATIVE_QUALITY,
+    DERIVATIVE_SIZES,
+    DERIVATIVE_WORKERS,
+    GUEST_SESSION_HOURS,
+    conversation_id,
+    geo_point,
+    message_preview,
+)
+
+
+BATCH_SIZE = 1000
+
+
+def _flush(collection, ops: list) -> int:
+    if not ops:
+        return 0
+    result = collection.bulk_write(ops, ordered=False)
+    ops.clear()
+    return result.modified_count
+
+
+def _backfill_locations(collection, batch_size: int) -> int:
+    updated = 0
+    ops = []
+    cursor = collection.find(
+        {"location": {"$exists": False}, "latitude": {"$type": "number"}, "longitude": {"$type": "number"}},
+        {"_id": 1, "latitude": 1, "longitude": 1},
+        batch_size=batch_size,
+    )
+    for doc in cursor:
+        ops.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"location": geo_point(doc["latitude"], doc["longitude"])}},
+        ))
+        if len(ops) >= batch_size:
+            updated += _flush(collection, ops)
+    updated += _flush(collection, ops)
+    return updated
+
+
+def backfill_pin_locations(batch_size: int = BATCH_SIZE) -> int:
+    """Populate the GeoJSON `location` field from latitude/longitude on older pins."""
+    return _backfill_locations(db.pins, batch_size)
+
+
+def backfill_event_locations(batch_size: int = BATCH_SIZE) -> int:
+    """Populate the GeoJSON `location` field on older events, which vector tiles query by."""
+    return _backfill_locations(db.events, batch_size)
+
+
+def backfill_username_lower(batch_size: int = BATCH_SIZE) -> int:
+    """Set username_lower, which search_users matches prefixes on, for users registered before it."""
+    updated = 0
+    ops = []
+    cursor = db.users.find({"username_lower": {"$exists": False}}, {"_id": 1, "username": 1}, batch_size=batch_size)
+    for user in cursor:
+        ops.append(UpdateOne({"_id": user["_id"]}, {"$set": {"username_lower": (user.get("username") or "").lower()}}))
+        if len(ops) >= batch_size:
+            updated += _flush(db.users, ops)
+    updated += _flush(db.users, ops)
+    return updated
+
+
+def _store_derivatives(bucket: GridFSBucket, media: dict, rendered: dict) -> None:
+    derivatives = {}
+    for name, out in rendered.items():
+        derivative_id = bucket.upload_from_stream(
+            f"{media['file_id']}_{name}",
+            out["data"],
+            metadata={"content_type": out["content_type"], "derivative_of": media["file_id"], "variant": name},
+        )
+        derivatives[name] = {
+            "file_id": str(derivative_id),
+            "content_type": out["content_type"],
+            "width": out["width"],
+            "height": out["height"],
+            "size": len(out["data"]),
+        }
+    result = db.media.update_one({"id": media["id"]}, {"$set": {"derivatives": derivatives}})
+    if result.matched_count == 0:
+        for d in derivatives.values():
+            bucket.delete(ObjectId(d["file_id"]))
+
+
+def backfill_derivatives(batch_size: int = 50) -> int:
+    """Render thumb/card/full derivatives for photos uploaded before the pipeline existed."""
+    bucket = GridFSBucket(db)
+    query = {
+        "media_type": "photo",
+        "derivatives_error": {"$exists": False},
+        "$or": [{"derivatives": {"$exists": False}}, {"derivatives": {}}],
+    }
+    processed = 0
+    with ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS, mp_context=multiprocessing.get_context("spawn")) as pool:
+        while True:
+            # Re-query each round; finished media no longer match
+            batch = list(db.media.find(query, {"id": 1, "file_id": 1}).limit(batch_size))
+            batch = [m for m in batch if ObjectId.is_valid(m.get("file_id", ""))]
+            if not batch:
+                break
+            originals = []
+            for media in batch:
+                try:
+                    originals.append(bucket.open_download_stream(ObjectId(media["file_id"])).read())
+                except Exception as e:
+                    print(f"skip media {media['id']}: {e}")
+                    originals.append(None)
+
+            futures = [
+                pool.submit(render_derivatives, data, DERIVATIVE_SIZES, DERIVATIVE_FORMAT, DERIVATIVE_QUALITY)
+                if data is not None else None
+                for data in originals
+            ]
+            for media, future in zip(batch, futures):
+                try:
+                    if future is None:
+                        raise ValueError("original file missing")
+                    _store_derivatives(bucket, media, future.result())
+                    processed += 1
+                except Exception as e:
+                    print(f"skip media {media['id']}: {e}")
+                    # Mark so the loop doesn't retry it forever
+                    db.media.update_one({"id": media["id"]}, {"$set": {"derivatives_error": str(e)[:200]}})
+    return processed
+
+
+def backfill_like_counts(batch_size: int = BATCH_SIZE) -> int:
+    """Recompute the denormalized like_count from the likes array on every pin.
+
+    Matches pins whose count is missing or disagrees with the array, so it
+    repairs drift as well as filling in old pins, and is safe to rerun.
+    """
+    # Single server-side pipeline update; batch_size is unused
+    result = db.pins.update_many(
+        {"$expr": {"$ne": ["$like_count", {"$size": {"$ifNull": ["$likes", []]}}]}},
+        [{"$set": {"like_count": {"$size": {"$ifNull": ["$likes", []]}}}}],
+    )
+    return result.modified_count
+
+
+def split_comments(batch_size: int = BATCH_SIZE) -> int:
+    """Move embedded pin comments into the comments collection.
+
+    Idempotent: comments are upserted by id, and pins that already have a
+    comment_count are skipped.
+    """
+    moved = 0
+    cursor = db.pins.find(
+        {"comment_count": {"$exists": False}},
+        {"_id": 1, "id": 1, "comments": 1},
+        batch_size=batch_size,
+    )
+    for pin in cursor:
+        comments = sorted(pin.get("comments") or [], key=lambda c: c.get("created_at", ""))
+        ops = [
+            UpdateOne({"id": c["id"]}, {"$setOnInsert": {**c, "pin_id": pin["id"]}}, upsert=True)
+            for c in comments if c.get("id")
+        ]
+        if ops:
+            db.comments.bulk_write(ops, ordered=False)
+        db.pins.update_one(
+            {"_id": pin["_id"]},
+            {"$set": {"comment_count": len(comments), "comments": comments[-COMMENT_PREVIEW_SIZE:]}},
+        )
+        moved += len(comments)
+    return moved
+
+
+def expire_legacy_guests() -> int:
+    """Give guest users created before stateless guest sessions an expiry, so the purge job removes them.
+
+    They get one more session length, as their tokens may still be in use.
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=GUEST_SESSION_HOURS)
+    result = db.users.update_many(
+        {"is_guest": True, "expires_at": {"$exists": False}},
+        {"$set": {"expires_at": expires_at}},
+    )
+    return result.modified_count
+
+
+def build_conversations(batch_size: int = BATCH_SIZE) -> int:
+    """Rebuild the conversations collection (inbox and unread counts) from messages.
+
+    Messages are authoritative, so re-running is safe. Run it with the API
+    stopped, or re-run afterwards, since sends during the rebuild can be
+    overwritten.
+    """
+    pipeline = [
+        {"$sort": {"created_at": 1, "id": 1}},
+        {"$group": {
+            "_id": {"a": {"$min": ["$sender_id", "$recipient_id"]}, "b": {"$max": ["$sender_id", "$recipient_id"]}},
+            "last": {"$last": "$$ROOT"},
+            "unread_a": {"$sum": {"$cond": [
+                {"$and": [{"$ne": ["$read", True]}, {"$lt": ["$recipient_id", "$sender_id"]}]}, 1, 0
+            ]}},
+            "unread_b": {"$sum": {"$cond": [
+                {"$and": [{"$ne": ["$read", True]}, {"$gt": ["$recipient_id", "$sender_id"]}]}, 1, 0
+            ]}},
+        }},
+    ]
+    built = 0
+    ops = []
+    for group in db.messages.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+        a, b, last = group["_id"]["a"], group["_id"]["b"], group["last"]
+        usernames = {last["sender_id"]: last.get("sender_username"), last["recipient_id"]: last.get("recipient_username")}
+        ops.append(ReplaceOne({"id": conversation_id(a, b)}, {
+            "id": conversation_id(a, b),
+            "participants": [a, b],
+            "usernames": usernames,
+            "last_message": message_preview(last),
+            "updated_at": last["created_at"],
+            "unread": {a: group["unread_a"], b: group["unread_b"]},
+        }, upsert=True))
+        built += 1
+        if len(ops) >= batch_size:
+            _flush(db.conversations, ops)
+    _flush(db.conversations, ops)
+    return built
+
+
+def stamp_conversations(batch_size: int = BATCH_SIZE) -> int:
+    """Give messages sent before conversation-keyed storage their conversation_id."""
+    updated = 0
+    ops = []
+    cursor = db.messages.find(
+        {"conversation_id": None},
+        {"_id": 1, "sender_id": 1, "recipient_id": 1},
+        batch_size=batch_size,
+    )
+    for message in cursor:
+        ops.append(UpdateOne(
+            {"_id": message["_id"]},
+            {"$set": {"conversation_id": conversation_id(message["sender_id"], message["recipient_id"])}},
+        ))
+        if len(ops) >= batch_size:
+            updated += _flush(db.messages, ops)
+    updated += _flush(db.messages, ops)
+    return updated
+
+
+def ensure_indexes() -> int:
+    """Create every index in indexes.INDEXES; existing ones are left alone."""
+    failed = 0
+    for collection, model in index_models():
+        try:
+            name = db[collection].create_indexes([model])[0]
+            print(f"{collection}.{name}")
+        except PyMongoError as e:
+            # Typically duplicates blocking a unique index; fix the data and re-run
+            failed += 1
+            print(f"{collection}: {model.document['key']} failed: {e}")
+    if failed:
+        raise SystemExit(f"{failed} indexes could not be created")
+    return len(list(index_models()))
+
+
+def check_indexes() -> int:
+    """Explain each route's canonical query and fail if any winning plan is a COLLSCAN."""
+    scans = 0
+    for route, collection, query, sort in CANONICAL_QUERIES:
+        cursor = db[collection].find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = set(plan_stages(plan))
+        print(f"{route:<22} {collection:<15} {'COLLSCAN' if 'COLLSCAN' in stages else 'ok'}")
+        scans += "COLLSCAN" in stages
+    if scans:
+        raise SystemExit(f"{scans} queries scan a whole collection; run ensure-indexes")
+    return len(CANONICAL_QUERIES)
+
+
+COMMANDS = {
+    "backfill-pin-locations": backfill_pin_locations,
+    "backfill-event-locations": backfill_event_locations,
+    "backfill-username-lower": backfill_username_lower,
+    "backfill-derivatives": backfill_derivatives,
+    "backfill-like-counts": backfill_like_counts,
+    "split-comments": split_comments,
+    "expire-legacy-guests": expire_legacy_guests,
+    "build-conversations": build_conversations,
+    "stamp-conversations": stamp_conversations,
+    "ensure-indexes": ensure_indexes,
+    "check-indexes": check_indexes,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MapMoments maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--batch-size", type=int, help="documents per batch (command-specific default)")
+    args = parser.parse_args()
+
+    command = COMMANDS[args.command]
+    kwargs = {}
+    if args.batch_size:
+        if "batch_size" not in inspect.signature(command).parameters:
+            parser.error(f"{args.command} does not take --batch-size")
+        kwargs["batch_size"] = args.batch_size
+    result = command(**kwargs)
+    print(f"{args.command}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Message storage benchmark: one document per message vs bucketed.
+
+Writes the same synthetic conversations into a scratch database in both layouts,
+then compares index size, insert throughput, and latency of reading the newest
+and a deeper history page. Writes go one at a time, like send_message.
+
+    python message_benchmark.py --messages 200000 --conversations 500
+    python message_benchmark.py --mongo-url mongodb://localhost:27017 --bucket-size 100
+
+The scratch database (<DB_NAME>_benchmark) is dropped afterwards unless --keep.
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import MongoClient
+
+from indexes import index_models
+from message_buckets import PageCollector, bucket_append, bucket_query
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def synthetic_messages(count: int, conversations: int, seed: int = 1):
+    """Messages in send order, spread over conversations with a skew towards busy ones."""
+    rng = random.Random(seed)
+    pairs = [sorted((str(uuid.uuid4()), str(uuid.uuid4()))) for _ in range(conversations)]
+    weights = [1 / (i + 1) for i in range(conversations)]
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i, (a, b) in enumerate(rng.choices(pairs, weights, k=count)):
+        sender, recipient = (a, b) if rng.random() < 0.5 else (b, a)
+        yield {
+            "id": str(uuid.uuid4()),
+            "sender_id": sender,
+            "sender_username": f"user_{sender[:6]}",
+            "recipient_id": recipient,
+            "recipient_username": f"user_{recipient[:6]}",
+            "conversation_id": f"{a}:{b}",
+            "content": "x" * rng.randint(10, 200),
+            "read": False,
+            "created_at": (start + timedelta(milliseconds=i * 250)).isoformat(),
+        }
+
+
+def create_indexes(db, collection: str) -> None:
+    for name, model in index_models():
+        if name == collection:
+            db[collection].create_indexes([model])
+
+
+def index_size(db, collection: str) -> int:
+    return db.command("collStats", collection)["totalIndexSize"]
+
+
+def read_documents(db, conversation: str, limit: int, before=None):
+    query = {"conversation_id": conversation}
+    if before:
+        value, last_id = before
+        query["$or"] = [{"created_at": {"$lt": value}}, {"created_at": value, "id": {"$lt": last_id}}]
+    return list(db.messages.find(query, {"_id": 0}).sort([("created_at", -1), ("id", -1)]).limit(limit))
+
+
+def read_buckets(db, conversation: str, limit: int, before=None):
+    collector = PageCollector(limit, before)
+    for bucket in db.message_buckets.find(bucket_query(conversation, before), {"_id": 0}).sort("end", -1):
+        if collector.add(bucket):
+            break
+    return collector.page()
+
+
+def run_layout(db, layout: str, messages, bucket_size: int, page: int, reads: int, busy: list) -> dict:
+    collection = "messages" if layout == "documents" else "message_buckets"
+    db.drop_collection(collection)
+    create_indexes(db, collection)
+
+    started = time.perf_counter()
+    for message in messages:
+        if layout == "documents":
+            db.messages.insert_one(dict(message))
+        else:
+            query, update = bucket_append(message, bucket_size)
+            db.message_buckets.update_one(query, update, upsert=True)
+    elapsed = time.perf_counter() - started
+
+    read = read_documents if layout == "documents" else read_buckets
+    rng = random.Random(2)
+    newest, deeper = [], []
+    for _ in range(reads):
+        conversation = rng.choice(busy)
+        t = time.perf_counter()
+        first = read(db, conversation, page)
+        newest.append((time.perf_counter() - t) * 1000)
+        if len(first) == page:
+            last = first[-1]
+            t = time.perf_counter()
+            read(db, conversation, page, (last["created_at"], last["id"]))
+            deeper.append((time.perf_counter() - t) * 1000)
+
+    return {
+        "layout": layout,
+        "documents": db[collection].estimated_document_count(),
+        "index_bytes": index_size(db, collection),
+        "inserts_per_s": len(messages) / elapsed,
+        "newest_ms": newest,
+        "deeper_ms": deeper,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="defaults to MONGO_URL via db.py")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--conversations", type=int, default=500)
+    parser.add_argument("--bucket-size", type=int, default=200)
+    parser.add_argument("--page", type=int, default=50)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database")
+    args = parser.parse_args()
+
+    if args.mongo_url:
+        client, db_name = MongoClient(args.mongo_url), "mapmoments"
+    else:
+        from db import DB_NAME, client
+        db_name = DB_NAME
+    db = client[f"{db_name}_benchmark"]
+
+    messages = list(synthetic_messages(args.messages, args.conversations))
+    # Page reads target the 20 busiest conversations, where history is long
+    counts = {}
+    for message in messages:
+        counts[message["conversation_id"]] = counts.get(message["conversation_id"], 0) + 1
+    busy = sorted(counts, key=counts.get, reverse=True)[:20]
+
+    try:
+        results = [
+            run_layout(db, layout, messages, args.bucket_size, args.page, args.reads, busy)
+            for layout in ("documents", "buckets")
+        ]
+    finally:
+        if not args.keep:
+            client.drop_database(db.name)
+
+    print(f"{args.messages} messages in {args.conversations} conversations, "
+          f"bucket size {args.bucket_size}, page {args.page}")
+    for r in results:
+        r["deeper_ms"] = r["deeper_ms"] or [float("nan")]  # no conversation longer than one page
+        print(f"{r['layout']:<10} {r['documents']:>8} docs  index {r['index_bytes'] / 1e6:7.1f} MB  "
+              f"{r['inserts_per_s']:7.0f} inserts/s  "
+              f"newest page p50 {statistics.median(r['newest_ms']):.2f} p99 {percentile(r['newest_ms'], 99):.2f} ms  "
+              f"older page p50 {statistics.median(r['deeper_ms']):.2f} p99 {percentile(r['deeper_ms'], 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
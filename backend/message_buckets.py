@@ -0,0 +1,68 @@
+"""Bucket-pattern storage for messages (MESSAGE_STORAGE=buckets).
+
+Each conversation's messages are packed into `message_buckets` documents of up
+to a fixed number of messages:
+
+    {"conversation_id", "count", "start", "end", "messages": [...]}
+
+A send appends to the conversation's open bucket with $push and $inc on count.
+Once a bucket is full the filter no longer matches it, and the upsert opens the
+next one. Indexes then hold one entry per bucket rather than one per message.
+
+History reads fetch whole buckets, newest ending first, until no remaining
+bucket can hold a message newer than the page already collected. Buckets of
+one conversation overlap in time only when concurrent sends open two at once.
+
+Kept free of app state so server.py and message_benchmark.py share it.
+"""
+import heapq
+from typing import List, Optional, Tuple
+
+
+def bucket_append(message: dict, bucket_size: int) -> Tuple[dict, dict]:
+    """(filter, update) for an upserting update_one that stores message."""
+    return (
+        {"conversation_id": message["conversation_id"], "count": {"$lt": bucket_size}},
+        {
+            "$push": {"messages": message},
+            "$inc": {"count": 1},
+            "$min": {"start": message["created_at"]},
+            "$max": {"end": message["created_at"]},
+        },
+    )
+
+
+def bucket_query(conversation_id: str, before: Optional[Tuple[str, str]] = None) -> dict:
+    """Buckets that can hold messages of a history page; read them sorted by end descending."""
+    query = {"conversation_id": conversation_id}
+    if before:
+        query["start"] = {"$lte": before[0]}
+    return query
+
+
+class PageCollector:
+    """The newest `size` messages older than `before`, from buckets fed newest-ending first."""
+
+    def __init__(self, size: int, before: Optional[Tuple[str, str]] = None):
+        self.size = size
+        self.before = tuple(before) if before else None
+        self._heap: List[tuple] = []  # (created_at, id, message), oldest at the top
+
+    def add(self, bucket: dict) -> bool:
+        """Take a bucket's messages; True once this and later buckets cannot change the page."""
+        heap = self._heap
+        if len(heap) >= self.size and bucket["end"] < heap[0][0]:
+            return True
+        for message in bucket["messages"]:
+            key = (message["created_at"], message["id"])
+            if self.before and key >= self.before:
+                continue
+            if len(heap) < self.size:
+                heapq.heappush(heap, (*key, message))
+            elif key > heap[0][:2]:
+                heapq.heapreplace(heap, (*key, message))
+        return False
+
+    def page(self) -> List[dict]:
+        """Collected messages, newest first."""
+        return [message for *_, message in sorted(self._heap, key=lambda item: item[:2], reverse=True)]
@@ -0,0 +1,136 @@
+"""In-process pub/sub for the /api/ws WebSocket channel.
+
+Hub fans events out to each user's live connections. Every connection has a
+bounded send queue. A client that falls a whole queue behind is marked
+overflowed and disconnected instead of being buffered without limit. It then
+reconnects with its `since` cursor and catches up from the database.
+
+Publishing goes through a broker so events reach connections held by other
+workers. LocalBroker hands events straight back to this process's hub, which
+is all a single worker needs. MongoBroker relays them through a capped
+collection that every worker tails.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, Set
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    def __init__(self, user_id: str, queue_size: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.overflowed = asyncio.Event()
+
+    def offer(self, event: dict) -> bool:
+        """Queue an event; False (and overflowed) if the client is a whole queue behind."""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed.set()
+            return False
+
+
+class LocalBroker:
+    """Delivers within this process only; the stand-in for a cross-worker backend."""
+
+    def __init__(self):
+        self.deliver = None  # set by Hub
+
+    async def publish(self, user_ids: Iterable[str], event: dict) -> None:
+        for user_id in user_ids:
+            self.deliver(user_id, event)
+
+    async def run(self) -> None:
+        pass  # nothing to listen to
+
+
+class MongoBroker:
+    """Relays events between workers through a capped collection that each worker tails.
+
+    Tailable cursors work on a standalone mongod, unlike change streams. The
+    publishing worker also receives its own events from the tail, so nothing is
+    delivered twice.
+    """
+
+    def __init__(self, db, name: str = "realtime_events", size_bytes: int = 16 * 1024 * 1024):
+        self.db = db
+        self.name = name
+        self.size_bytes = size_bytes
+        self.deliver = None  # set by Hub
+        self._created = False
+
+    async def _collection(self):
+        if not self._created:
+            try:
+                await self.db.create_collection(self.name, capped=True, size=self.size_bytes)
+            except CollectionInvalid:
+                pass  # already exists
+            self._created = True
+        return self.db[self.name]
+
+    async def publish(self, user_ids: Iterable[str], event: dict) -> None:
+        events = await self._collection()
+        await events.insert_one({"user_ids": list(user_ids), "event": event})
+
+    async def run(self) -> None:
+        events = await self._collection()
+        newest = await events.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+        last_id = newest["_id"] if newest else None
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            try:
+                cursor = events.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for doc in cursor:
+                    last_id = doc["_id"]
+                    for user_id in doc["user_ids"]:
+                        self.deliver(user_id, doc["event"])
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.warning(f"Realtime event tail interrupted, resuming: {e}")
+            # An empty capped collection ends the tail immediately; wait before retrying
+            await asyncio.sleep(1)
+
+
+class Hub:
+    def __init__(self, broker=None):
+        self.broker = broker or LocalBroker()
+        self.broker.deliver = self.deliver
+        self._connections: Dict[str, Set[Connection]] = {}
+        self.stats = {"connections": 0, "delivered": 0, "overflowed": 0}
+
+    def connect(self, user_id: str, queue_size: int) -> Connection:
+        connection = Connection(user_id, queue_size)
+        self._connections.setdefault(user_id, set()).add(connection)
+        self.stats["connections"] += 1
+        return connection
+
+    def disconnect(self, connection: Connection) -> None:
+        connections = self._connections.get(connection.user_id)
+        if connections and connection in connections:
+            connections.discard(connection)
+            self.stats["connections"] -= 1
+            if not connections:
+                del self._connections[connection.user_id]
+
+    def deliver(self, user_id: str, event: dict) -> None:
+        """Queue an event on this process's connections for user_id."""
+        for connection in list(self._connections.get(user_id, ())):
+            if connection.overflowed.is_set():
+                continue  # being disconnected
+            if connection.offer(event):
+                self.stats["delivered"] += 1
+            else:
+                self.stats["overflowed"] += 1
+
+    async def publish(self, user_ids: Iterable[str], event: dict) -> None:
+        await self.broker.publish(user_ids, event)
+
+    async def run(self) -> None:
+        await self.broker.run()
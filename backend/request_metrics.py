@@ -0,0 +1,72 @@
+"""Per-request MongoDB command metrics.
+
+CommandMetrics is a pymongo CommandListener registered on the server's client.
+It attributes every command to the request that issued it through a
+ContextVar. Motor runs driver calls on its thread pool inside a copy of the
+caller's context, so the listener sees the request's RequestStats from those
+threads. Commands outside a request (background loops, the CLI) are ignored.
+
+server.py's middleware starts a RequestStats for each request and reports it
+in Server-Timing and the access log.
+
+Reply sizes are only measured with reply_bytes=True. The driver hands listeners
+the decoded reply, so measuring means re-encoding every reply to BSON on the
+request path; leave it off outside of investigations.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+import bson
+from pymongo import monitoring
+
+
+class RequestStats:
+    __slots__ = ("started", "commands", "db_ms", "bytes_returned", "_lock")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.db_ms = 0.0
+        self.bytes_returned: Optional[int] = None  # None unless reply sizes are measured
+        self._lock = threading.Lock()  # listener callbacks run on motor's pool threads
+
+    def record(self, duration_micros: int, reply_bytes: Optional[int] = None) -> None:
+        with self._lock:
+            self.commands += 1
+            self.db_ms += duration_micros / 1000
+            if reply_bytes is not None:
+                self.bytes_returned = (self.bytes_returned or 0) + reply_bytes
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        desc = f"{self.commands} commands"
+        if self.bytes_returned is not None:
+            desc += f", {self.bytes_returned} bytes"
+        return f'db;dur={self.db_ms:.1f};desc="{desc}", app;dur={self.elapsed_ms():.1f}'
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self, reply_bytes: bool = False):
+        self.reply_bytes = reply_bytes
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        stats = current_request.get()
+        if stats is not None:
+            # Re-encoding the decoded reply gives its wire size, at the cost of a full encode
+            size = len(bson.encode(event.reply)) if self.reply_bytes else None
+            stats.record(event.duration_micros, size)
+
+    def failed(self, event) -> None:
+        stats = current_request.get()
+        if stats is not None:
+            stats.record(event.duration_micros, 0 if self.reply_bytes else None)
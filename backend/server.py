@@ -1,5 +1,6 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, File, UploadFile, Form, status, Response, Request
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, File, UploadFile, Form, Query, status, Response, Request, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
@@ -14,8 +15,42 @@ from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 from bson import ObjectId
+import asyncio
 import base64
-from pymongo.errors import PyMongoError
+import hashlib
+import hmac
+import json
+import math
+import multiprocessing
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+from imaging import render_derivatives
+from spatial_index import SpatialIndex
+from clustering import Supercluster
+from vector_tiles import MVT_CONTENT_TYPE, DiskTileCache, encode_tile, point_features, tile_bounds, tiles_for_point
+from indexes import EVENT_TEXT_WEIGHTS, PIN_TEXT_WEIGHTS, index_models
+from text_search import InvertedIndex, words
+from fuzzy_index import FuzzyIndex
+from suggest_index import SuggestIndex, normalize
+from realtime import Hub, LocalBroker, MongoBroker
+from message_buckets import PageCollector, bucket_append, bucket_query
+from request_metrics import CommandMetrics, RequestStats, current_request
+from common import (
+    COMMENT_PREVIEW_SIZE,
+    DERIVATIVE_FORMAT,
+    DERIVATIVE_QUALITY,
+    DERIVATIVE_SIZES,
+    DERIVATIVE_WORKERS,
+    GUEST_SESSION_HOURS,
+    conversation_id,
+    geo_point,
+    message_preview,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -77,10 +112,14 @@ if not mongo_url:
 # Intentionally redacts credentials to avoid leaking secrets to logs.
 print("MONGO_URL =", _redact_mongo_url(mongo_url))
 
+# Re-encodes every reply to report bytes per request; costly, so off by default
+DB_REPLY_BYTES = os.environ.get("DB_REPLY_BYTES", "false").lower() in ("1", "true", "yes")
+
 client = AsyncIOMotorClient(
     mongo_url,
     serverSelectionTimeoutMS=20000,
-    tls=True
+    tls=True,
+    event_listeners=[CommandMetrics(reply_bytes=DB_REPLY_BYTES)]  # per-request DB metrics, see request_metrics.py
 )
 
 # Allow specifying the database name either via DB_NAME or in the Mongo URI path.
@@ -103,9 +142,145 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production'
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 168  # 7 days
 
+# Upload limits (bytes). Uploads are copied into GridFS in UPLOAD_CHUNK_SIZE pieces.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 255 * 1024))  # GridFS default chunk size
+MAX_UPLOAD_BYTES = {
+    "photo": int(os.environ.get("MAX_PHOTO_UPLOAD_BYTES", 20 * 1024 * 1024)),
+    "video": int(os.environ.get("MAX_VIDEO_UPLOAD_BYTES", 200 * 1024 * 1024)),
+    "avatar": int(os.environ.get("MAX_AVATAR_UPLOAD_BYTES", 5 * 1024 * 1024)),
+}
+
+# Optional in-process spatial index of public pins (see spatial_index.py)
+SPATIAL_INDEX_ENABLED = os.environ.get("SPATIAL_INDEX_ENABLED", "false").lower() in ("1", "true", "yes")
+SPATIAL_INDEX_CELL_DEG = float(os.environ.get("SPATIAL_INDEX_CELL_DEG", 0.1))
+
+# Cluster indexes are cached per privacy scope. Per-user scopes are rebuilt after
+# non-public pin writes or TTL; the shared public index is rebuilt in the
+# background every CLUSTER_PUBLIC_REFRESH seconds, and local public writes are
+# overlaid on it until then
+CLUSTER_CACHE_TTL = int(os.environ.get("CLUSTER_CACHE_TTL", 60))  # seconds
+CLUSTER_CACHE_SIZE = int(os.environ.get("CLUSTER_CACHE_SIZE", 256))  # scopes
+CLUSTER_PUBLIC_REFRESH = int(os.environ.get("CLUSTER_PUBLIC_REFRESH", 300))  # seconds
+CLUSTER_MIN_REBUILD_SECONDS = 5
+CLUSTER_OVERLAY_MAX = 1000  # public writes that trigger an early rebuild
+CLUSTER_MAX_ITEMS = int(os.environ.get("CLUSTER_MAX_ITEMS", 2000))  # clusters + pins per response
+
+# Vector tiles for public pins and events
+TILE_CACHE_DIR = os.environ.get("TILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mapmoments-tiles"))
+TILE_CACHE_MAX_BYTES = int(os.environ.get("TILE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+TILE_CACHE_MAX_AGE = int(os.environ.get("TILE_CACHE_MAX_AGE", 3600))  # seconds
+TILE_FEATURE_LIMIT = int(os.environ.get("TILE_FEATURE_LIMIT", 2000))  # per layer
+TILE_CACHE_MAX_ZOOM = 16  # deeper tiles are rendered on demand but not cached
+TILE_SIMPLIFY_BELOW_ZOOM = 10  # below this, nearby points are collapsed
+
+# Trending: engagement decayed by age, recomputed in the background
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", 24))
+TRENDING_REFRESH_SECONDS = int(os.environ.get("TRENDING_REFRESH_SECONDS", 60))
+TRENDING_PERSIST = os.environ.get("TRENDING_PERSIST", "false").lower() in ("1", "true", "yes")
+TRENDING_COMMENT_WEIGHT = 2.0
+TRENDING_HORIZON_HALF_LIVES = 10  # older pins keep under 1/1000 of their engagement
+TRENDING_SIZE = 50
+TRENDING_WINDOWS = {"24h": timedelta(hours=24), "7d": timedelta(days=7), "all": None}
+
+# bcrypt runs on a bounded thread pool (it releases the GIL); once this many
+# hashes are queued or running, auth requests get 503 with Retry-After
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", min(4, os.cpu_count() or 1)))
+BCRYPT_MAX_PENDING = int(os.environ.get("BCRYPT_MAX_PENDING", 64))
+BCRYPT_RETRY_AFTER = 2  # seconds
+
+# Search uses MongoDB $text indexes; "memory" (or a failed $text query) switches
+# to in-process inverted indexes, rebuilt in the background from the database
+# once they are SEARCH_INDEX_TTL old
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "text").lower()  # text or memory
+SEARCH_INDEX_TTL = int(os.environ.get("SEARCH_INDEX_TTL", 300))  # seconds
+
+# Autocomplete indexes are rebuilt from the database on this interval and kept
+# current with local writes in between
+SUGGEST_REFRESH_SECONDS = int(os.environ.get("SUGGEST_REFRESH_SECONDS", 600))
+
+# Guests live only in their JWT until their first write; expired guests and
+# everything they created are purged periodically
+GUEST_PURGE_INTERVAL = int(os.environ.get("GUEST_PURGE_INTERVAL", 3600))  # seconds
+GUEST_PURGE_BATCH = 100
+
+# Authenticated user records cached in-process; writes invalidate explicitly and
+# the users change stream (when the deployment has one) covers other workers
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 30))  # seconds
+USER_CACHE_WATCH = os.environ.get("USER_CACHE_WATCH", "true").lower() in ("1", "true", "yes")
+
+# /api/ws pushes new messages. "mongo" relays them between workers through a
+# capped collection; "local" is enough when a single worker serves the API
+REALTIME_BROKER = os.environ.get("REALTIME_BROKER", "local").lower()  # local or mongo
+WS_QUEUE_SIZE = int(os.environ.get("WS_QUEUE_SIZE", 256))  # events buffered per connection
+WS_HEARTBEAT_SECONDS = int(os.environ.get("WS_HEARTBEAT_SECONDS", 25))
+WS_IDLE_TIMEOUT = int(os.environ.get("WS_IDLE_TIMEOUT", 60))  # seconds without any client frame
+WS_CATCHUP_PAGE = 500
+WS_AUTH_TIMEOUT = 10  # seconds to send the auth frame when there is no cookie
+
+# "buckets" packs each conversation's messages into documents of up to
+# MESSAGE_BUCKET_SIZE (see message_buckets.py); "documents" stores one per message.
+# Pick one when deploying: existing messages are not moved between layouts
+MESSAGE_STORAGE = os.environ.get("MESSAGE_STORAGE", "documents").lower()  # documents or buckets
+MESSAGE_BUCKET_SIZE = int(os.environ.get("MESSAGE_BUCKET_SIZE", 200))
+
+# Every response carries MongoDB command count and time in Server-Timing; requests
+# over either budget log a warning, and ACCESS_LOG adds one JSON line per request
+ACCESS_LOG = os.environ.get("ACCESS_LOG", "true").lower() in ("1", "true", "yes")
+DB_QUERY_BUDGET = int(os.environ.get("DB_QUERY_BUDGET", 50))  # commands per request
+DB_TIME_BUDGET_MS = float(os.environ.get("DB_TIME_BUDGET_MS", 250))
+
+# Starlette spools a multipart body to a temp file before the route runs, so the
+# cap in stream_upload_to_gridfs alone comes too late to bound disk use. Upload
+# routes are capped on the raw body too: on Content-Length up front, then by
+# counting bytes as they arrive. The allowance covers boundaries and form fields.
+UPLOAD_BODY_OVERHEAD = 64 * 1024
+UPLOAD_ROUTES = [
+    (re.compile(r"^/api/pins/[^/]+/media$"), max(MAX_UPLOAD_BYTES["photo"], MAX_UPLOAD_BYTES["video"])),
+    (re.compile(r"^/api/users/profile-picture$"), MAX_UPLOAD_BYTES["avatar"]),
+]
+
+class UploadLimitMiddleware:
+    """Reject upload bodies over their route's cap while they are received, not after."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = None
+        if scope["type"] == "http" and scope["method"] == "POST":
+            max_bytes = next((cap for pattern, cap in UPLOAD_ROUTES if pattern.match(scope["path"])), None)
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+        limit = max_bytes + UPLOAD_BODY_OVERHEAD
+        detail = f"File too large (max {max_bytes} bytes)"
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside form parsing; FastAPI re-raises HTTPException as is
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
 # Create the main app
 app = FastAPI()
 
+# Added before CORS so CORS stays outermost and its headers reach 413 responses
+app.add_middleware(UploadLimitMiddleware)
+
 # CORS must come BEFORE router - use FRONTEND_ORIGINS from env
 # Use allow_origin_regex to support Vercel preview URLs (*.vercel.app)
 app.add_middleware(
@@ -115,6 +290,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Search-Match", "Server-Timing"],
 )
 
 # Log active CORS origins for visibility in deployment logs
@@ -124,6 +300,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 logger.info(f"CORS allow_origins: {FRONTEND_ORIGINS}")
+access_logger = logging.getLogger("mapmoments.access")
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    """Count this request's MongoDB commands, DB time and reply bytes, and report them.
+
+    Streamed bodies (GridFS media) are read after the headers go out, so their
+    chunk reads are not included.
+    """
+    stats = RequestStats()
+    token = current_request.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        current_request.reset(token)
+    response.headers["Server-Timing"] = stats.server_timing()
+
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    if stats.commands > DB_QUERY_BUDGET or stats.db_ms > DB_TIME_BUDGET_MS:
+        logger.warning(
+            f"{request.method} {route} over DB budget: {stats.commands} commands "
+            f"(budget {DB_QUERY_BUDGET}), {stats.db_ms:.1f} ms (budget {DB_TIME_BUDGET_MS:g} ms)"
+        )
+    if ACCESS_LOG:
+        access_logger.info(json.dumps({
+            "method": request.method,
+            "route": route,
+            "path": request.url.path,
+            "status": response.status_code,
+            "ms": round(stats.elapsed_ms(), 1),
+            "db_commands": stats.commands,
+            "db_ms": round(stats.db_ms, 1),
+            **({"db_bytes": stats.bytes_returned} if stats.bytes_returned is not None else {}),
+        }))
+    return response
 
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
@@ -146,6 +357,28 @@ async def db_health():
             detail = detail.replace(mongo_url, _redact_mongo_url(mongo_url))
         return {"db": "error", "detail": detail}
 
+
+@app.get("/api/health/cache")
+async def cache_health():
+    lookups = user_cache_stats["hits"] + user_cache_stats["misses"]
+    return {
+        "users": {
+            **user_cache_stats,
+            "size": len(_user_cache),
+            "max_size": USER_CACHE_SIZE,
+            "hit_ratio": round(user_cache_stats["hits"] / lookups, 4) if lookups else None,
+        },
+        "suggest": {
+            "ready": _suggest_state["ready"],
+            "keys": {kind: len(index) for kind, index in suggest_indexes.items()},
+            "memory_bytes": _suggest_state["memory_bytes"],
+        },
+    }
+
+@app.get("/api/health/realtime")
+async def realtime_health():
+    return {"broker": REALTIME_BROKER, **hub.stats}
+
 # Rely on CORSMiddleware to handle OPTIONS automatically for preflight requests
 
 # ===== Models =====
@@ -179,8 +412,11 @@ class Pin(BaseModel):
     longitude: float
     privacy: str = "public"  # public, friends, private
     likes: List[str] = Field(default_factory=list)  # user IDs who liked
-    comments: List[dict] = Field(default_factory=list)
+    like_count: int = 0  # denormalized len(likes), recomputed by every like_pin update
+    comments: List[dict] = Field(default_factory=list)  # latest COMMENT_PREVIEW_SIZE only; full history in `comments` collection
+    comment_count: int = 0
     media_count: int = 0
+    location: Optional[dict] = None  # GeoJSON Point mirroring latitude/longitude (2dsphere indexed)
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class PinCreate(BaseModel):
@@ -200,7 +436,10 @@ class Media(BaseModel):
     user_id: str
     file_id: str  # GridFS file ID
     media_type: str  # photo or video
+    content_type: Optional[str] = None
+    size: Optional[int] = None  # bytes
     caption: Optional[str] = None
+    derivatives: dict = Field(default_factory=dict)  # variant -> {file_id, content_type, width, height, size}
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
 class Event(BaseModel):
@@ -214,6 +453,7 @@ class Event(BaseModel):
     latitude: float
     longitude: float
     location_name: str
+    location: Optional[dict] = None  # GeoJSON Point mirroring latitude/longitude (2dsphere indexed)
     attendees: List[str] = Field(default_factory=list)  # user IDs
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
@@ -237,10 +477,474 @@ class Message(BaseModel):
     sender_username: str
     recipient_id: str
     recipient_username: str
+    conversation_id: Optional[str] = None  # sorted sender:recipient pair; see conversation_id()
     content: str
     read: bool = False
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
+# ===== Geo Helpers =====
+# 2dsphere polygon edges are great-circle arcs, so a box's east-west edges bow
+# toward the pole between vertices. Edges get a vertex every degree (the sag
+# is then under 0.002 degrees), the box is padded by more than that, and the
+# exact latitude/longitude ranges are applied alongside.
+BBOX_EDGE_STEP = 1.0  # degrees of longitude between polygon vertices
+BBOX_PAD = 0.01  # degrees of latitude
+
+def _box_polygon(min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> dict:
+    south = max(-90.0, min_lat - BBOX_PAD)
+    north = min(90.0, max_lat + BBOX_PAD)
+    steps = max(1, math.ceil((max_lng - min_lng) / BBOX_EDGE_STEP))
+    lngs = [min_lng + (max_lng - min_lng) * i / steps for i in range(steps + 1)]
+    ring = [[lng, south] for lng in lngs] + [[lng, north] for lng in reversed(lngs)]
+    ring.append(ring[0])
+    return {"type": "Polygon", "coordinates": [ring]}
+
+def bbox_filter(min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> dict:
+    """$geoWithin filter on `location` for a map viewport.
+
+    A viewport that crosses the antimeridian arrives with min_lng > max_lng and is
+    split in two. Wide boxes are cut into <= 90 degree slices because 2dsphere
+    polygons must not span a hemisphere. The geo index selects candidates from a
+    slightly padded polygon; the latitude/longitude ranges make the box exact.
+    """
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat must not exceed max_lat")
+    if min_lng > max_lng:
+        ranges = [(min_lng, 180.0), (-180.0, max_lng)]
+    else:
+        ranges = [(min_lng, max_lng)]
+
+    slices = []
+    for start, end in ranges:
+        while start < end:
+            stop = min(start + 90.0, end)
+            slices.append((start, stop))
+            start = stop
+    if not slices or min_lat == max_lat:
+        # Degenerate box: nothing can be inside it
+        return {"location": {"$in": []}}
+
+    clauses = [
+        {
+            "location": {"$geoWithin": {"$geometry": _box_polygon(min_lat, start, max_lat, stop)}},
+            "latitude": {"$gte": min_lat, "$lte": max_lat},
+            "longitude": {"$gte": start, "$lte": stop},
+        }
+        for start, stop in slices
+    ]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+# ===== Media Helpers =====
+def _media_signature(media_id: str) -> str:
+    return hmac.new(JWT_SECRET.encode('utf-8'), f"media:{media_id}".encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+def media_url(media_id: str, variant: Optional[str] = None) -> str:
+    # Signed so <img>/<video> tags can load it without an Authorization header
+    url = f"/api/media/{media_id}/raw?sig={_media_signature(media_id)}"
+    return f"{url}&variant={variant}" if variant else url
+
+def media_file_ids(media: dict) -> List[ObjectId]:
+    """GridFS ids of the original file and every derivative of a media document."""
+    ids = [media.get('file_id')] + [d.get('file_id') for d in (media.get('derivatives') or {}).values()]
+    return [ObjectId(i) for i in ids if i and ObjectId.is_valid(i)]
+
+def verify_media_signature(media_id: str, sig: str) -> bool:
+    return hmac.compare_digest(_media_signature(media_id), sig or "")
+
+async def find_media_for_pins(pin_ids: List[str]) -> dict:
+    """Media documents for many pins in one query, grouped by pin id."""
+    grouped = {pin_id: [] for pin_id in pin_ids}
+    if not pin_ids:
+        return grouped
+    media_items = await db.media.find({"pin_id": {"$in": pin_ids}}).sort("created_at", 1).to_list(None)
+    for media in media_items:
+        media.pop('_id', None)
+        grouped[media['pin_id']].append(media)
+    return grouped
+
+async def media_descriptors(media_items: List[dict]) -> List[dict]:
+    """Lightweight references to media; the bytes are served by GET /api/media/{id}/raw."""
+    # Older media documents predate content_type/size, so read those from GridFS in one batch
+    missing = []
+    for m in media_items:
+        if (m.get('content_type') is None or m.get('size') is None) and ObjectId.is_valid(m.get('file_id', '')):
+            missing.append(ObjectId(m['file_id']))
+    files = {}
+    if missing:
+        async for f in db["fs.files"].find({"_id": {"$in": missing}}, {"length": 1, "metadata": 1}):
+            files[str(f['_id'])] = f
+
+    descriptors = []
+    for m in media_items:
+        grid_file = files.get(m.get('file_id'), {})
+        variants = {name: media_url(m['id'], name) for name in (m.get('derivatives') or {})}
+        descriptors.append({
+            "id": m['id'],
+            "pin_id": m.get('pin_id'),
+            "media_type": m.get('media_type'),
+            "content_type": m.get('content_type') or (grid_file.get('metadata') or {}).get('content_type', 'image/jpeg'),
+            "size": m['size'] if m.get('size') is not None else grid_file.get('length'),
+            "caption": m.get('caption'),
+            "url": media_url(m['id']),
+            # Lists should render the thumbnail; falls back to the original until it exists
+            "thumb_url": variants.get("thumb") or media_url(m['id']),
+            "variants": variants,
+        })
+    return descriptors
+
+# ===== Photo Derivatives =====
+# Pillow decoding runs in a small process pool so it never blocks the event loop.
+_derivative_pool: Optional[ProcessPoolExecutor] = None
+_derivative_slots = asyncio.Semaphore(DERIVATIVE_WORKERS * 2)  # bounds originals held in memory
+_background_tasks = set()
+
+def get_derivative_pool() -> ProcessPoolExecutor:
+    global _derivative_pool
+    if _derivative_pool is None:
+        # spawn: workers import only imaging.py, not this module and its clients
+        _derivative_pool = ProcessPoolExecutor(
+            max_workers=DERIVATIVE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _derivative_pool
+
+async def generate_derivatives(media_id: str, file_id: str) -> None:
+    async with _derivative_slots:
+        try:
+            grid_out = await fs.open_download_stream(ObjectId(file_id))
+            original = await grid_out.read()  # type: ignore[misc]
+            rendered = await asyncio.get_running_loop().run_in_executor(
+                get_derivative_pool(),
+                render_derivatives,
+                original,
+                DERIVATIVE_SIZES,
+                DERIVATIVE_FORMAT,
+                DERIVATIVE_QUALITY,
+            )
+        except Exception as e:
+            logging.error(f"Error rendering derivatives for media {media_id}: {e}")
+            return
+
+    derivatives = {}
+    try:
+        for name, out in rendered.items():
+            derivative_id = await fs.upload_from_stream(
+                f"{file_id}_{name}",
+                out["data"],
+                metadata={"content_type": out["content_type"], "derivative_of": file_id, "variant": name}
+            )
+            derivatives[name] = {
+                "file_id": str(derivative_id),
+                "content_type": out["content_type"],
+                "width": out["width"],
+                "height": out["height"],
+                "size": len(out["data"]),
+            }
+        result = await db.media.update_one({"id": media_id}, {"$set": {"derivatives": derivatives}})
+    except Exception as e:
+        logging.error(f"Error storing derivatives for media {media_id}: {e}")
+        result = None
+    if result is None or result.matched_count == 0:
+        # Media was deleted meanwhile (or the write failed): drop the orphans
+        for d in derivatives.values():
+            try:
+                await fs.delete(ObjectId(d["file_id"]))
+            except Exception:
+                pass
+
+def schedule_derivatives(media_id: str, file_id: str) -> None:
+    task = asyncio.create_task(generate_derivatives(media_id, file_id))
+    # Keep a reference so the task isn't garbage collected mid-flight
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+# ===== GridFS Streaming =====
+# GridFS files are immutable, so a file id (plus md5/length) is a strong validator
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def grid_etag(grid_out) -> str:
+    md5 = getattr(grid_out, "md5", None)
+    return f'"{grid_out._id}-{md5 or grid_out.length}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def parse_byte_range(range_header: Optional[str], length: int) -> Optional[tuple]:
+    """Inclusive (start, end) for a single `bytes=` range, or None to serve the whole file.
+
+    Multi-range and malformed headers are ignored as RFC 9110 allows; ranges that
+    start past the end raise 416.
+    """
+    if not range_header or not range_header.startswith("bytes=") or length == 0:
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+    start_s, sep, end_s = spec.partition("-")
+    # Positions are plain digits; int() alone would also take "-1", "+1" and " 1"
+    if not sep or not (start_s or end_s) or not all(p.isdigit() for p in (start_s, end_s) if p):
+        return None
+    if start_s == "":
+        suffix = int(end_s)
+        if suffix == 0:
+            raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{length}"})
+        return max(length - suffix, 0), length - 1
+    start = int(start_s)
+    end = int(end_s) if end_s else None
+    if end is not None and end < start:
+        return None
+    if start >= length:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{length}"})
+    return start, length - 1 if end is None else min(end, length - 1)
+
+async def _iter_grid_out(grid_out, start: int, count: int):
+    # Streams chunk by chunk so a file is never held in memory whole
+    grid_out.seek(start)
+    remaining = count
+    try:
+        while remaining > 0:
+            chunk = await grid_out.read(min(grid_out.chunk_size, remaining))  # type: ignore[misc]
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        grid_out.close()
+
+async def stream_grid_file(
+    request: Request,
+    file_id: str,
+    content_type: Optional[str] = None,
+    cache_control: str = IMMUTABLE_CACHE_CONTROL,
+) -> Response:
+    """Serve a GridFS file with Range, ETag/If-None-Match and Cache-Control support."""
+    try:
+        grid_out = await fs.open_download_stream(ObjectId(file_id))
+    except Exception as e:
+        logging.error(f"Error opening GridFS file {file_id}: {e}")
+        raise HTTPException(status_code=404, detail="Media file not found")
+
+    length = grid_out.length
+    etag = grid_etag(grid_out)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    content_type = content_type or (grid_out.metadata or {}).get("content_type", "application/octet-stream")
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        grid_out.close()
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range.strip() == etag:
+        try:
+            byte_range = parse_byte_range(request.headers.get("range"), length)
+        except HTTPException:
+            grid_out.close()
+            raise
+
+    status_code = 200
+    start, count = 0, length
+    if byte_range:
+        start, end = byte_range
+        count = end - start + 1
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(count)
+
+    if request.method == "HEAD":
+        grid_out.close()
+        return Response(status_code=status_code, headers=headers, media_type=content_type)
+    return StreamingResponse(
+        _iter_grid_out(grid_out, start, count),
+        status_code=status_code,
+        headers=headers,
+        media_type=content_type,
+    )
+
+async def stream_upload_to_gridfs(
+    file: UploadFile,
+    filename: str,
+    content_type: str,
+    max_bytes: int,
+    request: Optional[Request] = None,
+) -> tuple:
+    """Copy an upload into GridFS chunk by chunk and return (file_id, size).
+
+    Memory stays bounded by UPLOAD_CHUNK_SIZE. The size cap is enforced while
+    copying, and a partially written file is aborted (its chunks deleted) on any
+    error, cancellation or client disconnect.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes} bytes)")
+
+    grid_in = fs.open_upload_stream(
+        filename,
+        chunk_size_bytes=UPLOAD_CHUNK_SIZE,
+        metadata={"content_type": content_type}
+    )
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File too large (max {max_bytes} bytes)")
+            if request is not None and await request.is_disconnected():
+                raise HTTPException(status_code=400, detail="Client disconnected during upload")
+            await grid_in.write(chunk)
+        await grid_in.close()
+    except BaseException:
+        await grid_in.abort()
+        raise
+    return grid_in._id, size
+
+# ===== Spatial Index =====
+# Public pin coordinates kept in memory so nearby/viewport queries skip the
+# geo query and only hydrate the matching ids from Mongo. Built at startup,
+# then kept current by create_pin/delete_pin and a change stream (which also
+# covers writes made by other workers).
+pin_index = SpatialIndex(cell_deg=SPATIAL_INDEX_CELL_DEG)
+_pin_index_state = {"ready": False}
+
+def pin_index_ready() -> bool:
+    return SPATIAL_INDEX_ENABLED and _pin_index_state["ready"]
+
+def _epoch_seconds(iso: Optional[str]) -> int:
+    try:
+        return max(int(datetime.fromisoformat(iso).timestamp()), 0)
+    except (TypeError, ValueError):
+        return 0
+
+def index_pin(pin: dict) -> None:
+    if not SPATIAL_INDEX_ENABLED or pin.get('privacy') != 'public' or not isinstance(pin.get('_id'), ObjectId):
+        return
+    lng, lat = (pin.get('location') or {}).get('coordinates') or (pin.get('longitude'), pin.get('latitude'))
+    if lat is None or lng is None:
+        return
+    pin_index.add(pin['_id'].binary, lat, lng, _epoch_seconds(pin.get('created_at')))
+
+def unindex_pin(pin: dict) -> None:
+    if not SPATIAL_INDEX_ENABLED or not isinstance(pin.get('_id'), ObjectId):
+        return
+    pin_index.remove(pin['_id'].binary)
+
+async def hydrate_pins(keys: List[bytes]) -> List[dict]:
+    """Load public pins for index keys, preserving the index order."""
+    if not keys:
+        return []
+    docs = await db.pins.find({"_id": {"$in": [ObjectId(k) for k in keys]}, "privacy": "public"}).to_list(None)
+    by_key = {d['_id'].binary: d for d in docs}
+    return [by_key[k] for k in keys if k in by_key]
+
+async def build_pin_index() -> None:
+    count = 0
+    cursor = db.pins.find(
+        {"privacy": "public"},
+        {"_id": 1, "privacy": 1, "location": 1, "latitude": 1, "longitude": 1, "created_at": 1}
+    ).batch_size(5000)
+    pin_index.auto_compact = False
+    try:
+        async for pin in cursor:
+            index_pin(pin)
+            count += 1
+    finally:
+        pin_index.auto_compact = True
+        pin_index.compact()
+    _pin_index_state["ready"] = True
+    logger.info(f"Spatial index built: {count} public pins, ~{pin_index.memory_bytes() // 1024} KiB")
+
+async def watch_pin_changes(start_at=None) -> None:
+    # Only events that can change index membership or position
+    pipeline = [{"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "delete", "replace"]}},
+        {"updateDescription.updatedFields.privacy": {"$exists": True}},
+        {"updateDescription.updatedFields.location": {"$exists": True}},
+    ]}}]
+    resume_token = None
+    while True:
+        try:
+            options = {"resume_after": resume_token} if resume_token else {"start_at_operation_time": start_at}
+            async with db.pins.watch(pipeline, full_document="updateLookup", **options) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    key = change['documentKey']['_id']
+                    if change['operationType'] != 'insert':
+                        pin_index.remove(key.binary)
+                    doc = change.get('fullDocument')
+                    if doc:
+                        index_pin(doc)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            if resume_token is None and start_at is None:
+                logger.warning(f"Pin change stream unavailable, spatial index follows local writes only: {e}")
+                return
+            logger.warning(f"Pin change stream interrupted, resuming: {e}")
+            await asyncio.sleep(5)
+
+async def start_pin_index() -> None:
+    try:
+        # Replay changes made while the initial build is running
+        ping = await db.command("ping")
+        start_at = ping.get("operationTime")
+        await build_pin_index()
+    except Exception:
+        logger.exception("Failed to build spatial index; geo queries stay on MongoDB")
+        return
+    await watch_pin_changes(start_at)
+
+# ===== Pagination Helpers =====
+def encode_cursor(*values) -> str:
+    # Opaque to clients: base64 of the sort key of the last item returned
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Values go straight into query filters, so only scalars are accepted: a
+    # crafted {"$ne": null} would otherwise act as an operator. The last value is an id
+    if (
+        not isinstance(values, list) or len(values) != size
+        or not all(isinstance(v, (str, int, float)) and not isinstance(v, bool) for v in values)
+        or not isinstance(values[-1], str)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(sort_field: str, value, last_id: str, descending: bool) -> dict:
+    """Items strictly after (value, last_id) in (sort_field, id) order."""
+    op = "$lt" if descending else "$gt"
+    return {"$or": [{sort_field: {op: value}}, {sort_field: value, "id": {op: last_id}}]}
+
+def after_cursor(query: dict, cursor: Optional[str], sort_field: str, descending: bool) -> dict:
+    if not cursor:
+        return query
+    value, last_id = decode_cursor(cursor, 2)
+    return {"$and": [query, keyset_filter(sort_field, value, last_id, descending)]}
+
+def paginate(response: Response, items: List[dict], limit: int, sort_field: Optional[str]) -> List[dict]:
+    """Trim a limit + 1 fetch to one page and put the next cursor in X-Next-Cursor.
+
+    List endpoints keep returning plain arrays so existing clients are unaffected;
+    the header is only set when there is another page.
+    """
+    if len(items) <= limit:
+        return items
+    items = items[:limit]
+    last = items[-1]
+    keys = (last.get(sort_field), last['id']) if sort_field else (last['id'],)
+    response.headers["X-Next-Cursor"] = encode_cursor(*keys)
+    return items
+
 # ===== Auth Helpers =====
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -248,10 +952,62 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+_bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_pending = {"value": 0}
+
+async def run_bcrypt(fn, *args):
+    """Run hash_password/verify_password off the event loop, shedding load when the pool is backed up."""
+    if _bcrypt_pending["value"] >= BCRYPT_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-in requests, please retry shortly",
+            headers={"Retry-After": str(BCRYPT_RETRY_AFTER)},
+        )
+    _bcrypt_pending["value"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_bcrypt_pool, fn, *args)
+    finally:
+        _bcrypt_pending["value"] -= 1
+
 def create_token(user_id: str) -> str:
     expiration = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     return jwt.encode({'user_id': user_id, 'exp': expiration}, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+def create_guest_token(guest_id: str, username: str) -> str:
+    expiration = datetime.now(timezone.utc) + timedelta(hours=GUEST_SESSION_HOURS)
+    return jwt.encode(
+        {'user_id': guest_id, 'is_guest': True, 'username': username, 'exp': expiration},
+        JWT_SECRET,
+        algorithm=JWT_ALGORITHM
+    )
+
+# Reserved for guests: registration rejects usernames with the prefix and
+# emails with the prefix at the guest domain
+GUEST_PREFIX = "guest_"
+GUEST_EMAIL_DOMAIN = "@temp.com"
+
+def guest_identity(guest_id: str) -> tuple:
+    # (username, email) for a guest. Both are unique in users, so they carry the
+    # whole id; a prefix of it collides once there are enough guests
+    return f"Guest_{guest_id.replace('-', '')}", f"{GUEST_PREFIX}{guest_id}{GUEST_EMAIL_DOMAIN}"
+
+def is_reserved_identity(username: str, email: str) -> bool:
+    email = email.lower()
+    return username.lower().startswith(GUEST_PREFIX) or (email.startswith(GUEST_PREFIX) and email.endswith(GUEST_EMAIL_DOMAIN))
+
+def guest_from_token(payload: dict) -> dict:
+    # The user record a guest token stands for; no database read needed
+    guest_id = payload['user_id']
+    return {
+        "id": guest_id,
+        "username": payload['username'],
+        "email": guest_identity(guest_id)[1],
+        "is_guest": True,
+        "friends": [],
+        "friend_requests": [],
+        "expires_at": datetime.fromtimestamp(payload['exp'], timezone.utc),
+    }
+
 def decode_token(token: str) -> dict:
     try:
         return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
@@ -260,17 +1016,119 @@ def decode_token(token: str) -> dict:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# ===== User Cache =====
+USER_FIELDS = {"password_hash": 0, "password": 0}
+_user_cache = OrderedDict()  # user id -> (fetched_at, ObjectId, user)
+_user_oids = {}  # ObjectId -> user id, so change events can find cached entries
+_user_loads = {}  # user id -> in-flight fetch
+_user_generation = {"value": 0}  # bumped by every invalidation
+user_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+def invalidate_user(*user_ids: str) -> None:
+    """Drop cached records; call after any write to these users' documents."""
+    _user_generation["value"] += 1
+    for user_id in user_ids:
+        entry = _user_cache.pop(user_id, None)
+        if entry:
+            _user_oids.pop(entry[1], None)
+            user_cache_stats["invalidations"] += 1
+        # Later requests must not join a fetch that may predate the write
+        _user_loads.pop(user_id, None)
+
+async def _load_user(user_id: str) -> Optional[dict]:
+    generation = _user_generation["value"]
+    user = await db.users.find_one({"id": user_id}, USER_FIELDS)
+    if user is None:
+        return None
+    oid = user.pop('_id')
+    # Skip caching if an invalidation landed while the read was in flight
+    if generation == _user_generation["value"] and USER_CACHE_SIZE > 0:
+        _user_cache[user_id] = (time.monotonic(), oid, user)
+        _user_cache.move_to_end(user_id)
+        _user_oids[oid] = user_id
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _, (_, evicted_oid, _) = _user_cache.popitem(last=False)
+            _user_oids.pop(evicted_oid, None)
+            user_cache_stats["evictions"] += 1
+    return user
+
+async def get_cached_user(user_id: str) -> Optional[dict]:
+    entry = _user_cache.get(user_id)
+    if entry and time.monotonic() - entry[0] < USER_CACHE_TTL:
+        _user_cache.move_to_end(user_id)
+        user_cache_stats["hits"] += 1
+        return entry[2]
+    user_cache_stats["misses"] += 1
+
+    # Single flight: concurrent misses for one user share a read
+    task = _user_loads.get(user_id)
+    if task is None:
+        task = asyncio.create_task(_load_user(user_id))
+        _user_loads[user_id] = task
+        task.add_done_callback(lambda t: _user_loads.pop(user_id, None) if _user_loads.get(user_id) is t else None)
+    return await asyncio.shield(task)
+
+async def watch_user_changes() -> None:
+    resume_token = None
+    pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+    while True:
+        try:
+            options = {"resume_after": resume_token} if resume_token else {}
+            async with db.users.watch(pipeline, **options) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    user_id = _user_oids.get(change['documentKey']['_id'])
+                    if user_id:
+                        invalidate_user(user_id)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            if resume_token is None:
+                logger.warning(f"User change stream unavailable, cached users expire after {USER_CACHE_TTL}s: {e}")
+                return
+            logger.warning(f"User change stream interrupted, resuming: {e}")
+            await asyncio.sleep(5)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     payload = decode_token(credentials.credentials)
-    user = await db.users.find_one({"id": payload['user_id']})
+    if payload.get('is_guest'):
+        return guest_from_token(payload)
+    user = await get_cached_user(payload['user_id'])
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
-    user.pop('_id', None)
-    return user
+    # Shallow copy: routes may modify the dict, but the cached lists are shared
+    return dict(user)
+
+async def get_writing_user(current_user: dict = Depends(get_current_user)) -> dict:
+    """get_current_user for routes that store data; a guest's user document is created on first write."""
+    if current_user.get('is_guest', False):
+        guest = {k: v for k, v in current_user.items() if k != 'expires_at'}
+        try:
+            await db.users.update_one(
+                {"id": current_user['id']},
+                {
+                    "$setOnInsert": {
+                        **guest,
+                        "username_lower": guest['username'].lower(),
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                    },
+                    # Drives the purge job and, as a backstop, the users TTL index
+                    "$set": {"expires_at": current_user['expires_at']},
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Fine if a concurrent first write created it; otherwise the guest's
+            # username or email belongs to someone else and nothing was stored
+            if not await db.users.find_one({"id": current_user['id']}, {"_id": 1}):
+                raise HTTPException(status_code=409, detail="Guest session conflicts with an existing account; start a new one")
+    return current_user
 
 # ===== Auth Routes =====
 @api_router.post("/auth/register")
 async def register(user_data: UserCreate, response: Response):
+    if is_reserved_identity(user_data.username, user_data.email):
+        raise HTTPException(status_code=400, detail="That username or email is reserved for guest accounts")
     try:
         existing = await db.users.find_one(
             {"$or": [{"email": user_data.email}, {"username": user_data.username}]}
@@ -283,9 +1141,12 @@ async def register(user_data: UserCreate, response: Response):
             email=user_data.email
         )
         user_dict = user.model_dump()
-        user_dict['password_hash'] = hash_password(user_data.password)
+        user_dict['password_hash'] = await run_bcrypt(hash_password, user_data.password)
+        user_dict['username_lower'] = user.username.lower()  # for search_users prefix matching
 
         await db.users.insert_one(user_dict)
+        suggest_update("user", "set", user.username, user.id, 0)
+        update_search_index("users", user_dict)
 
         token = create_token(user.id)
         response.set_cookie(
@@ -301,6 +1162,9 @@ async def register(user_data: UserCreate, response: Response):
         return {"token": token, "user": {"id": user.id, "username": user.username, "email": user.email}}
     except HTTPException:
         raise
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration; the unique indexes catch it
+        raise HTTPException(status_code=400, detail="User already exists")
     except PyMongoError:
         logger.exception("MongoDB error in /auth/register")
         raise HTTPException(
@@ -319,7 +1183,7 @@ async def login(login_data: UserLogin, response: Response):
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
         hashed = user.get('password_hash') or user.get('password')
-        if not hashed or not verify_password(login_data.password, hashed):
+        if not hashed or not await run_bcrypt(verify_password, login_data.password, hashed):
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
         token = create_token(user['id'])
@@ -356,31 +1220,19 @@ async def login_prefetch():
 
 @api_router.post("/auth/guest")
 async def guest_login(response: Response):
-    # Create temporary guest user
+    # Guest identity lives in the token; a user document is only created on first write
     guest_id = str(uuid.uuid4())
-    guest_user = {
-        "id": guest_id,
-        "username": f"Guest_{guest_id[:8]}",
-        "email": f"guest_{guest_id[:8]}@temp.com",
-        "is_guest": True,
-        "friends": [],
-        "friend_requests": [],
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    # Store guest user temporarily (no password needed)
-    await db.users.insert_one(guest_user)
-    
-    token = create_token(guest_id)
+    username, email = guest_identity(guest_id)
+    token = create_guest_token(guest_id, username)
     response.set_cookie(
         "token", 
         token, 
         httponly=True, 
         secure=COOKIE_SECURE,
         samesite="lax",
-        max_age=24 * 3600  # 24 hours for guest
+        max_age=GUEST_SESSION_HOURS * 3600
     )
-    return {"token": token, "user": {"id": guest_id, "username": guest_user["username"], "email": guest_user["email"], "is_guest": True}}
+    return {"token": token, "user": {"id": guest_id, "username": username, "email": email, "is_guest": True}}
 
 @api_router.get("/auth/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
@@ -389,95 +1241,563 @@ async def get_me(current_user: dict = Depends(get_current_user)):
     user.pop('password', None)
     return user
 
+# ===== Pin Clustering =====
+CLUSTER_FIELDS = {"_id": 0, "id": 1, "title": 1, "latitude": 1, "longitude": 1, "user_id": 1, "media_count": 1}
+_cluster_cache = OrderedDict()  # scope -> (built_at, pin_version, Supercluster)
+_cluster_builds = {}  # scope -> in-flight build task, shared by concurrent requests
+_pin_version = {"value": 0}  # bumped on local non-public pin writes
+# Local public pin writes since the public index started building:
+# pin id -> (monotonic time, cluster point, or None once deleted)
+_public_overlay = {}
+
+def bump_pin_version(pin: dict, removed: bool = False) -> None:
+    if pin.get('privacy') != "public":
+        _pin_version["value"] += 1
+        return
+    # Public writes reach the shared index on its next rebuild; until then they
+    # are patched into responses, so authors see their own pins at once
+    point = None if removed else {k: pin.get(k) for k in CLUSTER_FIELDS if k != "_id"}
+    _public_overlay[pin['id']] = (time.monotonic(), point)
+
+def _in_bbox(lat: float, lng: float, min_lng: float, min_lat: float, max_lng: float, max_lat: float) -> bool:
+    if not min_lat <= lat <= max_lat:
+        return False
+    if min_lng > max_lng:  # crosses the antimeridian
+        return lng >= min_lng or lng <= max_lng
+    return min_lng <= lng <= max_lng
+
+def overlay_public_pins(pins: List[dict], min_lng: float, min_lat: float, max_lng: float, max_lat: float) -> List[dict]:
+    """Public-index pins with local writes since its build applied."""
+    if not _public_overlay:
+        return pins
+    pins = [p for p in pins if p.get('id') not in _public_overlay]
+    for _, point in _public_overlay.values():
+        if point and _in_bbox(point['latitude'], point['longitude'], min_lng, min_lat, max_lng, max_lat):
+            pins.append(point)
+    return pins
+
+def cluster_scopes(current_user: dict) -> List[tuple]:
+    """(scope key, query) pairs that together cover the pins a user may see.
+
+    Public pins share one index across all users; each user's own and friends'
+    non-public pins get a small index of their own.
+    """
+    if current_user.get('is_guest', False):
+        return [(f"guest:{current_user['id']}", visible_pins_query(current_user))]
+    friends = sorted(current_user.get('friends', []))
+    friends_digest = hashlib.sha1(",".join(friends).encode('utf-8')).hexdigest()[:12]
+    return [
+        ("public", {"privacy": "public"}),
+        (f"user:{current_user['id']}:{friends_digest}", {
+            "privacy": {"$ne": "public"},
+            "$or": [
+                {"user_id": current_user['id']},
+                {"privacy": "friends", "user_id": {"$in": friends}}
+            ]
+        }),
+    ]
+
+async def _build_cluster_index(scope: str, query: dict, version: int) -> Supercluster:
+    started = time.monotonic()
+    points = []
+    async for pin in db.pins.find(query, CLUSTER_FIELDS).batch_size(5000):
+        if pin.get('latitude') is not None and pin.get('longitude') is not None:
+            points.append((pin['latitude'], pin['longitude'], pin))
+    # Clustering is CPU-bound; keep it off the event loop
+    index = await asyncio.to_thread(Supercluster().load, points)
+    _cluster_cache[scope] = (time.monotonic(), version, index)
+    _cluster_cache.move_to_end(scope)
+    if scope == "public":
+        # Writes from before the read began are in the new index
+        for pin_id in [k for k, (at, _) in _public_overlay.items() if at < started]:
+            del _public_overlay[pin_id]
+    while len(_cluster_cache) > CLUSTER_CACHE_SIZE:
+        _cluster_cache.popitem(last=False)
+    return index
+
+def _cluster_build(scope: str, query: dict) -> asyncio.Task:
+    # Single flight: concurrent requests for the same scope share one build
+    task = _cluster_builds.get(scope)
+    if task is None:
+        task = asyncio.create_task(_build_cluster_index(scope, query, _pin_version["value"]))
+        _cluster_builds[scope] = task
+
+        def done(t: asyncio.Task) -> None:
+            _cluster_builds.pop(scope, None)
+            if not t.cancelled() and t.exception():
+                logger.error(f"Cluster index build for {scope} failed", exc_info=t.exception())
+        task.add_done_callback(done)
+    return task
+
+async def get_cluster_index(scope: str, query: dict) -> Supercluster:
+    cached = _cluster_cache.get(scope)
+    if cached:
+        built_at, built_version, index = cached
+        age = time.monotonic() - built_at
+        if scope == "public":
+            # Shared and expensive to build: keep serving the current index while
+            # the next one builds in the background
+            if age >= CLUSTER_PUBLIC_REFRESH or (
+                    len(_public_overlay) >= CLUSTER_OVERLAY_MAX and age >= CLUSTER_MIN_REBUILD_SECONDS):
+                _cluster_build(scope, query)
+            _cluster_cache.move_to_end(scope)
+            return index
+        if age < CLUSTER_CACHE_TTL and (built_version == _pin_version["value"] or age < CLUSTER_MIN_REBUILD_SECONDS):
+            _cluster_cache.move_to_end(scope)
+            return index
+    return await asyncio.shield(_cluster_build(scope, query))
+
+# ===== Vector Tiles =====
+tile_cache = DiskTileCache(TILE_CACHE_DIR, TILE_CACHE_MAX_BYTES, TILE_CACHE_MAX_AGE)
+
+async def render_tile(z: int, x: int, y: int) -> bytes:
+    west, south, east, north = tile_bounds(z, x, y)
+    snap = 16 if z < TILE_SIMPLIFY_BELOW_ZOOM else 1
+    # Fetch extra rows when simplifying since many will collapse together
+    fetch = TILE_FEATURE_LIMIT * (4 if snap > 1 else 1)
+
+    pins = await db.pins.find(
+        {"$and": [{"privacy": "public"}, bbox_filter(south, west, north, east)]},
+        {"_id": 0, "id": 1, "title": 1, "username": 1, "media_count": 1, "latitude": 1, "longitude": 1}
+    ).sort("created_at", -1).limit(fetch).to_list(fetch)
+    events = await db.events.find(
+        bbox_filter(south, west, north, east),
+        {"_id": 0, "id": 1, "title": 1, "event_date": 1, "location_name": 1, "latitude": 1, "longitude": 1}
+    ).sort("event_date", 1).limit(fetch).to_list(fetch)
+
+    def features(docs: List[dict]) -> list:
+        points = [(d.pop('latitude'), d.pop('longitude'), d) for d in docs]
+        return point_features(points, z, x, y, TILE_FEATURE_LIMIT, snap)
+
+    return await asyncio.to_thread(encode_tile, [("pins", features(pins)), ("events", features(events))])
+
+async def invalidate_tiles(latitude: float, longitude: float) -> None:
+    def drop():
+        for z, x, y in tiles_for_point(latitude, longitude, TILE_CACHE_MAX_ZOOM):
+            tile_cache.invalidate(z, x, y)
+    try:
+        await asyncio.to_thread(drop)
+    except OSError as e:
+        logging.error(f"Error invalidating tiles: {e}")
+
+# ===== Search =====
+# Collection -> (filter for searchable documents, field weights)
+SEARCHABLE = {
+    "pins": ({"privacy": "public"}, PIN_TEXT_WEIGHTS),
+    "events": ({}, EVENT_TEXT_WEIGHTS),
+    "users": ({"is_guest": {"$ne": True}}, {"username": 1}),  # fuzzy only
+}
+USER_SEARCH_FIELDS = {"_id": 0, "password_hash": 0, "password": 0, "username_lower": 0}
+_search_memory = {"enabled": SEARCH_BACKEND == "memory"}
+_search_indexes = {}  # (collection, fuzzy) -> (built_at, InvertedIndex or FuzzyIndex)
+_search_builds = {}  # (collection, fuzzy) -> in-flight build task
+_search_pending = {}  # (collection, fuzzy) -> [(doc, removed)] written while that build runs
+
+def _index_search_docs(index, docs: List[dict]) -> None:
+    for doc in docs:
+        index.add(doc['id'], doc)
+
+def _apply_search_write(index, doc: dict, removed: bool) -> None:
+    if removed:
+        index.remove(doc['id'])
+    else:
+        index.add(doc['id'], doc)
+
+async def _build_search_index(collection: str, fuzzy: bool):
+    key = (collection, fuzzy)
+    query, weights = SEARCHABLE[collection]
+    index = FuzzyIndex(weights) if fuzzy else InvertedIndex(weights)
+    started = time.monotonic()
+    _search_pending[key] = []
+    try:
+        batch = []
+        async for doc in db[collection].find(query, {"_id": 0, "id": 1, **{f: 1 for f in weights}}).batch_size(5000):
+            batch.append(doc)
+            if len(batch) >= 5000:
+                # Indexing is CPU-bound; keep it off the event loop
+                await asyncio.to_thread(_index_search_docs, index, batch)
+                batch = []
+        await asyncio.to_thread(_index_search_docs, index, batch)
+        # Writes made while we were reading; no await between replay and swap
+        for doc, removed in _search_pending[key]:
+            _apply_search_write(index, doc, removed)
+        _search_indexes[key] = (started, index)
+    finally:
+        _search_pending.pop(key, None)
+    return index
+
+def _search_build(key: tuple) -> asyncio.Task:
+    # Single flight, as for cluster indexes
+    task = _search_builds.get(key)
+    if task is None:
+        task = asyncio.create_task(_build_search_index(*key))
+        _search_builds[key] = task
+
+        def done(t: asyncio.Task) -> None:
+            _search_builds.pop(key, None)
+            if not t.cancelled() and t.exception():
+                logger.error(f"Search index build for {key} failed", exc_info=t.exception())
+        task.add_done_callback(done)
+    return task
+
+async def get_search_index(collection: str, fuzzy: bool = False):
+    key = (collection, fuzzy)
+    cached = _search_indexes.get(key)
+    if cached:
+        # Keep serving the current index while the next one builds in the background
+        if time.monotonic() - cached[0] >= SEARCH_INDEX_TTL:
+            _search_build(key)
+        return cached[1]
+    return await asyncio.shield(_search_build(key))
+
+def update_search_index(collection: str, doc: dict, removed: bool = False) -> None:
+    """Keep in-memory indexes current with this process's writes; pass removed=True for unsearchable docs."""
+    for fuzzy in (False, True):
+        key = (collection, fuzzy)
+        cached = _search_indexes.get(key)
+        if cached is not None:
+            _apply_search_write(cached[1], doc, removed)
+        pending = _search_pending.get(key)
+        if pending is not None:
+            pending.append((doc, removed))
+
+async def _hydrate(collection: str, ids: List[str], projection: dict) -> List[dict]:
+    query, _ = SEARCHABLE[collection]
+    found = {d['id']: d for d in await db[collection].find({**query, "id": {"$in": ids}}, projection).to_list(len(ids))}
+    return [found[i] for i in ids if i in found]
+
+async def text_search(collection: str, q: str, limit: int, offset: int) -> List[dict]:
+    """Documents matching q, most relevant first. Input is reduced to plain words, never an operator or regex."""
+    terms = " ".join(words(q))
+    if not terms:
+        return []
+    query, _ = SEARCHABLE[collection]
+    if not _search_memory["enabled"]:
+        try:
+            docs = await db[collection].find(
+                {**query, "$text": {"$search": terms}},
+                {"_id": 0, "score": {"$meta": "textScore"}}
+            ).sort([("score", {"$meta": "textScore"})]).skip(offset).limit(limit).to_list(limit)
+            for d in docs:
+                d.pop('score', None)
+            return docs
+        except OperationFailure as e:
+            logger.warning(f"$text search unavailable on {collection}, using the in-memory index: {e}")
+            _search_memory["enabled"] = True
+
+    ids = (await get_search_index(collection)).search(terms, limit, offset)
+    return await _hydrate(collection, ids, {"_id": 0})
+
+async def fuzzy_search(collection: str, q: str, limit: int, offset: int, projection: Optional[dict] = None) -> List[dict]:
+    """Documents whose words are within a few typos of every query word, most similar first."""
+    ids = (await get_search_index(collection, fuzzy=True)).search(q, limit, offset)
+    return await _hydrate(collection, ids, projection or {"_id": 0})
+
+async def run_search(response: Response, match: str, offset: int, exact, fuzzy) -> List[dict]:
+    """match=exact|fuzzy picks one; auto tries exact and falls back to fuzzy when its first page is empty.
+
+    X-Search-Match tells the client which one produced the results, so it can
+    keep paging with the same mode. exact and fuzzy are zero-argument coroutine
+    functions.
+    """
+    docs = [] if match == "fuzzy" else await exact()
+    used = "exact"
+    if match == "fuzzy" or (match == "auto" and offset == 0 and not docs):
+        docs = await fuzzy()
+        used = "fuzzy"
+    response.headers["X-Search-Match"] = used
+    return docs
+
+# ===== Suggest =====
+# Kind -> prefix index of (label, ref, popularity); see suggest_index.py
+suggest_indexes = {"user": SuggestIndex(), "pin": SuggestIndex(), "location": SuggestIndex()}
+_suggest_state = {"ready": False, "building": False, "pending": [], "memory_bytes": 0}
+
+def suggest_update(kind: str, op: str, *args) -> None:
+    """Apply a set/add/remove to a suggest index, and replay it on the index being rebuilt."""
+    getattr(suggest_indexes[kind], op)(*args)
+    if _suggest_state["building"]:
+        _suggest_state["pending"].append((kind, op, args))
+
+async def _suggest_entries() -> dict:
+    users = [
+        (u['username'], u['id'], u['friend_count'])
+        async for u in db.users.aggregate([
+            {"$match": {"is_guest": {"$ne": True}}},
+            {"$project": {"_id": 0, "id": 1, "username": 1, "friend_count": {"$size": {"$ifNull": ["$friends", []]}}}},
+        ])
+    ]
+    pins = [
+        (p.get('title') or "", p['id'], p.get('like_count', 0))
+        async for p in db.pins.find({"privacy": "public"}, {"_id": 0, "id": 1, "title": 1, "like_count": 1}).batch_size(5000)
+    ]
+    # One entry per place, however it was capitalized, scored by its number of events
+    places = {}
+    async for row in db.events.aggregate([{"$group": {"_id": "$location_name", "count": {"$sum": 1}}}]):
+        norm = normalize(row['_id'] or "")
+        if norm:
+            label, count = places.get(norm, (row['_id'], 0))
+            places[norm] = (label, count + row['count'])
+    locations = [(label, "", count) for label, count in places.values()]
+    return {"user": users, "pin": pins, "location": locations}
+
+def _load_suggest_indexes(entries: dict) -> tuple:
+    built = {kind: SuggestIndex.from_entries(rows) for kind, rows in entries.items()}
+    return built, sum(index.memory_bytes() for index in built.values())
+
+async def build_suggest_indexes() -> None:
+    _suggest_state["building"] = True
+    _suggest_state["pending"] = []
+    try:
+        entries = await _suggest_entries()
+        built, memory = await asyncio.to_thread(_load_suggest_indexes, entries)
+        # Writes made while we were reading; no await between replay and swap
+        for kind, op, args in _suggest_state["pending"]:
+            getattr(built[kind], op)(*args)
+        suggest_indexes.update(built)
+        _suggest_state["ready"] = True
+        _suggest_state["memory_bytes"] = memory
+        keys = sum(len(index) for index in built.values())
+        logger.info(f"Suggest indexes loaded: {keys} keys, {memory / 1e6:.1f} MB")
+    finally:
+        _suggest_state["building"] = False
+        _suggest_state["pending"] = []
+
+async def suggest_refresh_loop() -> None:
+    while True:
+        try:
+            await build_suggest_indexes()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Suggest index build failed")
+        await asyncio.sleep(SUGGEST_REFRESH_SECONDS)
+
+@api_router.get("/suggest")
+async def suggest(
+    q: str = Query(..., max_length=100),
+    limit: int = Query(10, ge=1, le=20),
+    types: str = Query("user,pin,location"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Prefix completions for usernames, public pin titles and event places, most popular first."""
+    kinds = [t for t in types.split(",") if t in suggest_indexes]
+    results = [
+        {"type": kind, "text": label, "id": ref or None, "score": score}
+        for kind in kinds
+        for label, ref, score in suggest_indexes[kind].suggest(q, limit)
+    ]
+    results.sort(key=lambda r: r['score'], reverse=True)
+    return results[:limit]
+
 # ===== Pin Routes =====
+def visible_pins_query(current_user: dict) -> dict:
+    """Filter for the pins a user may see on the map."""
+    if current_user.get('is_guest', False):
+        # Guest users see only their private pins to avoid sharing with others
+        return {"user_id": current_user['id']}
+
+    # Authenticated users see public pins, their own pins, and friends' pins
+    friends = current_user.get('friends', [])
+    return {
+        "$or": [
+            {"privacy": "public", "user_id": {"$ne": current_user['id']}},
+            {"user_id": current_user['id']},
+            {"$and": [{"privacy": "friends"}, {"user_id": {"$in": friends}}]}
+        ]
+    }
+
 @api_router.post("/pins", response_model=Pin)
-async def create_pin(pin_data: PinCreate, current_user: dict = Depends(get_current_user)):
+async def create_pin(pin_data: PinCreate, current_user: dict = Depends(get_writing_user)):
     # Fix A — add userId to pin document stored in MongoDB
     pin = Pin(
         user_id=current_user['id'],
         username=current_user['username'],
+        location=geo_point(pin_data.latitude, pin_data.longitude),
         **pin_data.model_dump()
     )
-    await db.pins.insert_one(pin.model_dump())
+    pin_doc = pin.model_dump()
+    await db.pins.insert_one(pin_doc)
+    index_pin(pin_doc)
+    update_search_index("pins", pin_doc, removed=pin.privacy != "public")
+    if pin.privacy == "public":
+        suggest_update("pin", "set", pin.title, pin.id, 0)
+    bump_pin_version(pin_doc)
+    if pin.privacy == "public":
+        await invalidate_tiles(pin.latitude, pin.longitude)
     return pin
 
 @api_router.get("/pins")
-async def get_pins(privacy: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    query = {}
-
-    is_guest = current_user.get('is_guest', False)
+async def get_pins(
+    response: Response,
+    privacy: Optional[str] = None,
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lng: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lng: Optional[float] = Query(None, ge=-180, le=180),
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    media: str = Query("refs", pattern="^(refs|embed)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """List visible pins, newest first; X-Next-Cursor is passed back as cursor for older ones.
 
+    media=refs (default) attaches lightweight media descriptors with a URL to the bytes;
+    media=embed keeps the legacy base64 data URIs for older clients.
+    """
     if privacy:
-        query['privacy'] = privacy
+        query = {'privacy': privacy}
     else:
-        friends = current_user.get('friends', [])
-
-        if is_guest:
-            # Guest users see only their private pins to avoid sharing with others
-            query = {
-                "user_id": current_user['id']
-            }
-        else:
-            # Authenticated users see public pins, their own pins, and friends' pins
-            query = {
-                "$or": [
-                    {"privacy": "public", "user_id": {"$ne": current_user['id']}},
-                    {"user_id": current_user['id']},
-                    {"$and": [{"privacy": "friends"}, {"user_id": {"$in": friends}}]}
-                ]
-            }
-
-    pins = await db.pins.find(query).sort("created_at", -1).to_list(1000)
-
-    # Embed media for each pin
+        query = visible_pins_query(current_user)
+
+    # Optional viewport: only pins inside the visible map bounds
+    bounds = (min_lat, min_lng, max_lat, max_lng)
+    has_bounds = any(v is not None for v in bounds)
+    if has_bounds:
+        if any(v is None for v in bounds):
+            raise HTTPException(status_code=400, detail="min_lat, min_lng, max_lat and max_lng must be given together")
+        in_bounds = bbox_filter(min_lat, min_lng, max_lat, max_lng)
+        query = {"$and": [query, in_bounds]}
+    query = after_cursor(query, cursor, "created_at", descending=True)
+
+    public_keys = None
+    if not cursor and has_bounds and not privacy and not current_user.get('is_guest', False) and pin_index_ready():
+        # None when the viewport is too large for the index to answer quickly
+        public_keys = pin_index.within_bbox(min_lat, min_lng, max_lat, max_lng, limit + 1, with_ties=True)
+    if public_keys is not None:
+        # Public pins come from the in-memory index; only the caller's own and
+        # friends' non-public pins still need a geo query
+        public_pins = await hydrate_pins(public_keys)
+        own_query = {"$and": [
+            {"privacy": {"$ne": "public"}},
+            {"$or": [
+                {"user_id": current_user['id']},
+                {"privacy": "friends", "user_id": {"$in": current_user.get('friends', [])}}
+            ]},
+            in_bounds
+        ]}
+        own_pins = await db.pins.find(own_query).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
+        pins = sorted(public_pins + own_pins, key=lambda p: (p.get('created_at', ''), p['id']), reverse=True)
+    else:
+        pins = await db.pins.find(query).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
+    pins = paginate(response, pins, limit, "created_at")
+
+    # One batched lookup for the whole page, skipping pins known to have no media
+    media_by_pin = await find_media_for_pins([p["id"] for p in pins if p.get("media_count", 1) > 0])
+
+    if media == "refs":
+        descriptors_by_pin = {}
+        for d in await media_descriptors([m for items in media_by_pin.values() for m in items]):
+            descriptors_by_pin.setdefault(d["pin_id"], []).append(d)
+        for pin in pins:
+            pin["media"] = descriptors_by_pin.get(pin["id"], [])
+            pin.pop('_id', None)
+        return pins
+
+    # Legacy: embed media as base64 data URIs
     for pin in pins:
-        media_items = await db.media.find({"pin_id": pin["id"]}).to_list(100)
+        media_items = media_by_pin.get(pin["id"], [])
         result_media = []
-        for media in media_items:
+        for m in media_items:
             try:
-                grid_out = await fs.open_download_stream(ObjectId(media["file_id"]))
+                grid_out = await fs.open_download_stream(ObjectId(m["file_id"]))
                 content = await grid_out.read()  # type: ignore[misc]
                 # motor returns bytes from async read
                 base64_data = base64.b64encode(content).decode("utf-8")
                 ct = (grid_out.metadata or {}).get("content_type", "image/jpeg")
-                media["file_data"] = f"data:{ct};base64,{base64_data}"
-                result_media.append(media)
+                m["file_data"] = f"data:{ct};base64,{base64_data}"
+                result_media.append(m)
             except Exception as e:
                 logging.error(f"Error embedding media for pin {pin['id']}: {e}")
                 continue
-        # drop internal ids
-        for m in result_media:
-            m.pop('_id', None)
         pin["media"] = result_media
         pin.pop('_id', None)
 
     return pins
 
 @api_router.get("/users/{user_id}/pins")
-async def get_user_pins(user_id: str, current_user: dict = Depends(get_current_user)):
+async def get_user_pins(
+    user_id: str,
+    response: Response,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     # List pins created by a specific user
     if user_id != current_user['id']:
         # Optionally add friend or public check to allow viewing others' pins
         raise HTTPException(status_code=403, detail="Not authorized to view pins of other users")
-    pins = await db.pins.find({"user_id": user_id}).sort("created_at", -1).to_list(1000)
-    for p in pins:
-        p.pop('_id', None)
-    return pins
+    query = after_cursor({"user_id": user_id}, cursor, "created_at", descending=True)
+    pins = await db.pins.find(query, {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    return paginate(response, pins, limit, "created_at")
 
 @api_router.get("/pins/search")
-async def search_pins(q: str, current_user: dict = Depends(get_current_user)):
-    """Search pins by title or description"""
-    query = {
-        "privacy": "public",
-        "$or": [
-            {"title": {"$regex": q, "$options": "i"}},
-            {"description": {"$regex": q, "$options": "i"}}
-        ]
-    }
-    pins = await db.pins.find(query).sort("created_at", -1).limit(50).to_list(50)
-    for p in pins:
-        p.pop('_id', None)
-    return pins
+async def search_pins(
+    q: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    match: str = Query("auto", pattern="^(auto|exact|fuzzy)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Search public pins by title or description, most relevant first"""
+    return await run_search(
+        response,
+        match,
+        offset,
+        lambda: text_search("pins", q, limit, offset),
+        lambda: fuzzy_search("pins", q, limit, offset),
+    )
+
+@api_router.get("/pins/clusters")
+async def get_pin_clusters(
+    bbox: str,
+    zoom: float = Query(..., ge=0, le=24),
+    current_user: dict = Depends(get_current_user)
+):
+    """Clusters and sparse individual pins for a viewport.
+
+    bbox is "min_lng,min_lat,max_lng,max_lat"; min_lng > max_lng crosses the
+    antimeridian. Visibility matches GET /api/pins.
+    """
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lng,min_lat,max_lng,max_lat")
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise HTTPException(status_code=400, detail="bbox out of range")
+
+    clusters, pins = [], []
+    for scope, query in cluster_scopes(current_user):
+        index = await get_cluster_index(scope, query)
+        # One past the cap tells us the viewport was cut short
+        budget = CLUSTER_MAX_ITEMS + 1 - len(clusters) - len(pins)
+        scope_clusters, scope_pins = index.get_clusters(min_lng, min_lat, max_lng, max_lat, zoom, limit=budget)
+        if scope == "public":
+            scope_pins = overlay_public_pins(scope_pins, min_lng, min_lat, max_lng, max_lat)
+        clusters.extend(scope_clusters)
+        pins.extend(scope_pins)
+        if len(clusters) + len(pins) > CLUSTER_MAX_ITEMS:
+            break
+    # Wide boxes at high zoom would otherwise list every pin one by one
+    truncated = len(clusters) + len(pins) > CLUSTER_MAX_ITEMS
+    if truncated:
+        pins = pins[:max(CLUSTER_MAX_ITEMS - len(clusters), 0)]
+        clusters = clusters[:CLUSTER_MAX_ITEMS]
+    return {"zoom": int(zoom), "clusters": clusters, "pins": pins, "truncated": truncated}
+
+def check_pin_access(pin: dict, current_user: dict) -> None:
+    if pin['privacy'] == 'private' and pin['user_id'] != current_user['id']:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if pin['privacy'] == 'friends' and pin['user_id'] != current_user['id']:
+        if pin['user_id'] not in current_user.get('friends', []):
+            raise HTTPException(status_code=403, detail="Access denied")
 
 @api_router.get("/pins/{pin_id}")
 async def get_pin(pin_id: str, current_user: dict = Depends(get_current_user)):
@@ -486,15 +1806,31 @@ async def get_pin(pin_id: str, current_user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Pin not found")
     
     # Check privacy
-    if pin['privacy'] == 'private' and pin['user_id'] != current_user['id']:
-        raise HTTPException(status_code=403, detail="Access denied")
-    if pin['privacy'] == 'friends' and pin['user_id'] != current_user['id']:
-        if pin['user_id'] not in current_user.get('friends', []):
-            raise HTTPException(status_code=403, detail="Access denied")
+    check_pin_access(pin, current_user)
     
     pin.pop('_id', None)
     return pin
 
+async def remove_pin(pin: dict) -> None:
+    """Delete a pin with its media (originals and derivatives) and comments."""
+    media_items = await db.media.find({"pin_id": pin['id']}).to_list(None)
+    for media in media_items:
+        for file_id in media_file_ids(media):
+            try:
+                await fs.delete(file_id)
+            except:
+                pass
+    await db.media.delete_many({"pin_id": pin['id']})
+    await db.comments.delete_many({"pin_id": pin['id']})
+
+    await db.pins.delete_one({"id": pin['id']})
+    unindex_pin(pin)
+    update_search_index("pins", pin, removed=True)
+    suggest_update("pin", "remove", pin.get('title') or "", pin['id'])
+    bump_pin_version(pin, removed=True)
+    if pin.get('privacy') == "public":
+        await invalidate_tiles(pin['latitude'], pin['longitude'])
+
 @api_router.delete("/pins/{pin_id}")
 async def delete_pin(pin_id: str, current_user: dict = Depends(get_current_user)):
     pin = await db.pins.find_one({"id": pin_id})
@@ -502,41 +1838,80 @@ async def delete_pin(pin_id: str, current_user: dict = Depends(get_current_user)
         raise HTTPException(status_code=404, detail="Pin not found")
     if pin['user_id'] != current_user['id']:
         raise HTTPException(status_code=403, detail="Not authorized")
-    
-    # Delete associated media
-    media_items = await db.media.find({"pin_id": pin_id}).to_list(1000)
-    for media in media_items:
-        try:
-            await fs.delete(ObjectId(media['file_id']))
-        except:
-            pass
-    await db.media.delete_many({"pin_id": pin_id})
-    
-    await db.pins.delete_one({"id": pin_id})
+
+    await remove_pin(pin)
     return {"message": "Pin deleted"}
 
 # ===== Like Routes =====
 @api_router.post("/pins/{pin_id}/like")
-async def like_pin(pin_id: str, current_user: dict = Depends(get_current_user)):
-    pin = await db.pins.find_one({"id": pin_id})
-    if not pin:
-        raise HTTPException(status_code=404, detail="Pin not found")
-    
-    likes = pin.get('likes', [])
-    if current_user['id'] in likes:
-        likes.remove(current_user['id'])
-    else:
-        likes.append(current_user['id'])
-    
-    await db.pins.update_one({"id": pin_id}, {"$set": {"likes": likes}})
-    return {"likes": len(likes), "liked": current_user['id'] in likes}
+async def like_pin(pin_id: str, current_user: dict = Depends(get_writing_user)):
+    user_id = current_user['id']
+    # Each toggle is a single conditional update, so concurrent likes are never lost.
+    # Retry covers the same user toggling twice between our two attempts.
+    # like_count is recomputed from the array rather than incremented, so pins
+    # from before the field existed (or with a drifted count) come out right.
+    for _ in range(3):
+        pin = await db.pins.find_one_and_update(
+            {"id": pin_id, "likes": {"$ne": user_id}},
+            [
+                {"$set": {"likes": {"$concatArrays": [{"$ifNull": ["$likes", []]}, {"$literal": [user_id]}]}}},
+                {"$set": {"like_count": {"$size": "$likes"}}},
+            ],
+            projection={"_id": 0, "like_count": 1, "title": 1, "privacy": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if pin:
+            if pin.get('privacy') == "public":
+                suggest_update("pin", "set", pin.get('title') or "", pin_id, pin.get('like_count', 0))
+            return {"likes": pin.get('like_count', 0), "liked": True}
+
+        pin = await db.pins.find_one_and_update(
+            {"id": pin_id, "likes": user_id},
+            [
+                {"$set": {"likes": {"$setDifference": ["$likes", {"$literal": [user_id]}]}}},
+                {"$set": {"like_count": {"$size": "$likes"}}},
+            ],
+            projection={"_id": 0, "like_count": 1, "title": 1, "privacy": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if pin:
+            if pin.get('privacy') == "public":
+                suggest_update("pin", "set", pin.get('title') or "", pin_id, pin.get('like_count', 0))
+            return {"likes": pin.get('like_count', 0), "liked": False}
+
+        if not await db.pins.find_one({"id": pin_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Pin not found")
+    raise HTTPException(status_code=409, detail="Like state changed concurrently, please retry")
 
 # ===== Comment Routes =====
+# Comments live in their own collection, indexed on (pin_id, created_at, id).
+# Pins keep comment_count and a preview of the newest COMMENT_PREVIEW_SIZE.
+async def refresh_comment_preview(pin_id: str) -> None:
+    latest = await db.comments.find({"pin_id": pin_id}, {"_id": 0, "pin_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(COMMENT_PREVIEW_SIZE).to_list(COMMENT_PREVIEW_SIZE)
+    await db.pins.update_one({"id": pin_id}, {"$set": {"comments": latest[::-1]}})
+
+async def migrate_pin_comments(pin: dict) -> None:
+    """Move a legacy pin's embedded comments into the collection (same as manage.py split-comments)."""
+    if 'comment_count' in pin:
+        return
+    legacy = await db.pins.find_one({"id": pin['id']}, {"comments": 1})
+    comments = sorted((legacy or {}).get('comments') or [], key=lambda c: c.get('created_at', ''))
+    for c in comments:
+        if c.get('id'):
+            await db.comments.update_one({"id": c['id']}, {"$setOnInsert": {**c, "pin_id": pin['id']}}, upsert=True)
+    await db.pins.update_one(
+        {"id": pin['id'], "comment_count": {"$exists": False}},
+        {"$set": {"comment_count": len(comments), "comments": comments[-COMMENT_PREVIEW_SIZE:]}}
+    )
+
 @api_router.post("/pins/{pin_id}/comments")
-async def add_comment(pin_id: str, comment: Comment, current_user: dict = Depends(get_current_user)):
-    pin = await db.pins.find_one({"id": pin_id})
+async def add_comment(pin_id: str, comment: Comment, current_user: dict = Depends(get_writing_user)):
+    pin = await db.pins.find_one({"id": pin_id}, {"id": 1, "comment_count": 1})
     if not pin:
         raise HTTPException(status_code=404, detail="Pin not found")
+    await migrate_pin_comments(pin)
 
     new_comment = {
         "id": str(uuid.uuid4()),
@@ -546,29 +1921,60 @@ async def add_comment(pin_id: str, comment: Comment, current_user: dict = Depend
         "created_at": datetime.now(timezone.utc).isoformat()
     }
 
-    await db.pins.update_one({"id": pin_id}, {"$push": {"comments": new_comment}})
+    await db.comments.insert_one({**new_comment, "pin_id": pin_id})
+    await db.pins.update_one(
+        {"id": pin_id},
+        {
+            "$inc": {"comment_count": 1},
+            "$push": {"comments": {"$each": [new_comment], "$slice": -COMMENT_PREVIEW_SIZE}}
+        }
+    )
     return new_comment
 
+@api_router.get("/pins/{pin_id}/comments")
+async def get_comments(
+    pin_id: str,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Comments newest first; X-Next-Cursor is passed back as cursor for older ones."""
+    pin = await db.pins.find_one({"id": pin_id}, {"id": 1, "privacy": 1, "user_id": 1, "comment_count": 1})
+    if not pin:
+        raise HTTPException(status_code=404, detail="Pin not found")
+    check_pin_access(pin, current_user)
+    await migrate_pin_comments(pin)
+
+    query = after_cursor({"pin_id": pin_id}, cursor, "created_at", descending=True)
+    comments = await db.comments.find(query, {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    return paginate(response, comments, limit, "created_at")
+
 @api_router.delete("/pins/{pin_id}/comments/{comment_id}")
 async def delete_comment(pin_id: str, comment_id: str, current_user: dict = Depends(get_current_user)):
-    pin = await db.pins.find_one({"id": pin_id})
+    pin = await db.pins.find_one({"id": pin_id}, {"id": 1, "user_id": 1, "comment_count": 1, "comments.id": 1})
     if not pin:
         raise HTTPException(status_code=404, detail="Pin not found")
 
     if pin['user_id'] != current_user['id']:
         raise HTTPException(status_code=403, detail="Not authorized to delete comments on this pin")
-
-    # Remove the comment from the comments array
-    await db.pins.update_one(
-        {"id": pin_id},
-        {"$pull": {"comments": {"id": comment_id}}}
-    )
+    await migrate_pin_comments(pin)
+
+    result = await db.comments.delete_one({"id": comment_id, "pin_id": pin_id})
+    if result.deleted_count:
+        await db.pins.update_one({"id": pin_id}, {"$inc": {"comment_count": -1}})
+        # Backfill the preview from the collection if the deleted comment was in it
+        if any(c.get('id') == comment_id for c in pin.get('comments', [])):
+            await refresh_comment_preview(pin_id)
     return {"message": "Comment deleted"}
 
 # ===== Media Routes =====
 @api_router.post("/pins/{pin_id}/media")
 async def upload_media(
     pin_id: str,
+    request: Request,
     file: UploadFile = File(...),
     caption: Optional[str] = Form(None),
     current_user: dict = Depends(get_current_user)
@@ -588,12 +1994,13 @@ async def upload_media(
     else:
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    # Upload to GridFS
-    file_content = await file.read()
-    file_id = await fs.upload_from_stream(
+    # Stream into GridFS
+    file_id, size = await stream_upload_to_gridfs(
+        file,
         file.filename or "uploaded_file",
-        file_content,
-        metadata={"content_type": content_type}
+        content_type,
+        MAX_UPLOAD_BYTES[media_type],
+        request
     )
     
     # Create media record
@@ -602,18 +2009,38 @@ async def upload_media(
         user_id=current_user['id'],
         file_id=str(file_id),
         media_type=media_type,
+        content_type=content_type,
+        size=size,
         caption=caption
     )
-    await db.media.insert_one(media.model_dump())
+    try:
+        await db.media.insert_one(media.model_dump())
+    except PyMongoError:
+        # Don't leave an unreferenced GridFS file behind
+        await fs.delete(file_id)
+        raise
     
     # Update pin media count
     await db.pins.update_one({"id": pin_id}, {"$inc": {"media_count": 1}})
+
+    if media_type == "photo":
+        schedule_derivatives(media.id, str(file_id))
     
     return media.model_dump()
 
 @api_router.get("/pins/{pin_id}/media")
-async def get_media(pin_id: str, current_user: dict = Depends(get_current_user)):
-    media_list = await db.media.find({"pin_id": pin_id}).to_list(1000)
+async def get_media(
+    pin_id: str,
+    response: Response,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    query = after_cursor({"pin_id": pin_id}, cursor, "created_at", descending=False)
+    media_list = await db.media.find(query).sort(
+        [("created_at", 1), ("id", 1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    media_list = paginate(response, media_list, limit, "created_at")
 
     # Convert GridFS files to base64
     result = []
@@ -642,6 +2069,22 @@ async def get_media(pin_id: str, current_user: dict = Depends(get_current_user))
 
     return result
 
+@api_router.api_route("/media/{media_id}/raw", methods=["GET", "HEAD"])
+async def get_media_raw(media_id: str, request: Request, sig: str = "", variant: Optional[str] = None):
+    # Authorized by the signed URL handed out in media descriptors
+    if not verify_media_signature(media_id, sig):
+        raise HTTPException(status_code=403, detail="Invalid media signature")
+    media = await db.media.find_one({"id": media_id}, {"file_id": 1, "content_type": 1, "derivatives": 1})
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    derivative = (media.get('derivatives') or {}).get(variant) if variant else None
+    if derivative:
+        return await stream_grid_file(request, derivative['file_id'], derivative.get('content_type'))
+    # Unknown or not-yet-generated variants fall back to the original, uncached under this URL
+    cache_control = "public, no-cache" if variant else IMMUTABLE_CACHE_CONTROL
+    return await stream_grid_file(request, media['file_id'], media.get('content_type'), cache_control)
+
 @api_router.delete("/media/{media_id}")
 async def delete_media(media_id: str, current_user: dict = Depends(get_current_user)):
     media = await db.media.find_one({"id": media_id})
@@ -650,11 +2093,12 @@ async def delete_media(media_id: str, current_user: dict = Depends(get_current_u
     if media['user_id'] != current_user['id']:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Delete from GridFS
-    try:
-        await fs.delete(ObjectId(media['file_id']))
-    except:
-        pass
+    # Delete original and derivatives from GridFS
+    for file_id in media_file_ids(media):
+        try:
+            await fs.delete(file_id)
+        except:
+            pass
     
     await db.media.delete_one({"id": media_id})
     
@@ -666,11 +2110,13 @@ async def delete_media(media_id: str, current_user: dict = Depends(get_current_u
 # ===== Friend Routes =====
 @api_router.post("/friends/request/{user_id}")
 async def send_friend_request(user_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user.get('is_guest', False):
+        raise HTTPException(status_code=403, detail="Guests cannot add friends")
     if user_id == current_user['id']:
         raise HTTPException(status_code=400, detail="Cannot add yourself")
     
     target_user = await db.users.find_one({"id": user_id})
-    if not target_user:
+    if not target_user or target_user.get('is_guest', False):
         raise HTTPException(status_code=404, detail="User not found")
     
     # Check if already friends
@@ -682,11 +2128,14 @@ async def send_friend_request(user_id: str, current_user: dict = Depends(get_cur
         {"id": user_id},
         {"$addToSet": {"friend_requests": current_user['id']}}
     )
+    invalidate_user(user_id)
     
     return {"message": "Friend request sent"}
 
 @api_router.post("/friends/accept/{user_id}")
 async def accept_friend_request(user_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user.get('is_guest', False):
+        raise HTTPException(status_code=403, detail="Guests cannot add friends")
     # Check if request exists
     if user_id not in current_user.get('friend_requests', []):
         raise HTTPException(status_code=400, detail="No friend request found")
@@ -703,18 +2152,28 @@ async def accept_friend_request(user_id: str, current_user: dict = Depends(get_c
         {"id": user_id},
         {"$addToSet": {"friends": current_user['id']}}
     )
+    invalidate_user(current_user['id'], user_id)
     
     return {"message": "Friend request accepted"}
 
 @api_router.get("/friends")
-async def get_friends(current_user: dict = Depends(get_current_user)):
-    friend_ids = current_user.get('friends', [])
-    friends = await db.users.find({"id": {"$in": friend_ids}}).to_list(1000)
+async def get_friends(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    # Ordered by id alone: the set is bounded by the caller's friends list and
+    # older user documents may lack created_at
+    query = {"id": {"$in": current_user.get('friends', [])}}
+    if cursor:
+        query["id"]["$gt"] = decode_cursor(cursor, 1)[0]
+    friends = await db.users.find(query).sort("id", 1).limit(limit + 1).to_list(limit + 1)
     for f in friends:
         f.pop('_id', None)
         f.pop('password_hash', None)
         f.pop('password', None)
-    return friends
+    return paginate(response, friends, limit, None)
 
 @api_router.get("/friends/requests")
 async def get_friend_requests(current_user: dict = Depends(get_current_user)):
@@ -728,39 +2187,59 @@ async def get_friend_requests(current_user: dict = Depends(get_current_user)):
 
 # ===== User Search =====
 @api_router.get("/users/search")
-async def search_users(q: str, current_user: dict = Depends(get_current_user)):
-    users = await db.users.find(
-        {
-            "$or": [
-                {"username": {"$regex": q, "$options": "i"}},
-                {"email": {"$regex": q, "$options": "i"}}
-            ],
-            "id": {"$ne": current_user['id']}
-        }
-    ).limit(20).to_list(20)
-    for u in users:
-        u.pop('_id', None)
-        u.pop('password_hash', None)
-        u.pop('password', None)
-    return users
+async def search_users(
+    q: str,
+    response: Response,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    match: str = Query("auto", pattern="^(auto|exact|fuzzy)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    q = q.strip()
+    if not q:
+        return []
+
+    async def exact():
+        # Case-insensitive regexes cannot bound an index scan, so usernames are
+        # matched lowercased: an anchored, case-sensitive prefix on username_lower
+        # scans only the matching index range. Emails match exactly
+        return await db.users.find(
+            {
+                "$or": [
+                    {"username_lower": {"$regex": f"^{re.escape(q.lower())}"}},
+                    {"email": {"$in": [q, q.lower()]}}
+                ],
+                "id": {"$ne": current_user['id']}
+            },
+            USER_SEARCH_FIELDS
+        ).skip(offset).limit(limit).to_list(limit)
+
+    async def fuzzy():
+        # One extra so excluding the caller still fills the page
+        users = await fuzzy_search("users", q, limit + 1, offset, USER_SEARCH_FIELDS)
+        return [u for u in users if u['id'] != current_user['id']][:limit]
+
+    return await run_search(response, match, offset, exact, fuzzy)
 
 # ===== Profile Picture Routes =====
 @api_router.post("/users/profile-picture")
 async def upload_profile_picture(
+    request: Request,
     file: UploadFile = File(...),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_writing_user)
 ):
     # Determine media type
     content_type = file.content_type or ""
     if not content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="Invalid file type. Only images allowed.")
 
-    # Upload to GridFS
-    file_content = await file.read()
-    file_id = await fs.upload_from_stream(
+    # Stream into GridFS
+    file_id, _ = await stream_upload_to_gridfs(
+        file,
         file.filename or "profile_picture",
-        file_content,
-        metadata={"content_type": content_type}
+        content_type,
+        MAX_UPLOAD_BYTES["avatar"],
+        request
     )
 
     # Update user profile
@@ -768,6 +2247,7 @@ async def upload_profile_picture(
         {"id": current_user['id']},
         {"$set": {"profile_photo": str(file_id)}}
     )
+    invalidate_user(current_user['id'])
 
     return {"message": "Profile picture updated", "file_id": str(file_id)}
 
@@ -787,6 +2267,118 @@ async def get_profile_picture(user_id: str):
         logging.error(f"Error retrieving profile picture: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving profile picture")
 
+@api_router.api_route("/users/{user_id}/profile-picture/raw", methods=["GET", "HEAD"])
+async def get_profile_picture_raw(user_id: str, request: Request, v: Optional[str] = None):
+    user = await db.users.find_one({"id": user_id}, {"profile_photo": 1})
+    if not user or not user.get('profile_photo'):
+        raise HTTPException(status_code=404, detail="Profile picture not found")
+
+    # ?v=<file id> pins a specific photo and may be cached forever; the bare URL
+    # follows the user's current photo and must be revalidated.
+    cache_control = IMMUTABLE_CACHE_CONTROL if v == user['profile_photo'] else "public, no-cache"
+    return await stream_grid_file(request, user['profile_photo'], cache_control=cache_control)
+
+# ===== Conversations =====
+# One document per pair of users, keyed by the sorted pair, holding the latest
+# message preview and each participant's unread count
+# Conversation ids known to have no unstamped messages, least recently used first.
+# Forgetting one only costs an update_many that matches nothing
+_stamped_conversations = OrderedDict()
+STAMPED_CONVERSATIONS_SIZE = 10000
+
+async def stamp_conversation(conversation: str, user_a: str, user_b: str) -> None:
+    """Give a pair's legacy messages their conversation_id (same as manage.py stamp-conversations)."""
+    if conversation in _stamped_conversations:
+        _stamped_conversations.move_to_end(conversation)
+        return
+    await db.messages.update_many(
+        {
+            "$or": [
+                {"sender_id": user_a, "recipient_id": user_b},
+                {"sender_id": user_b, "recipient_id": user_a}
+            ],
+            "conversation_id": None
+        },
+        {"$set": {"conversation_id": conversation}}
+    )
+    _stamped_conversations[conversation] = True
+    if len(_stamped_conversations) > STAMPED_CONVERSATIONS_SIZE:
+        _stamped_conversations.popitem(last=False)
+
+async def record_conversation_message(message: dict) -> None:
+    """Fold a new message into its conversation in one atomic update."""
+    sender, recipient = message['sender_id'], message['recipient_id']
+    # An update pipeline reads "$..." strings as field paths, so every stored
+    # value goes in as a $literal; a username like "$unread" stays a username
+    created_at = {"$literal": message['created_at']}
+    newer = {"$gt": [created_at, {"$ifNull": ["$updated_at", ""]}]}
+    await db.conversations.update_one(
+        {"id": conversation_id(sender, recipient)},
+        [{"$set": {
+            "participants": {"$literal": sorted((sender, recipient))},
+            f"usernames.{sender}": {"$literal": message['sender_username']},
+            f"usernames.{recipient}": {"$literal": message['recipient_username']},
+            # Concurrent sends may commit out of order; keep the newest preview
+            "last_message": {"$cond": [newer, {"$literal": message_preview(message)}, "$last_message"]},
+            "updated_at": {"$cond": [newer, created_at, "$updated_at"]},
+            f"unread.{recipient}": {"$add": [{"$ifNull": [f"$unread.{recipient}", 0]}, 1]},
+        }}],
+        upsert=True
+    )
+
+# ===== Message Storage =====
+# One document per message, or buckets of messages, per MESSAGE_STORAGE
+async def store_message(message: dict) -> None:
+    if MESSAGE_STORAGE == "buckets":
+        query, update = bucket_append(message, MESSAGE_BUCKET_SIZE)
+        await db.message_buckets.update_one(query, update, upsert=True)
+    else:
+        await db.messages.insert_one(dict(message))  # a copy, so the caller's dict gets no _id
+
+async def message_history(conversation: str, limit: int, before: Optional[list]) -> List[dict]:
+    """Up to `limit` messages of a conversation older than the (created_at, id) `before`, newest first."""
+    if MESSAGE_STORAGE == "buckets":
+        collector = PageCollector(limit, before)
+        async for bucket in db.message_buckets.find(bucket_query(conversation, before), {"_id": 0}).sort("end", -1):
+            if collector.add(bucket):
+                break
+        return collector.page()
+    query = {"conversation_id": conversation}
+    if before:
+        query = {"$and": [query, keyset_filter("created_at", before[0], before[1], descending=True)]}
+    return await db.messages.find(query, {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(limit).to_list(limit)
+
+async def messages_after(user_id: str, value: str, last_id: str, limit: int) -> List[dict]:
+    """Up to `limit` messages to or from user_id after the (created_at, id) cursor, oldest first."""
+    if MESSAGE_STORAGE == "buckets":
+        # Only conversations active since the cursor can have newer messages
+        conversations = await db.conversations.distinct("id", {"participants": user_id, "updated_at": {"$gte": value}})
+        messages = []
+        async for bucket in db.message_buckets.find(
+            {"conversation_id": {"$in": conversations}, "end": {"$gte": value}}, {"_id": 0}
+        ):
+            messages.extend(m for m in bucket['messages'] if (m['created_at'], m['id']) > (value, last_id))
+        messages.sort(key=lambda m: (m['created_at'], m['id']))
+        return messages[:limit]
+    query = {"$or": [{"sender_id": user_id}, {"recipient_id": user_id}]}
+    return await db.messages.find(
+        {"$and": [query, keyset_filter("created_at", value, last_id, descending=False)]}, {"_id": 0}
+    ).sort([("created_at", 1), ("id", 1)]).limit(limit).to_list(limit)
+
+async def mark_read(conversation: str, sender_id: str, reader_id: str) -> int:
+    unread = {"sender_id": sender_id, "recipient_id": reader_id, "read": False}
+    if MESSAGE_STORAGE == "buckets":
+        result = await db.message_buckets.update_many(
+            {"conversation_id": conversation, "messages": {"$elemMatch": unread}},
+            {"$set": {"messages.$[m].read": True}},
+            array_filters=[{f"m.{k}": v for k, v in unread.items()}]
+        )
+    else:
+        result = await db.messages.update_many(unread, {"$set": {"read": True}})
+    return result.modified_count
+
 # ===== Message Routes =====
 @api_router.post("/messages")
 async def send_message(message_data: MessageCreate, current_user: dict = Depends(get_current_user)):
@@ -804,102 +2396,283 @@ async def send_message(message_data: MessageCreate, current_user: dict = Depends
         sender_username=current_user['username'],
         recipient_id=message_data.recipient_id,
         recipient_username=recipient['username'],
+        conversation_id=conversation_id(current_user['id'], message_data.recipient_id),
         content=message_data.content
     )
 
-    await db.messages.insert_one(message.model_dump())
+    message_doc = message.model_dump()
+    await store_message(message_doc)
+    await record_conversation_message(message_doc)
+    await publish_message(message_doc)
     return message
 
 @api_router.get("/messages/{friend_id}")
-async def get_messages(friend_id: str, current_user: dict = Depends(get_current_user)):
+async def get_messages(
+    friend_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=1000),
+    before: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """The newest `limit` messages with a friend, oldest first within the page.
+
+    X-Next-Cursor, passed back as `before`, fetches the page of older messages.
+    """
     # Check if friend_id is actually a friend
     if friend_id not in current_user.get('friends', []):
         raise HTTPException(status_code=403, detail="Can only view messages with friends")
 
-    # Get messages between current user and friend
-    messages = await db.messages.find(
-        {
-            "$or": [
-                {"sender_id": current_user['id'], "recipient_id": friend_id},
-                {"sender_id": friend_id, "recipient_id": current_user['id']}
-            ]
-        }
-    ).sort("created_at", 1).to_list(1000)
-    for m in messages:
-        m.pop('_id', None)
+    conversation = conversation_id(current_user['id'], friend_id)
+    if MESSAGE_STORAGE == "documents":
+        await stamp_conversation(conversation, current_user['id'], friend_id)
+    messages = await message_history(conversation, limit + 1, decode_cursor(before, 2) if before else None)
+    return paginate(response, messages, limit, "created_at")[::-1]
 
-    return messages
+@api_router.post("/messages/{friend_id}/read")
+async def mark_messages_read(friend_id: str, current_user: dict = Depends(get_current_user)):
+    """Mark everything friend_id sent the current user as read and reset the unread count"""
+    if friend_id not in current_user.get('friends', []):
+        raise HTTPException(status_code=403, detail="Can only view messages with friends")
+
+    # Counter first: a message landing in between is then counted but already
+    # read (corrected on the next read) rather than unread with a zero count
+    await db.conversations.update_one(
+        {"id": conversation_id(current_user['id'], friend_id)},
+        {"$set": {f"unread.{current_user['id']}": 0}}
+    )
+    # Counts documents updated: messages, or buckets in bucket storage
+    marked = await mark_read(conversation_id(current_user['id'], friend_id), friend_id, current_user['id'])
+    return {"marked": marked}
 
 @api_router.get("/messages")
-async def get_conversations(current_user: dict = Depends(get_current_user)):
-    # Get all conversations (latest message from each friend)
-    pipeline = [
-        {
-            "$match": {
-                "$or": [
-                    {"sender_id": current_user['id']},
-                    {"recipient_id": current_user['id']}
-                ]
-            }
-        },
-        {
-            "$sort": {"created_at": -1}
-        },
-        {
-            "$group": {
-                "_id": {
-                    "$cond": {
-                        "if": {"$eq": ["$sender_id", current_user['id']]},
-                        "then": "$recipient_id",
-                        "else": "$sender_id"
-                    }
-                },
-                "latest_message": {"$first": "$$ROOT"}
-            }
-        },
-        {
-            "$replaceRoot": {"newRoot": "$latest_message"}
-        }
-    ]
+async def get_conversations(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """The current user's conversations, most recently active first"""
+    query = after_cursor({"participants": current_user['id']}, cursor, "updated_at", descending=True)
+    docs = await db.conversations.find(query, {"_id": 0}).sort(
+        [("updated_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    conversations = []
+    for doc in docs:
+        friend_id = next((p for p in doc['participants'] if p != current_user['id']), current_user['id'])
+        conversations.append({
+            "id": doc['id'],
+            "friend_id": friend_id,
+            "friend_username": doc.get('usernames', {}).get(friend_id),
+            "last_message": doc.get('last_message'),
+            "updated_at": doc['updated_at'],
+            "unread_count": doc.get('unread', {}).get(current_user['id'], 0),
+        })
+    return paginate(response, conversations, limit, "updated_at")
+
+# ===== Realtime =====
+hub = Hub(MongoBroker(db) if REALTIME_BROKER == "mongo" else LocalBroker())
+
+def message_event(message: dict) -> dict:
+    # cursor is what the client passes back as `since` when it reconnects
+    return {"type": "message", "message": message, "cursor": encode_cursor(message['created_at'], message['id'])}
+
+async def publish_message(message: dict) -> None:
+    # Both sides: the sender may have the conversation open on other devices
+    try:
+        await hub.publish([message['recipient_id'], message['sender_id']], message_event(message))
+    except PyMongoError as e:
+        logger.warning(f"Failed to publish message {message['id']}, clients will catch up on reconnect: {e}")
+
+async def websocket_user(token: Optional[str]) -> Optional[dict]:
+    if not token:
+        return None
+    try:
+        payload = decode_token(token)
+    except HTTPException:
+        return None
+    if payload.get('is_guest'):
+        return guest_from_token(payload)
+    return await get_cached_user(payload['user_id'])
+
+async def receive_auth_frame(websocket: WebSocket) -> Optional[str]:
+    """Token from a {"type": "auth", "token": ...} first frame, sent by clients without the cookie."""
+    try:
+        data = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT))
+    except (asyncio.TimeoutError, WebSocketDisconnect, ValueError, KeyError, RuntimeError):
+        return None
+    if not isinstance(data, dict) or data.get("type") != "auth" or not isinstance(data.get("token"), str):
+        return None
+    return data["token"]
+
+async def send_catchup(websocket: WebSocket, user_id: str, since: str) -> set:
+    """Send every message to or from user_id after the `since` cursor, oldest first; returns their ids."""
+    value, last_id = decode_cursor(since, 2)
+    sent = set()
+    while True:
+        page = await messages_after(user_id, value, last_id, WS_CATCHUP_PAGE)
+        for message in page:
+            await websocket.send_json(message_event(message))
+            sent.add(message['id'])
+        if len(page) < WS_CATCHUP_PAGE:
+            return sent
+        value, last_id = page[-1]['created_at'], page[-1]['id']
+
+async def _ws_send_loop(websocket: WebSocket, connection, skip: set) -> None:
+    while True:
+        try:
+            event = await asyncio.wait_for(connection.queue.get(), WS_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            event = {"type": "ping"}
+        # Published while catch-up was running, so already sent
+        if event.get('type') == "message" and event['message']['id'] in skip:
+            continue
+        await websocket.send_json(event)
+
+async def _ws_receive_loop(websocket: WebSocket) -> None:
+    # Any client frame (normally a pong) proves the connection is alive
+    while True:
+        message = await asyncio.wait_for(websocket.receive(), WS_IDLE_TIMEOUT)
+        if message["type"] == "websocket.disconnect":
+            return
+
+@api_router.websocket("/ws")
+async def realtime_socket(websocket: WebSocket, since: Optional[str] = None):
+    """Push channel for new messages; replaces polling GET /api/messages/{friend_id}.
+
+    Authenticated by the login cookie or, failing that, a first frame
+    {"type": "auth", "token": ...}. Events are JSON: {"type": "message",
+    "message": ..., "cursor": ...} and {"type": "ping"}, which the client
+    answers with any frame. Reconnect with ?since=<last cursor> to receive what
+    was sent in between.
+    """
+    # Browsers cannot set headers on a WebSocket, so the token comes from the login
+    # cookie or the first frame, never the URL, which ends up in access logs.
+    # Cookies ride along cross-site, so check Origin
+    origin = websocket.headers.get("origin")
+    if origin and not is_origin_allowed(origin):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    user = await websocket_user(websocket.cookies.get("token"))
+    await websocket.accept()
+    if not user:
+        user = await websocket_user(await receive_auth_frame(websocket))
+        if not user:
+            try:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            except RuntimeError:
+                pass  # already closed
+            return
+
+    # Subscribe before catching up so nothing published in between is missed
+    connection = hub.connect(user['id'], WS_QUEUE_SIZE)
+    tasks = []
+    code = status.WS_1000_NORMAL_CLOSURE
+    try:
+        skip = set()
+        if since:
+            try:
+                skip = await send_catchup(websocket, user['id'], since)
+            except HTTPException:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid cursor")
+                return
+        tasks = [
+            asyncio.create_task(_ws_send_loop(websocket, connection, skip)),
+            asyncio.create_task(_ws_receive_loop(websocket)),
+            asyncio.create_task(connection.overflowed.wait()),
+        ]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        errors = {task: task.exception() for task in done}
+        if tasks[2] in done:
+            # Too far behind: drop the backlog; the client resumes from its cursor
+            code = status.WS_1013_TRY_AGAIN_LATER
+        elif isinstance(errors.get(tasks[1]), asyncio.TimeoutError):
+            code = status.WS_1001_GOING_AWAY
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        hub.disconnect(connection)
+        for task in tasks:
+            task.cancel()
+    try:
+        await websocket.close(code=code)
+    except RuntimeError:
+        pass  # already closed
+
+# ===== Tile Routes =====
+@api_router.get("/tiles/pins/{z}/{x}/{y}.mvt")
+async def get_pin_tile(z: int, x: int, y: int, request: Request):
+    # Public pins and events only, so tiles need no auth and can be shared by caches
+    if not 0 <= z <= 22 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+
+    cacheable = z <= TILE_CACHE_MAX_ZOOM
+    data = await asyncio.to_thread(tile_cache.get, z, x, y) if cacheable else None
+    if data is None:
+        # Taken before the render reads Mongo: a pin write that lands meanwhile
+        # invalidates the tile, and the stale render is then served but not cached
+        generation = tile_cache.generation(z, x, y)
+        data = await render_tile(z, x, y)
+        if cacheable:
+            try:
+                await asyncio.to_thread(tile_cache.put, z, x, y, data, generation)
+            except OSError as e:
+                logging.error(f"Error caching tile {z}/{x}/{y}: {e}")
 
-    conversations = await db.messages.aggregate(pipeline).to_list(100)
-    return conversations
+    etag = f'"{hashlib.md5(data).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=60"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=MVT_CONTENT_TYPE, headers=headers)
 
 # ===== Event Routes =====
 @api_router.post("/events", response_model=Event)
-async def create_event(event_data: EventCreate, current_user: dict = Depends(get_current_user)):
+async def create_event(event_data: EventCreate, current_user: dict = Depends(get_writing_user)):
     event = Event(
         user_id=current_user['id'],
         username=current_user['username'],
+        location=geo_point(event_data.latitude, event_data.longitude),
         **event_data.model_dump()
     )
-    await db.events.insert_one(event.model_dump())
+    event_doc = event.model_dump()
+    await db.events.insert_one(event_doc)
+    update_search_index("events", event_doc)
+    suggest_update("location", "add", event.location_name, "", 1)
+    await invalidate_tiles(event.latitude, event.longitude)
     return event
 
 @api_router.get("/events")
-async def get_events(current_user: dict = Depends(get_current_user)):
-    events = await db.events.find({}).sort("event_date", 1).to_list(1000)
-    for e in events:
-        e.pop('_id', None)
-    return events
+async def get_events(
+    response: Response,
+    limit: int = Query(1000, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    query = after_cursor({}, cursor, "event_date", descending=False)
+    events = await db.events.find(query, {"_id": 0}).sort(
+        [("event_date", 1), ("id", 1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    return paginate(response, events, limit, "event_date")
 
 @api_router.get("/events/search")
-async def search_events(q: str, current_user: dict = Depends(get_current_user)):
-    """Search events by title, description, or location"""
-    query = {
-        "$or": [
-            {"title": {"$regex": q, "$options": "i"}},
-            {"description": {"$regex": q, "$options": "i"}},
-            {"location_name": {"$regex": q, "$options": "i"}}
-        ]
-    }
-    events = await db.events.find(query).sort("event_date", 1).limit(50).to_list(50)
-    for e in events:
-        e.pop('_id', None)
-    return events
+async def search_events(
+    q: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    match: str = Query("auto", pattern="^(auto|exact|fuzzy)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Search events by title, description, or location, most relevant first"""
+    return await run_search(
+        response,
+        match,
+        offset,
+        lambda: text_search("events", q, limit, offset),
+        lambda: fuzzy_search("events", q, limit, offset),
+    )
 
 @api_router.post("/events/{event_id}/attend")
-async def attend_event(event_id: str, current_user: dict = Depends(get_current_user)):
+async def attend_event(event_id: str, current_user: dict = Depends(get_writing_user)):
     event = await db.events.find_one({"id": event_id})
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
@@ -913,42 +2686,254 @@ async def attend_event(event_id: str, current_user: dict = Depends(get_current_u
     await db.events.update_one({"id": event_id}, {"$set": {"attendees": attendees}})
     return {"attendees": len(attendees), "attending": current_user['id'] in attendees}
 
+# ===== Guest Cleanup =====
+async def purge_guests(guest_ids: List[str]) -> None:
+    """Remove guests and everything they left behind: pins, media, comments, likes, events, friend requests."""
+    async for pin in db.pins.find({"user_id": {"$in": guest_ids}}):
+        await remove_pin(pin)
+
+    # Comments on other users' pins: recount and refresh each affected preview
+    commented = await db.comments.distinct("pin_id", {"user_id": {"$in": guest_ids}})
+    await db.comments.delete_many({"user_id": {"$in": guest_ids}})
+    for pin_id in commented:
+        count = await db.comments.count_documents({"pin_id": pin_id})
+        await db.pins.update_one({"id": pin_id}, {"$set": {"comment_count": count}})
+        await refresh_comment_preview(pin_id)
+
+    # Recomputed from the array, so a concurrent purge of the same batch is harmless
+    await db.pins.update_many({"likes": {"$in": guest_ids}}, [
+        {"$set": {"likes": {"$setDifference": ["$likes", {"$literal": guest_ids}]}}},
+        {"$set": {"like_count": {"$size": "$likes"}}},
+    ])
+
+    async for event in db.events.find({"user_id": {"$in": guest_ids}}, {"id": 1, "latitude": 1, "longitude": 1, "location_name": 1}):
+        await db.events.delete_one({"_id": event['_id']})
+        update_search_index("events", event, removed=True)
+        suggest_update("location", "add", event.get('location_name') or "", "", -1)
+        await invalidate_tiles(event['latitude'], event['longitude'])
+    await db.events.update_many({"attendees": {"$in": guest_ids}}, {"$pull": {"attendees": {"$in": guest_ids}}})
+
+    # Requests guests sent before friend actions were closed to them
+    requested = await db.users.distinct("id", {"friend_requests": {"$in": guest_ids}})
+    if requested:
+        await db.users.update_many({"id": {"$in": requested}}, {"$pull": {"friend_requests": {"$in": guest_ids}}})
+        invalidate_user(*requested)
+
+    async for user in db.users.find({"id": {"$in": guest_ids}, "profile_photo": {"$ne": None}}, {"profile_photo": 1}):
+        try:
+            await fs.delete(ObjectId(user['profile_photo']))
+        except Exception:
+            pass
+    await db.users.delete_many({"id": {"$in": guest_ids}, "is_guest": True})
+
+async def purge_expired_guests() -> int:
+    now = datetime.now(timezone.utc)
+    purged = 0
+    while True:
+        batch = await db.users.find(
+            {"is_guest": True, "expires_at": {"$lt": now}}, {"_id": 0, "id": 1}
+        ).limit(GUEST_PURGE_BATCH).to_list(GUEST_PURGE_BATCH)
+        if not batch:
+            return purged
+        await purge_guests([u['id'] for u in batch])
+        purged += len(batch)
+
+async def guest_purge_loop() -> None:
+    while True:
+        try:
+            purged = await purge_expired_guests()
+            if purged:
+                logger.info(f"Purged {purged} expired guest users")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Guest purge failed")
+        await asyncio.sleep(GUEST_PURGE_INTERVAL)
+
+# ===== Trending =====
+# Snapshots per window are served from memory; a background task recomputes them
+# every TRENDING_REFRESH_SECONDS, and concurrent refreshes share a single run.
+_trending = {}  # window -> {"pins": [...], "refreshed_at": iso}
+_trending_refresh = {"task": None}
+
+def trending_score_expr(now: datetime) -> dict:
+    """(likes + TRENDING_COMMENT_WEIGHT * comments), halved every TRENDING_HALF_LIFE_HOURS of age."""
+    created = {"$dateFromString": {"dateString": "$created_at", "onError": now, "onNull": now}}
+    age_ms = {"$max": [{"$subtract": [now, created]}, 0]}
+    engagement = {"$add": [
+        {"$ifNull": ["$like_count", 0]},
+        {"$multiply": [TRENDING_COMMENT_WEIGHT, {"$ifNull": ["$comment_count", {"$size": {"$ifNull": ["$comments", []]}}]}]},
+    ]}
+    return {"$multiply": [engagement, {"$pow": [0.5, {"$divide": [age_ms, TRENDING_HALF_LIFE_HOURS * 3600 * 1000]}]}]}
+
+async def _compute_trending(window: str, now: datetime) -> List[dict]:
+    # Every pin in the window is scored with its decay applied, so new and
+    # comment-heavy pins compete with long-liked ones. Beyond a few half-lives
+    # nothing can catch up, which bounds the scan for the "all" window.
+    horizon = timedelta(hours=TRENDING_HALF_LIFE_HOURS * TRENDING_HORIZON_HALF_LIVES)
+    if TRENDING_WINDOWS[window] is not None:
+        horizon = min(horizon, TRENDING_WINDOWS[window])
+    ranked = await db.pins.aggregate([
+        {"$match": {"privacy": "public", "created_at": {"$gte": (now - horizon).isoformat()}}},
+        {"$project": {"_id": 0, "id": 1, "created_at": 1, "score": trending_score_expr(now)}},
+        {"$sort": {"score": -1, "created_at": -1}},
+        {"$limit": TRENDING_SIZE},
+    ]).to_list(TRENDING_SIZE)
+    ids = [c['id'] for c in ranked]
+    docs = {d['id']: d for d in await db.pins.find({"id": {"$in": ids}}, {"_id": 0}).to_list(len(ids))}
+    return [docs[i] for i in ids if i in docs]
+
+async def _refresh_trending() -> None:
+    now = datetime.now(timezone.utc)
+    for window in TRENDING_WINDOWS:
+        snapshot = {"pins": await _compute_trending(window, now), "refreshed_at": now.isoformat()}
+        _trending[window] = snapshot
+        if TRENDING_PERSIST:
+            await db.trending.replace_one({"_id": window}, snapshot, upsert=True)
+
+def refresh_trending() -> asyncio.Task:
+    """Start a refresh, or join the one already running."""
+    task = _trending_refresh["task"]
+    if task is None or task.done():
+        task = asyncio.create_task(_refresh_trending())
+        _trending_refresh["task"] = task
+    return task
+
+async def load_persisted_trending() -> None:
+    async for snapshot in db.trending.find({"_id": {"$in": list(TRENDING_WINDOWS)}}):
+        window = snapshot.pop('_id')
+        _trending.setdefault(window, snapshot)
+
+async def trending_refresh_loop() -> None:
+    if TRENDING_PERSIST:
+        try:
+            await load_persisted_trending()
+        except PyMongoError:
+            logger.exception("Failed to load persisted trending snapshot")
+    while True:
+        try:
+            await asyncio.shield(refresh_trending())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Trending refresh failed")
+        await asyncio.sleep(TRENDING_REFRESH_SECONDS)
+
 # ===== Discovery Routes =====
 @api_router.get("/discover/trending")
-async def get_trending(current_user: dict = Depends(get_current_user)):
-    # Get public pins sorted by likes
-    pipeline = [
-        {"$match": {"privacy": "public"}},
-        {"$addFields": {"like_count": {"$size": "$likes"}}},
-        {"$sort": {"like_count": -1, "created_at": -1}},
-        {"$limit": 50}
-    ]
-    trending = await db.pins.aggregate(pipeline).to_list(50)
-    for t in trending:
-        t.pop('_id', None)
-    return trending
+async def get_trending(
+    window: str = Query("all", pattern="^(24h|7d|all)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    snapshot = _trending.get(window)
+    if snapshot is None:
+        # Cold start: wait for the first refresh (shared with any concurrent callers)
+        await asyncio.shield(refresh_trending())
+        snapshot = _trending.get(window, {"pins": []})
+    return snapshot['pins']
 
 @api_router.get("/discover/nearby")
-async def get_nearby(lat: float, lng: float, radius_km: float = 10, current_user: dict = Depends(get_current_user)):
-    # Simple distance calculation (for production, use geospatial queries)
-    all_pins = await db.pins.find({"privacy": "public"}).to_list(1000)
-    
-    nearby = []
-    for pin in all_pins:
-        # Haversine formula approximation
-        lat_diff = abs(pin['latitude'] - lat)
-        lng_diff = abs(pin['longitude'] - lng)
-        distance = ((lat_diff ** 2 + lng_diff ** 2) ** 0.5) * 111  # rough km
-        if distance <= radius_km:
-            pin['distance'] = round(distance, 2)
-            nearby.append(pin)
-    
-    nearby.sort(key=lambda x: x['distance'])
-    return nearby[:50]
+async def get_nearby(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(10, gt=0, le=20000),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0, le=10000),
+    scope: str = Query("public", pattern="^(public|visible)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Pins nearest to (lat, lng) with true spherical distances in km.
+
+    scope=public searches public pins only; scope=visible applies the same rules as
+    GET /api/pins, so it also covers the caller's own pins and friends' pins.
+    """
+    hits = None
+    if scope == "public" and pin_index_ready():
+        # None when the radius covers too much of the index; $geoNear below answers it
+        hits = pin_index.nearby(lat, lng, radius_km, limit, offset)
+    if hits is not None:
+        nearby = await hydrate_pins([key for key, _ in hits])
+        distances = {key: d for key, d in hits}
+        for pin in nearby:
+            pin['distance'] = round(distances[pin.pop('_id').binary], 2)
+        return nearby
+
+    query = {"privacy": "public"} if scope == "public" else visible_pins_query(current_user)
+    pipeline = [
+        {
+            "$geoNear": {
+                "near": geo_point(lat, lng),
+                "key": "location",
+                "distanceField": "distance",
+                "maxDistance": radius_km * 1000,  # metres
+                "spherical": True,
+                "query": query,
+            }
+        },
+        {"$skip": offset},
+        {"$limit": limit},
+        {"$project": {"_id": 0}},
+    ]
+    nearby = await db.pins.aggregate(pipeline).to_list(limit)
+    for pin in nearby:
+        pin['distance'] = round(pin['distance'] / 1000, 2)
+    return nearby
 
 # Include router
 app.include_router(api_router)
 
+@app.on_event("startup")
+async def ensure_indexes():
+    # The registry lives in indexes.py; `python manage.py check-indexes` verifies it
+    for collection, model in index_models():
+        try:
+            await db[collection].create_indexes([model])
+        except PyMongoError:
+            logger.exception(f"Failed to create index {model.document['name']} on {collection}")
+
+@app.on_event("startup")
+async def start_trending_refresh():
+    task = asyncio.create_task(trending_refresh_loop())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("startup")
+async def start_suggest_indexes():
+    task = asyncio.create_task(suggest_refresh_loop())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("startup")
+async def start_guest_purge():
+    task = asyncio.create_task(guest_purge_loop())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("startup")
+async def start_realtime_hub():
+    task = asyncio.create_task(hub.run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("startup")
+async def start_user_cache_watch():
+    if USER_CACHE_WATCH and USER_CACHE_SIZE > 0:
+        task = asyncio.create_task(watch_user_changes())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+@app.on_event("startup")
+async def start_spatial_index():
+    if SPATIAL_INDEX_ENABLED:
+        task = asyncio.create_task(start_pin_index())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in list(_background_tasks):
+        task.cancel()
+    if _derivative_pool is not None:
+        _derivative_pool.shutdown(wait=False, cancel_futures=True)
+    _bcrypt_pool.shutdown(wait=False, cancel_futures=True)
     client.close()
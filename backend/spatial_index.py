@@ -0,0 +1,365 @@
+"""In-memory spatial index of pin coordinates.
+
+A uniform lat/lng grid over compact parallel arrays, with no per-pin or per-cell
+Python objects:
+
+- per slot: float32 latitude and longitude, uint32 creation time and a 12-byte
+  key (a Mongo ObjectId), 24 bytes;
+- the grid in CSR form: the sorted ids of occupied cells, their offsets into one
+  array of slots ordered by cell, 4 bytes per pin plus 8 per occupied cell;
+- key -> slot as an open-addressing hash table of uint32, kept at most two
+  thirds full, 6 to 12 bytes per pin.
+
+Measured with memory_bytes(), which counts every array, the table and the
+pending buffers, that comes to about 45 bytes per pin (a million uniformly
+spread pins at 0.1 degree cells), so ten million pins take about 450 MB.
+
+The CSR arrays cannot take inserts in place. New points go to a small per-cell
+pending buffer that queries also read, and removals blank the slot's
+coordinates. Once enough has changed, compact() merges both into fresh CSR
+arrays. The merge copies the runs of unchanged cells as slices and loops in
+Python only over changed cells. The threshold grows with the index (a
+sixteenth of it), so the amortized cost per update stays constant; a single
+compaction of a million pins takes a few hundred milliseconds, and a bulk load
+sets auto_compact to False and compacts once at the end.
+
+Queries run on the event loop, so they are bounded: a query covering more than
+max_cells grid cells or scanning more than max_scan points returns None, and
+callers fall back to MongoDB's geo index.
+
+The index only stores ids and coordinates; callers hydrate documents from Mongo.
+"""
+import heapq
+import math
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Iterable, List, Optional, Tuple
+
+
+KEY_SIZE = 12  # bytes in a BSON ObjectId
+EARTH_RADIUS_KM = 6371.0088
+
+# Hash table entries: 0 is empty, 1 a deleted entry, slot + 2 otherwise
+_EMPTY, _DELETED = 0, 1
+
+
+def _f32(value: float) -> float:
+    # Round like the float32 arrays do, so cell lookups agree with stored coordinates
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    def __init__(self, cell_deg: float = 0.1, max_cells: int = 2500, max_scan: int = 20000):
+        self.cell_deg = cell_deg
+        self.max_cells = max_cells
+        self.max_scan = max_scan
+        # A bulk load turns this off and calls compact() once at the end
+        self.auto_compact = True
+        self._rows = int(math.ceil(180 / cell_deg))
+        self._cols = int(math.ceil(360 / cell_deg))
+        # Per slot
+        self._lat = array("f")
+        self._lng = array("f")
+        self._created = array("I")  # epoch seconds
+        self._keys = bytearray()
+        self._free = array("I")  # slots no cell refers to any more
+        # Grid, CSR: slots of cell_ids[i] are order[offsets[i]:offsets[i + 1]]
+        self._cell_ids = array("I")
+        self._offsets = array("I", [0])
+        self._order = array("I")
+        # Changes since the last compaction
+        self._pending = {}  # cell -> array("I") of slots added
+        self._pending_count = 0
+        self._dead = array("I")  # removed slots, reusable after compaction
+        self._dirty = set()  # cells whose CSR segment holds removed slots
+        # key -> slot
+        self._table = array("I", bytes(4 * 8))
+        self._table_used = 0  # live and deleted entries
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    # ----- grid -----
+    def _row(self, lat: float) -> int:
+        return min(max(int((lat + 90) / self.cell_deg), 0), self._rows - 1)
+
+    def _col(self, lng: float) -> int:
+        return min(max(int((lng + 180) / self.cell_deg), 0), self._cols - 1)
+
+    def _cell(self, lat: float, lng: float) -> int:
+        return self._row(lat) * self._cols + self._col(lng)
+
+    def _too_many_cells(self, row0: int, row1: int, col_ranges: List[Tuple[int, int]]) -> bool:
+        return (row1 - row0 + 1) * sum(c1 - c0 + 1 for c0, c1 in col_ranges) > self.max_cells
+
+    def _cells_in(self, row0: int, row1: int, col_ranges: List[Tuple[int, int]]) -> Iterable[array]:
+        """Slot arrays of the occupied cells in a block of the grid, compacted and pending."""
+        cell_ids, offsets, order, pending = self._cell_ids, self._offsets, self._order, self._pending
+        for row in range(row0, row1 + 1):
+            base = row * self._cols
+            for c0, c1 in col_ranges:
+                first, last = base + c0, base + c1
+                i = bisect_left(cell_ids, first)
+                while i < len(cell_ids) and cell_ids[i] <= last:
+                    yield order[offsets[i]:offsets[i + 1]]
+                    i += 1
+                if pending:
+                    for cell in range(first, last + 1):
+                        slots = pending.get(cell)
+                        if slots is not None:
+                            yield slots
+
+    def _col_ranges(self, min_lng: float, max_lng: float) -> List[Tuple[int, int]]:
+        if min_lng > max_lng:  # crosses the antimeridian
+            return [(self._col(min_lng), self._cols - 1), (0, self._col(max_lng))]
+        return [(self._col(min_lng), self._col(max_lng))]
+
+    def _key_at(self, slot: int) -> bytes:
+        return bytes(self._keys[slot * KEY_SIZE:(slot + 1) * KEY_SIZE])
+
+    # ----- key table -----
+    def _probe(self, key: bytes) -> Tuple[int, int]:
+        """(position of key's entry or -1, first reusable position on its probe path)."""
+        table = self._table
+        mask = len(table) - 1
+        i = hash(key) & mask
+        reusable = -1
+        while True:
+            entry = table[i]
+            if entry == _EMPTY:
+                return -1, i if reusable < 0 else reusable
+            if entry == _DELETED:
+                if reusable < 0:
+                    reusable = i
+            elif self._keys[(entry - 2) * KEY_SIZE:(entry - 1) * KEY_SIZE] == key:
+                return i, reusable
+            i = (i + 1) & mask
+
+    def _lookup(self, key: bytes) -> Optional[int]:
+        position, _ = self._probe(key)
+        return None if position < 0 else self._table[position] - 2
+
+    def _insert_key(self, key: bytes, slot: int) -> None:
+        _, position = self._probe(key)
+        if self._table[position] == _EMPTY:
+            self._table_used += 1
+        self._table[position] = slot + 2
+        if self._table_used * 3 >= len(self._table) * 2:
+            self._rehash()
+
+    def _rehash(self) -> None:
+        size = 8
+        while size * 2 < self._count * 3 + 3:  # at most two thirds full after rehashing
+            size *= 2
+        old = self._table
+        self._table = table = array("I", bytes(4 * size))
+        mask = size - 1
+        keys = self._keys
+        for entry in old:
+            if entry > _DELETED:
+                slot = entry - 2
+                i = hash(bytes(keys[slot * KEY_SIZE:(slot + 1) * KEY_SIZE])) & mask
+                while table[i] != _EMPTY:
+                    i = (i + 1) & mask
+                table[i] = entry
+        self._table_used = self._count
+
+    # ----- updates -----
+    def add(self, key: bytes, lat: float, lng: float, created_at: int = 0) -> bool:
+        """Insert or move a point; False if the key was already in that cell (it is updated in place)."""
+        if len(key) != KEY_SIZE:
+            raise ValueError(f"key must be {KEY_SIZE} bytes")
+        key = bytes(key)
+        lat, lng = _f32(lat), _f32(lng)
+        cell = self._cell(lat, lng)
+        existing = self._lookup(key)
+        if existing is not None:
+            if self._cell(self._lat[existing], self._lng[existing]) == cell:
+                self._lat[existing] = lat
+                self._lng[existing] = lng
+                self._created[existing] = created_at
+                return False
+            self.remove(key)
+
+        if self._free:
+            slot = self._free.pop()
+            self._lat[slot] = lat
+            self._lng[slot] = lng
+            self._created[slot] = created_at
+            self._keys[slot * KEY_SIZE:(slot + 1) * KEY_SIZE] = key
+        else:
+            slot = len(self._lat)
+            self._lat.append(lat)
+            self._lng.append(lng)
+            self._created.append(created_at)
+            self._keys += key
+
+        slots = self._pending.get(cell)
+        if slots is None:
+            slots = self._pending[cell] = array("I")
+        slots.append(slot)
+        self._pending_count += 1
+        self._insert_key(key, slot)
+        self._count += 1
+        self._maybe_compact()
+        return True
+
+    def remove(self, key: bytes) -> bool:
+        position, _ = self._probe(bytes(key))
+        if position < 0:
+            return False
+        slot = self._table[position] - 2
+        self._table[position] = _DELETED
+        self._count -= 1
+
+        cell = self._cell(self._lat[slot], self._lng[slot])
+        pending = self._pending.get(cell)
+        if pending is not None and slot in pending:
+            pending.remove(slot)
+            self._pending_count -= 1
+            if not pending:
+                del self._pending[cell]
+        else:
+            self._dirty.add(cell)
+        # Blank coordinates fail every query test until compaction drops the slot
+        self._lat[slot] = math.nan
+        self._lng[slot] = math.nan
+        self._keys[slot * KEY_SIZE:(slot + 1) * KEY_SIZE] = bytes(KEY_SIZE)
+        self._dead.append(slot)
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self) -> None:
+        if self.auto_compact and self._pending_count + len(self._dead) >= max(4096, len(self._order) // 16):
+            self.compact()
+
+    def compact(self) -> None:
+        """Merge pending points into the CSR arrays and drop removed slots.
+
+        Only changed cells are handled one by one; the runs of unchanged cells
+        between them are copied as slices.
+        """
+        pending, dirty = self._pending, self._dirty
+        dead = set(self._dead)
+        cell_ids, offsets, order = self._cell_ids, self._offsets, self._order
+        new_ids, new_offsets, new_order = array("I"), array("I", [0]), array("I")
+
+        def copy_run(start: int, stop: int) -> None:
+            # Old cells [start, stop) are unchanged; their offsets shift by a constant
+            if start >= stop:
+                return
+            shift = len(new_order) - offsets[start]
+            new_ids.extend(cell_ids[start:stop])
+            new_order.extend(order[offsets[start]:offsets[stop]])
+            new_offsets.extend(map(shift.__add__, offsets[start + 1:stop + 1]))
+
+        i = 0
+        for cell in sorted(pending.keys() | dirty):
+            j = bisect_left(cell_ids, cell, i)
+            copy_run(i, j)
+            i = j
+            segment = array("I")
+            if i < len(cell_ids) and cell_ids[i] == cell:
+                segment = order[offsets[i]:offsets[i + 1]]
+                if cell in dirty:
+                    segment = array("I", [slot for slot in segment if slot not in dead])
+                i += 1
+            if cell in pending:
+                segment += pending[cell]
+            if segment:
+                new_ids.append(cell)
+                new_order += segment
+                new_offsets.append(len(new_order))
+        copy_run(i, len(cell_ids))
+
+        self._cell_ids, self._offsets, self._order = new_ids, new_offsets, new_order
+        self._free += self._dead
+        self._pending, self._pending_count = {}, 0
+        self._dead, self._dirty = array("I"), set()
+
+    # ----- queries -----
+    def within_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float, limit: int,
+                    with_ties: bool = False) -> Optional[List[bytes]]:
+        """Keys inside the box, newest first, or None if the box is too large to answer here.
+
+        min_lng > max_lng means the box crosses the antimeridian. Creation times are
+        whole seconds, so with_ties also returns every other point created in the
+        same second as the last one; callers that re-sort on a finer key can then
+        cut a page without skipping anything.
+        """
+        wraps = min_lng > max_lng
+        row0, row1, col_ranges = self._row(min_lat), self._row(max_lat), self._col_ranges(min_lng, max_lng)
+        if self._too_many_cells(row0, row1, col_ranges):
+            return None
+        lat_arr, lng_arr, created = self._lat, self._lng, self._created
+        candidates = []
+        scanned = 0
+        for slots in self._cells_in(row0, row1, col_ranges):
+            scanned += len(slots)
+            if scanned > self.max_scan:
+                return None
+            for slot in slots:
+                lat, lng = lat_arr[slot], lng_arr[slot]
+                if not (min_lat <= lat <= max_lat):
+                    continue
+                if (lng >= min_lng or lng <= max_lng) if wraps else (min_lng <= lng <= max_lng):
+                    candidates.append((created[slot], slot))
+        top = heapq.nlargest(limit, candidates)
+        if with_ties and len(top) == limit and len(candidates) > limit:
+            chosen = {slot for _, slot in top}
+            last = top[-1][0]
+            top += [c for c in candidates if c[0] == last and c[1] not in chosen]
+        return [self._key_at(slot) for _, slot in top]
+
+    def nearby(self, lat: float, lng: float, radius_km: float, limit: int,
+               offset: int = 0) -> Optional[List[Tuple[bytes, float]]]:
+        """(key, distance_km) pairs within radius_km of the point, nearest first; None if the area is too large."""
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        widest = max(abs(min_lat), abs(max_lat))
+        if widest >= 89.9:
+            col_ranges = [(0, self._cols - 1)]
+        else:
+            dlng = dlat / math.cos(math.radians(widest))
+            if dlng >= 180:
+                col_ranges = [(0, self._cols - 1)]
+            else:
+                min_lng = (lng - dlng + 540) % 360 - 180
+                max_lng = (lng + dlng + 540) % 360 - 180
+                col_ranges = self._col_ranges(min_lng, max_lng)
+
+        row0, row1 = self._row(min_lat), self._row(max_lat)
+        if self._too_many_cells(row0, row1, col_ranges):
+            return None
+        lat_arr, lng_arr = self._lat, self._lng
+        hits = []
+        scanned = 0
+        for slots in self._cells_in(row0, row1, col_ranges):
+            scanned += len(slots)
+            if scanned > self.max_scan:
+                return None
+            for slot in slots:
+                distance = haversine_km(lat, lng, lat_arr[slot], lng_arr[slot])
+                if distance <= radius_km:
+                    hits.append((distance, slot))
+        return [(self._key_at(slot), d) for d, slot in heapq.nsmallest(offset + limit, hits)[offset:]]
+
+    def memory_bytes(self) -> int:
+        """Bytes held by every structure of the index, including the pending buffer."""
+        arrays = [
+            self._lat, self._lng, self._created, self._free, self._cell_ids, self._offsets,
+            self._order, self._dead, self._table, *self._pending.values(),
+        ]
+        total = sum(sys.getsizeof(a) for a in arrays) + sys.getsizeof(self._keys)
+        return total + sys.getsizeof(self._pending) + sys.getsizeof(self._dirty)
@@ -0,0 +1,153 @@
+"""Prefix autocomplete over short labels (usernames, pin titles, place names).
+
+Each index is one sorted list of strings "normalized\\0ref\\0label" plus a parallel
+array of popularity scores. A prefix maps to a contiguous slice found by bisection.
+Small slices are scanned directly. Prefixes matching more than SCAN_LIMIT entries
+(typically one or two letters) keep a cached top list. Inserts merge into that
+cache, and removals and score drops invalidate it.
+
+Inserts and removals shift the arrays (a memmove), which stays cheap at millions
+of keys.
+"""
+import bisect
+import heapq
+import sys
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+SEP = "\0"
+SCAN_LIMIT = 500
+TOP_CACHE_SIZE = 20  # also the largest k a query may ask for
+
+
+def normalize(text: str) -> str:
+    """Case-folded, accents stripped, whitespace collapsed."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._keys: List[str] = []
+        self._scores = array("I")
+        self._top: Dict[str, List[Tuple[int, str]]] = {}  # prefix -> [(score, key)] best first
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Tuple[str, str, int]]) -> "SuggestIndex":
+        """Bulk build from (label, ref, score); much faster than repeated set().
+
+        Like set(), keeps one entry per normalized label and ref, the last given.
+        """
+        index = cls()
+        rows = {}
+        for label, ref, score in entries:
+            norm = normalize(label)
+            if norm:
+                rows[(norm, ref)] = (f"{norm}{SEP}{ref}{SEP}{label}", max(0, score))
+        ordered = sorted(rows.values())
+        index._keys = [key for key, _ in ordered]
+        index._scores = array("I", (score for _, score in ordered))
+        return index
+
+    # ----- updates -----
+    def _find(self, norm: str, ref: str) -> Optional[int]:
+        head = f"{norm}{SEP}{ref}{SEP}"
+        i = bisect.bisect_left(self._keys, head)
+        if i < len(self._keys) and self._keys[i].startswith(head):
+            return i
+        return None
+
+    def _touch(self, norm: str, key: str, score: int, grew: bool) -> None:
+        for n in range(1, len(norm) + 1):
+            top = self._top.get(norm[:n])
+            if top is None:
+                continue
+            listed = any(k == key for _, k in top)
+            if not grew:
+                if listed:
+                    del self._top[norm[:n]]
+                continue
+            if listed:
+                top[:] = [(s, k) for s, k in top if k != key]
+            top.append((score, key))
+            top.sort(reverse=True)
+            del top[TOP_CACHE_SIZE:]
+
+    def set(self, label: str, ref: str, score: int) -> None:
+        """Insert an entry or update its score."""
+        norm = normalize(label)
+        if not norm:
+            return
+        score = max(0, score)
+        i = self._find(norm, ref)
+        if i is not None and self._keys[i] != f"{norm}{SEP}{ref}{SEP}{label}":
+            self.remove(self._keys[i].split(SEP, 2)[2], ref)  # label changed, same normalized form
+            i = None
+        if i is None:
+            key = f"{norm}{SEP}{ref}{SEP}{label}"
+            i = bisect.bisect_left(self._keys, key)
+            self._keys.insert(i, key)
+            self._scores.insert(i, score)
+            self._touch(norm, key, score, grew=True)
+            return
+        old = self._scores[i]
+        self._scores[i] = score
+        self._touch(norm, self._keys[i], score, grew=score >= old)
+
+    def add(self, label: str, ref: str, delta: int) -> None:
+        """Adjust an entry's score by delta, inserting it (at delta) if missing."""
+        norm = normalize(label)
+        i = self._find(norm, ref) if norm else None
+        current = self._scores[i] if i is not None else 0
+        self.set(label, ref, current + delta)
+
+    def remove(self, label: str, ref: str) -> bool:
+        norm = normalize(label)
+        i = self._find(norm, ref) if norm else None
+        if i is None:
+            return False
+        key = self._keys.pop(i)
+        self._scores.pop(i)
+        self._touch(norm, key, 0, grew=False)
+        return True
+
+    def score(self, label: str, ref: str) -> Optional[int]:
+        norm = normalize(label)
+        i = self._find(norm, ref) if norm else None
+        return self._scores[i] if i is not None else None
+
+    # ----- queries -----
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        lo = bisect.bisect_left(self._keys, prefix)
+        hi = bisect.bisect_left(self._keys, prefix + "\U0010ffff")
+        return lo, hi
+
+    def suggest(self, query: str, k: int = 10) -> List[Tuple[str, str, int]]:
+        """Top k (label, ref, score) whose normalized label starts with the query, most popular first."""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        k = min(k, TOP_CACHE_SIZE)
+        top = self._top.get(prefix)
+        if top is None:
+            lo, hi = self._range(prefix)
+            keys, scores = self._keys, self._scores
+            top = heapq.nlargest(TOP_CACHE_SIZE, ((scores[i], keys[i]) for i in range(lo, hi)))
+            if hi - lo > SCAN_LIMIT:
+                self._top[prefix] = top
+        results = []
+        for score, key in top[:k]:
+            _, ref, label = key.split(SEP, 2)
+            results.append((label, ref, score))
+        return results
+
+    def memory_bytes(self) -> int:
+        """Bytes held by keys, the key list, scores and cached tops (interpreter overhead included for strings)."""
+        keys = sum(sys.getsizeof(k) for k in self._keys) + sys.getsizeof(self._keys)
+        tops = sum(sys.getsizeof(v) + 64 * len(v) for v in self._top.values())
+        return keys + self._scores.itemsize * len(self._scores) + tops
@@ -0,0 +1,75 @@
+"""Tokenizing and an in-memory inverted index for text search.
+
+MongoDB's $text index serves search normally. This index is the fallback for
+deployments whose MongoDB-compatible service has no text index support. It mirrors
+$text semantics closely enough for the search routes: case-folded, stop words
+dropped, light English stemming, any term may match, and results ranked by the
+summed field weights of matching terms.
+"""
+import heapq
+import re
+from typing import Dict, Iterable, List
+
+_WORD = re.compile(r"[^\W_]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def words(text: str) -> List[str]:
+    """Lowercased words with punctuation, operators and quotes stripped."""
+    return _WORD.findall((text or "").lower())
+
+
+def stem(word: str) -> str:
+    # A few common English suffixes; enough to match plurals and simple verb forms
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 5 and word.endswith("ing"):
+        return word[:-3]
+    if len(word) > 4 and word.endswith("ed"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def terms(text: str) -> List[str]:
+    return [stem(w) for w in words(text) if w not in STOPWORDS]
+
+
+class InvertedIndex:
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = weights
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {doc id: weight}
+        self._terms: Dict[str, Iterable[str]] = {}  # doc id -> its terms, for removal
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def add(self, doc_id: str, doc: dict) -> None:
+        self.remove(doc_id)
+        scores: Dict[str, int] = {}
+        for field, weight in self.weights.items():
+            for term in terms(doc.get(field) or ""):
+                scores[term] = scores.get(term, 0) + weight
+        for term, score in scores.items():
+            self._postings.setdefault(term, {})[doc_id] = score
+        self._terms[doc_id] = tuple(scores)
+
+    def remove(self, doc_id: str) -> None:
+        for term in self._terms.pop(doc_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, limit: int, offset: int = 0) -> List[str]:
+        """Doc ids matching any query term, best first."""
+        scores: Dict[str, int] = {}
+        for term in set(terms(query)):
+            for doc_id, score in self._postings.get(term, {}).items():
+                scores[doc_id] = scores.get(doc_id, 0) + score
+        ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return [doc_id for doc_id, _ in ranked[offset:]]
@@ -0,0 +1,281 @@
+"""Mapbox Vector Tile encoding for point layers, plus an on-disk tile cache.
+
+Only the subset of the MVT 2.1 spec needed for points is implemented: the
+protobuf wire format is written by hand, so no protobuf dependency is required.
+"""
+import math
+import os
+import struct
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+
+EXTENT = 4096
+MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+# ===== Tile math =====
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """(west, south, east, north) in degrees for a Web Mercator tile."""
+    n = 2 ** z
+
+    def lat(ty: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def tiles_for_point(lat: float, lng: float, max_zoom: int) -> Iterable[Tuple[int, int, int]]:
+    """The (z, x, y) tile containing the point at every zoom up to max_zoom."""
+    lat = min(max(lat, -85.05112878), 85.05112878)
+    sin = math.sin(math.radians(lat))
+    fx = lng / 360 + 0.5
+    fy = 0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+    for z in range(max_zoom + 1):
+        n = 2 ** z
+        yield z, min(int(fx * n), n - 1), min(max(int(fy * n), 0), n - 1)
+
+
+def point_features(points: Iterable[Tuple[float, float, dict]], z: int, x: int, y: int,
+                   limit: int, snap: int = 1) -> List[Tuple[int, int, dict]]:
+    """Project (lat, lng, properties) into tile coordinates.
+
+    With snap > 1, points falling in the same snap x snap cell are collapsed into
+    the first one seen, which gets a `point_count`; callers pass points newest
+    first so the newest survives. At most `limit` features are returned.
+    """
+    n = 2 ** z
+    features = []
+    cells = {}
+    for lat, lng, props in points:
+        lat = min(max(lat, -85.05112878), 85.05112878)
+        sin = math.sin(math.radians(lat))
+        px = int(((lng / 360 + 0.5) * n - x) * EXTENT)
+        py = int(((0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * n - y) * EXTENT)
+        if not (0 <= px <= EXTENT and 0 <= py <= EXTENT):
+            continue
+        if snap > 1:
+            cell = (px // snap, py // snap)
+            kept = cells.get(cell)
+            if kept is not None:
+                kept["point_count"] = kept.get("point_count", 1) + 1
+                continue
+            props = dict(props)
+            cells[cell] = props
+        if len(features) >= limit:
+            break
+        features.append((px, py, props))
+    return features
+
+
+# ===== Protobuf encoding =====
+def _varint(value: int, out: bytearray) -> None:
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number: int, wire_type: int, out: bytearray) -> None:
+    _varint((number << 3) | wire_type, out)
+
+
+def _length_delimited(number: int, payload: bytes, out: bytearray) -> None:
+    _field(number, 2, out)
+    _varint(len(payload), out)
+    out += payload
+
+
+def _packed(number: int, values: List[int], out: bytearray) -> None:
+    payload = bytearray()
+    for v in values:
+        _varint(v, payload)
+    _length_delimited(number, bytes(payload), out)
+
+
+def _value(value) -> bytes:
+    out = bytearray()
+    if isinstance(value, bool):
+        _field(7, 0, out)
+        _varint(int(value), out)
+    elif isinstance(value, int):
+        _field(6, 0, out)  # sint64
+        _varint(_zigzag(value), out)
+    elif isinstance(value, float):
+        _field(3, 1, out)  # double
+        out += struct.pack("<d", value)
+    else:
+        _length_delimited(1, str(value).encode("utf-8"), out)
+    return bytes(out)
+
+
+def encode_layer(name: str, features: List[Tuple[int, int, dict]], extent: int = EXTENT) -> bytes:
+    keys, key_index = [], {}
+    values, value_index = [], {}
+    layer = bytearray()
+    _field(15, 0, layer)
+    _varint(2, layer)  # spec version
+    _length_delimited(1, name.encode("utf-8"), layer)
+
+    for fid, (px, py, props) in enumerate(features, start=1):
+        tags = []
+        for k, v in props.items():
+            if v is None:
+                continue
+            if k not in key_index:
+                key_index[k] = len(keys)
+                keys.append(k)
+            vkey = (type(v).__name__, v)
+            if vkey not in value_index:
+                value_index[vkey] = len(values)
+                values.append(v)
+            tags += [key_index[k], value_index[vkey]]
+
+        feature = bytearray()
+        _field(1, 0, feature)
+        _varint(fid, feature)
+        _packed(2, tags, feature)
+        _field(3, 0, feature)
+        _varint(1, feature)  # GeomType.POINT
+        _packed(4, [(1 & 0x7) | (1 << 3), _zigzag(px), _zigzag(py)], feature)  # MoveTo(1)
+        _length_delimited(2, bytes(feature), layer)
+
+    for k in keys:
+        _length_delimited(3, k.encode("utf-8"), layer)
+    for v in values:
+        _length_delimited(4, _value(v), layer)
+    _field(5, 0, layer)
+    _varint(extent, layer)
+    return bytes(layer)
+
+
+def encode_tile(layers: List[Tuple[str, List[Tuple[int, int, dict]]]]) -> bytes:
+    """Encode [(layer name, features)] into a tile; empty layers are omitted."""
+    tile = bytearray()
+    for name, features in layers:
+        if features:
+            _length_delimited(3, encode_layer(name, features), tile)
+    return bytes(tile)
+
+
+# ===== Disk cache =====
+class DiskTileCache:
+    """Tiles stored as {root}/{z}/{x}/{y}.mvt with age and total-size eviction.
+
+    A file's mtime is when it was rendered (used for age); its atime is bumped on
+    every hit and drives least-recently-used eviction. All methods do blocking
+    file IO, so call them from a worker thread.
+
+    A render can read the database before a write invalidates its tile and
+    finish after. Callers take generation() before rendering and pass it to
+    put(), which drops the tile if an invalidation came in between. Counters
+    are shared by tiles that hash alike, which at worst skips a put.
+    """
+
+    GENERATION_SLOTS = 1 << 16
+
+    def __init__(self, root: str, max_bytes: int, max_age: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._size: Optional[int] = None
+        self._generations = [0] * self.GENERATION_SLOTS
+        self._lock = threading.Lock()  # orders put's generation check against invalidate
+
+    def _slot(self, z: int, x: int, y: int) -> int:
+        return hash((z, x, y)) % self.GENERATION_SLOTS
+
+    def generation(self, z: int, x: int, y: int) -> int:
+        return self._generations[self._slot(z, x, y)]
+
+    def _path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self.root, str(z), str(x), f"{y}.mvt")
+
+    def _files(self) -> List[Tuple[float, int, str]]:
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_atime, st.st_size, path))
+        return found
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        path = self._path(z, x, y)
+        try:
+            st = os.stat(path)
+            if time.time() - st.st_mtime > self.max_age:
+                self.invalidate(z, x, y)
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, (time.time(), st.st_mtime))
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, z: int, x: int, y: int, data: bytes, generation: Optional[int] = None) -> bool:
+        """Store a tile; False if it was invalidated since `generation` was taken."""
+        path = self._path(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so concurrent readers never see a partial tile
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        with self._lock:
+            if generation is not None and generation != self.generation(z, x, y):
+                os.remove(tmp)
+                return False
+            os.replace(tmp, path)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._files())
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self.evict()
+        return True
+
+    def invalidate(self, z: int, x: int, y: int) -> None:
+        path = self._path(z, x, y)
+        with self._lock:
+            self._generations[self._slot(z, x, y)] += 1
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return
+        if self._size is not None:
+            self._size -= size
+
+    def evict(self) -> None:
+        """Drop expired tiles, then least recently used ones until 90% of max_bytes."""
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - self.max_age
+        target = self.max_bytes * 0.9
+        for atime, size, path in files:
+            try:
+                expired = os.stat(path).st_mtime < cutoff
+            except FileNotFoundError:
+                total -= size
+                continue
+            if not expired and total <= target:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._size = total
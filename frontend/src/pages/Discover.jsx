@@ -170,7 +170,7 @@ const Discover = ({ token, logout }) => {
                   </button>
                   <div className="flex items-center gap-2 text-slate-600">
                     <MessageCircle className="w-5 h-5" />
-                    <span className="font-semibold">{pin.comments?.length || 0}</span>
+                    <span className="font-semibold">{pin.comment_count ?? pin.comments?.length ?? 0}</span>
                   </div>
                   {pin.media_count > 0 && (
                     <div className="flex items-center gap-2 text-slate-600">
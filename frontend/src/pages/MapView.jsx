@@ -152,10 +152,24 @@ const MapView = ({ token, logout, user, setUser }) => {
   const [commentText, setCommentText] = useState("");  
   const [commentLoading, setCommentLoading] = useState(false);
 
-  const handlePinClick = (pin) => {
+  const handlePinClick = async (pin) => {
     setSelectedPin(pin);
     setPinMedia(pin.media || []);
     setCommentText("");
+    // Pins only embed a preview of the newest comments; load the latest page
+    try {
+      const response = await axios.get(`${API}/pins/${pin.id}/comments`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { limit: 50 },
+      });
+      setSelectedPin((prev) =>
+        prev && prev.id === pin.id
+          ? { ...prev, comments: [...response.data].reverse() }
+          : prev
+      );
+    } catch (error) {
+      console.error("Failed to load comments:", error);
+    }
   };
 
   const handleAddComment = async () => {
@@ -174,6 +188,7 @@ const MapView = ({ token, logout, user, setUser }) => {
       setSelectedPin((prev) => ({
         ...prev,
         comments: [...(prev.comments || []), response.data],
+        comment_count: (prev.comment_count ?? prev.comments?.length ?? 0) + 1,
       }));
       setCommentText("");
       toast.success("Comment added successfully");
@@ -291,9 +306,11 @@ const MapView = ({ token, logout, user, setUser }) => {
               {selectedPin?.media?.length > 0 && (
                 <div className="grid grid-cols-3 gap-2 mb-4">
                   {selectedPin.media.map((media) => {
-                    let src = media.file_data;
+                    // Media references carry a URL to the bytes; legacy responses embed base64
+                    const ref = media.media_type === "photo" ? media.thumb_url || media.url : media.url;
+                    let src = ref ? `${BACKEND_URL}${ref}` : media.file_data;
                     // Ensure src is a full data url, prepend if needed
-                    if (!src.startsWith("data:")) {
+                    if (!ref && !src.startsWith("data:")) {
                       if (media.media_type === "photo") {
                         src = `data:image/jpeg;base64,${src}`;
                       } else if (media.media_type === "video") {
@@ -341,7 +358,7 @@ const MapView = ({ token, logout, user, setUser }) => {
                   </button>
                   <div className="flex items-center gap-1">
                     <MessageCircle className="w-5 h-5" />
-                    <span>{selectedPin.comments?.length || 0}</span>
+                    <span>{selectedPin.comment_count ?? selectedPin.comments?.length ?? 0}</span>
                   </div>
                 </div>
 
@@ -371,6 +388,7 @@ const MapView = ({ token, logout, user, setUser }) => {
                                     setSelectedPin((prev) => ({
                                       ...prev,
                                       comments: prev.comments.filter(c => c.id !== comment.id),
+                                      comment_count: Math.max((prev.comment_count ?? prev.comments.length) - 1, 0),
                                     }));
                                     toast.success("Comment deleted");
                                   } catch (error) {
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import { Button } from '@/components/ui/button';
 import { Card } from '@/components/ui/card';
@@ -23,6 +23,8 @@ const Profile = ({ token, logout, user }) => {
   const [messages, setMessages] = useState([]);
   const [selectedFriend, setSelectedFriend] = useState(null);
   const [messageText, setMessageText] = useState('');
+  const [olderMessagesCursor, setOlderMessagesCursor] = useState(null);
+  const selectedFriendRef = useRef(null);
 
   useEffect(() => {
     fetchUserData();
@@ -31,6 +33,62 @@ const Profile = ({ token, logout, user }) => {
     }
   }, [currentUser]);
 
+  useEffect(() => {
+    selectedFriendRef.current = selectedFriend;
+  }, [selectedFriend]);
+
+  // New messages are pushed over /api/ws. After a reconnect the server replays
+  // everything since the last cursor we saw
+  useEffect(() => {
+    if (!token) return undefined;
+    let socket;
+    let cursor = null;
+    let retry;
+    let reconnecting = false;
+    let stopped = false;
+
+    const connect = () => {
+      const params = new URLSearchParams();
+      if (cursor) params.set('since', cursor);
+      socket = new WebSocket(`${API.replace(/^http/, 'ws')}/ws?${params}`);
+      socket.onopen = () => {
+        // The token goes in the first frame, not the URL, so it stays out of
+        // access logs; the server ignores it when the login cookie already worked
+        socket.send(JSON.stringify({ type: 'auth', token }));
+        // Nothing received yet, so there is no cursor to resume from
+        if (reconnecting && !cursor && selectedFriendRef.current) {
+          fetchMessages(selectedFriendRef.current.id);
+        }
+      };
+      socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'ping') {
+          socket.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
+        if (data.type !== 'message') return;
+        cursor = data.cursor;
+        const friend = selectedFriendRef.current;
+        const { message } = data;
+        if (friend && (message.sender_id === friend.id || message.recipient_id === friend.id)) {
+          appendMessage(message);
+        }
+      };
+      socket.onclose = () => {
+        if (stopped) return;
+        reconnecting = true;
+        retry = setTimeout(connect, 2000);
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retry);
+      socket.close();
+    };
+  }, [token]);
+
   const fetchUserData = async () => {
     try {
       const [userRes, pinsRes, friendsRes, requestsRes] = await Promise.all([
@@ -89,23 +147,42 @@ const Profile = ({ token, logout, user }) => {
         headers: { Authorization: `Bearer ${token}` },
       });
       setMessages(response.data);
+      setOlderMessagesCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Failed to fetch messages:', error);
     }
   };
 
+  const fetchOlderMessages = async () => {
+    if (!selectedFriend || !olderMessagesCursor) return;
+    try {
+      const response = await axios.get(`${API}/messages/${selectedFriend.id}`, {
+        params: { before: olderMessagesCursor },
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      setMessages((prev) => [...response.data, ...prev]);
+      setOlderMessagesCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Failed to fetch older messages:', error);
+    }
+  };
+
+  const appendMessage = (message) => {
+    setMessages((prev) => (prev.some((m) => m.id === message.id) ? prev : [...prev, message]));
+  };
+
   const sendMessage = async () => {
     if (!messageText.trim() || !selectedFriend) return;
 
     try {
-      await axios.post(`${API}/messages`, {
+      const response = await axios.post(`${API}/messages`, {
         recipient_id: selectedFriend.id,
         content: messageText.trim(),
       }, {
         headers: { Authorization: `Bearer ${token}` },
       });
       setMessageText('');
-      fetchMessages(selectedFriend.id);
+      appendMessage(response.data);
       toast.success('Message sent!');
     } catch (error) {
       toast.error('Failed to send message');
@@ -444,6 +521,13 @@ const Profile = ({ token, logout, user }) => {
 
                 <div className="space-y-4">
                   <div className="h-64 overflow-y-auto border rounded-lg p-4 bg-white/30">
+                    {olderMessagesCursor && (
+                      <div className="text-center mb-3">
+                        <Button onClick={fetchOlderMessages} variant="ghost" size="sm">
+                          Load older messages
+                        </Button>
+                      </div>
+                    )}
                     {messages.length === 0 ? (
                       <p className="text-slate-600 text-center">No messages yet. Start the conversation!</p>
                     ) : (
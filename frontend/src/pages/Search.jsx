@@ -24,6 +24,28 @@ const Search = ({ token, logout }) => {
   const [eventResults, setEventResults] = useState([]);
   
   const [loading, setLoading] = useState(false);
+  const [suggestions, setSuggestions] = useState([]);
+
+  // Autocomplete from the in-memory suggest index, debounced while typing
+  useEffect(() => {
+    const q = searchQuery.trim();
+    if (q.length < 2) {
+      setSuggestions([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API}/suggest`, {
+          params: { q, limit: 8 },
+          headers: { Authorization: `Bearer ${token}` }
+        });
+        setSuggestions(response.data);
+      } catch (error) {
+        setSuggestions([]);
+      }
+    }, 150);
+    return () => clearTimeout(timer);
+  }, [searchQuery, token]);
 
   const handleSearch = async () => {
     if (!searchQuery.trim()) {
@@ -153,8 +175,14 @@ const Search = ({ token, logout }) => {
               value={searchQuery}
               onChange={(e) => setSearchQuery(e.target.value)}
               onKeyPress={(e) => e.key === 'Enter' && handleSearch()}
+              list="search-suggestions"
               className="glass border-white/30 text-lg"
             />
+            <datalist id="search-suggestions">
+              {suggestions.map((s) => (
+                <option key={`${s.type}-${s.id || s.text}`} value={s.text} />
+              ))}
+            </datalist>
             <Button
               data-testid="search-submit-button"
               onClick={handleSearch}
@@ -264,7 +292,7 @@ const Search = ({ token, logout }) => {
                     <p className="text-sm text-slate-700 line-clamp-2">{album.description}</p>
                     <div className="flex items-center gap-3 mt-3 text-sm text-slate-600">
                       <span>❤️ {album.likes?.length || 0}</span>
-                      <span>💬 {album.comments?.length || 0}</span>
+                      <span>💬 {album.comment_count ?? album.comments?.length ?? 0}</span>
                     </div>
                   </Card>
                 ))
@@ -0,0 +1,97 @@
+"""Login burst benchmark.
+
+Fires a burst of concurrent logins at a running backend while probing an
+unrelated endpoint, and compares the probe's latency with an idle baseline. With
+bcrypt off the event loop the probe's p99 should stay roughly flat.
+
+    python login_benchmark.py --base-url http://localhost:8000 --concurrency 100
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def probe(url, stop, samples):
+    session = requests.Session()
+    while not stop.is_set():
+        start = time.perf_counter()
+        session.get(url, timeout=30)
+        samples.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.01)
+
+
+def login(api_url, email, password):
+    start = time.perf_counter()
+    response = requests.post(f"{api_url}/auth/login", json={"email": email, "password": password}, timeout=120)
+    return response.status_code, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--probe-path", default="/health")
+    parser.add_argument("--baseline-seconds", type=float, default=3)
+    parser.add_argument("--max-p99-ratio", type=float, default=3.0,
+                        help="fail if probe p99 during the burst exceeds baseline p99 by this factor")
+    parser.add_argument("--slack-ms", type=float, default=25,
+                        help="absolute allowance on top of the ratio, for sub-millisecond baselines")
+    args = parser.parse_args()
+
+    api_url = f"{args.base_url}/api"
+    probe_url = f"{args.base_url}{args.probe_path}"
+    suffix = uuid.uuid4().hex[:8]
+    email, password = f"bench_{suffix}@example.com", "bench-password"
+    response = requests.post(f"{api_url}/auth/register",
+                             json={"username": f"bench_{suffix}", "email": email, "password": password}, timeout=30)
+    response.raise_for_status()
+
+    # Idle baseline
+    baseline, stop = [], threading.Event()
+    thread = threading.Thread(target=probe, args=(probe_url, stop, baseline))
+    thread.start()
+    time.sleep(args.baseline_seconds)
+    stop.set()
+    thread.join()
+
+    # Same probe while the burst runs
+    during, stop = [], threading.Event()
+    thread = threading.Thread(target=probe, args=(probe_url, stop, during))
+    thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda _: login(api_url, email, password), range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    thread.join()
+
+    ok = [ms for status, ms in results if status == 200]
+    shed = sum(1 for status, _ in results if status == 503)
+    failed = len(results) - len(ok) - shed
+    print(f"logins: {len(ok)} ok, {shed} shed (503), {failed} failed in {elapsed:.2f}s "
+          f"({len(ok) / elapsed:.1f}/s)")
+    if ok:
+        print(f"login latency ms: p50 {statistics.median(ok):.0f}  p99 {percentile(ok, 99):.0f}")
+    base_p99, burst_p99 = percentile(baseline, 99), percentile(during, 99)
+    print(f"{args.probe_path} ms: baseline p50 {statistics.median(baseline):.1f} p99 {base_p99:.1f} | "
+          f"during burst p50 {statistics.median(during):.1f} p99 {burst_p99:.1f} ({len(during)} samples)")
+
+    if failed or burst_p99 > base_p99 * args.max_p99_ratio + args.slack_ms:
+        print("FAIL")
+        sys.exit(1)
+    print("PASS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The backend modules import each other flat, as they do when run from backend/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+# server.py refuses to import without MONGO_URL; the client connects lazily, so
+# tests of its pure helpers never reach a database
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017/mapmoments_test")
@@ -0,0 +1,90 @@
+import math
+import random
+
+import pytest
+
+server = pytest.importorskip("server")
+
+
+def in_ranges(doc, clause):
+    """Whether doc passes a clause's latitude/longitude ranges (the exact part of the filter)."""
+    for field in ("latitude", "longitude"):
+        bounds = clause[field]
+        if not bounds["$gte"] <= doc[field] <= bounds["$lte"]:
+            return False
+    return True
+
+
+def clauses(query):
+    return query.get("$or", [query])
+
+
+def in_box(doc, min_lat, min_lng, max_lat, max_lng):
+    if not min_lat <= doc["latitude"] <= max_lat:
+        return False
+    if min_lng <= max_lng:
+        return min_lng <= doc["longitude"] <= max_lng
+    return doc["longitude"] >= min_lng or doc["longitude"] <= max_lng
+
+
+def great_circle_midpoint(a, b):
+    """Latitude of the great-circle midpoint between [lng, lat] vertices a and b."""
+    def vec(p):
+        lng, lat = map(math.radians, p)
+        return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat))
+    x, y, z = (u + v for u, v in zip(vec(a), vec(b)))
+    return math.degrees(math.atan2(z, math.hypot(x, y)))
+
+
+def random_box(rng):
+    min_lat = rng.uniform(-89, 88)
+    max_lat = rng.uniform(min_lat, 89)
+    min_lng = rng.uniform(-180, 180)
+    max_lng = rng.uniform(-180, 180)  # may cross the antimeridian
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def test_ranges_match_brute_force():
+    rng = random.Random(1)
+    docs = [{"latitude": rng.uniform(-90, 90), "longitude": rng.uniform(-180, 180)} for _ in range(2000)]
+    for _ in range(200):
+        box = random_box(rng)
+        query = server.bbox_filter(*box)
+        for doc in docs:
+            assert any(in_ranges(doc, c) for c in clauses(query)) == in_box(doc, *box)
+
+
+def test_polygons_cover_their_ranges():
+    rng = random.Random(2)
+    for _ in range(200):
+        min_lat, min_lng, max_lat, max_lng = random_box(rng)
+        for clause in clauses(server.bbox_filter(min_lat, min_lng, max_lat, max_lng)):
+            ring = clause["location"]["$geoWithin"]["$geometry"]["coordinates"][0]
+            assert ring[0] == ring[-1]
+            lngs = [lng for lng, _ in ring]
+            assert max(lngs) - min(lngs) <= 90
+            assert min(lngs) == pytest.approx(clause["longitude"]["$gte"])
+            assert max(lngs) == pytest.approx(clause["longitude"]["$lte"])
+            # Great-circle edges bow poleward; the padding must absorb it so no
+            # point inside the ranges falls outside the polygon
+            for a, b in zip(ring, ring[1:]):
+                if a[1] != b[1]:
+                    continue  # the meridian edges are exact
+                sag = abs(great_circle_midpoint(a, b) - a[1])
+                assert sag < server.BBOX_PAD
+            lats = [lat for _, lat in ring]
+            assert min(lats) == max(-90.0, clause["latitude"]["$gte"] - server.BBOX_PAD)
+            assert max(lats) == min(90.0, clause["latitude"]["$lte"] + server.BBOX_PAD)
+
+
+def test_antimeridian_box_is_split():
+    query = server.bbox_filter(-10, 170, 10, -170)
+    assert [(c["longitude"]["$gte"], c["longitude"]["$lte"]) for c in clauses(query)] == [(170, 180), (-180, -170)]
+
+
+def test_degenerate_and_inverted_boxes():
+    assert server.bbox_filter(5, 0, 5, 10) == {"location": {"$in": []}}
+    assert server.bbox_filter(0, 10, 5, 10) == {"location": {"$in": []}}
+    with pytest.raises(server.HTTPException) as e:
+        server.bbox_filter(10, 0, 5, 10)
+    assert e.value.status_code == 400
@@ -0,0 +1,53 @@
+import pytest
+
+server = pytest.importorskip("server")
+
+
+def reference(header, length):
+    """Slow restatement of the single-range rules: (start, end), None, or 416."""
+    if not header or not header.startswith("bytes=") or length == 0:
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec or spec.count("-") != 1:
+        return None
+    first, last = spec.split("-")
+    if not first:
+        if not last.isdigit():
+            return None
+        return 416 if int(last) == 0 else (max(length - int(last), 0), length - 1)
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= length:
+        return 416
+    return start, min(int(last), length - 1) if last else length - 1
+
+
+def parse(header, length):
+    try:
+        return server.parse_byte_range(header, length)
+    except server.HTTPException as e:
+        assert e.status_code == 416
+        assert e.headers["Content-Range"] == f"bytes */{length}"
+        return 416
+
+
+def test_matches_reference_on_every_small_range():
+    values = ["", "0", "1", "4", "9", "10", "11", "25"]
+    headers = [None, "", "bytes=", "bytes=-", "items=0-1", "bytes=0-1,3-4", "bytes=a-b", "bytes=--1", "bytes=+1-2", "bytes= 1-2"]
+    headers += [f"bytes={a}-{b}" for a in values for b in values]
+    for length in (0, 1, 10):
+        for header in headers:
+            assert parse(header, length) == reference(header, length), (header, length)
+
+
+def test_common_ranges():
+    assert parse("bytes=0-99", 1000) == (0, 99)
+    assert parse("bytes=500-", 1000) == (500, 999)
+    assert parse("bytes=-200", 1000) == (800, 999)
+    assert parse("bytes=-5000", 1000) == (0, 999)
+    assert parse("bytes=900-5000", 1000) == (900, 999)
+    assert parse("bytes=1000-", 1000) == 416
+    assert parse("bytes=-0", 1000) == 416
@@ -0,0 +1,124 @@
+import random
+
+import pytest
+
+from clustering import Supercluster, lat_y, lng_x, x_lng, y_lat
+
+
+def random_points(rng, n):
+    points = []
+    for i in range(n):
+        lat0, lng0 = rng.choice([(48.85, 2.35), (35.68, 139.69), (-33.87, 151.21), (0.0, 179.9)])
+        spread = rng.choice([0.01, 0.5, 5])
+        lat = max(min(lat0 + rng.gauss(0, spread), 84), -84)
+        lng = (lng0 + rng.gauss(0, spread) + 540) % 360 - 180
+        points.append((lat, lng, {"id": str(i)}))
+    return points
+
+
+def reference_levels(index, points):
+    """Greedy clustering like Supercluster._cluster, comparing every pair of nodes."""
+    nodes = [(lng_x(lng), lat_y(lat), 1, i) for i, (lat, lng, _) in enumerate(points)]
+    levels = {index.max_zoom + 1: nodes}
+    for zoom in range(index.max_zoom, index.min_zoom - 1, -1):
+        r = index._cell(zoom)
+        visited = [False] * len(nodes)
+        out = []
+        for i, (x, y, count, point) in enumerate(nodes):
+            if visited[i]:
+                continue
+            visited[i] = True
+            near = [j for j, (xj, yj, _, _) in enumerate(nodes)
+                    if not visited[j] and (xj - x) ** 2 + (yj - y) ** 2 <= r * r]
+            total = count + sum(nodes[j][2] for j in near)
+            if not near or total < index.min_points:
+                out.append((x, y, count, point))
+                continue
+            for j in near:
+                visited[j] = True
+            wx = x * count + sum(nodes[j][0] * nodes[j][2] for j in near)
+            wy = y * count + sum(nodes[j][1] * nodes[j][2] for j in near)
+            out.append((wx / total, wy / total, total, None))
+        levels[zoom] = nodes = out
+    return levels
+
+
+def in_box(lat, lng, box):
+    min_lng, min_lat, max_lng, max_lat = box
+    if not lat_y(max_lat) <= lat_y(lat) <= lat_y(min_lat):
+        return False
+    if min_lng > max_lng:
+        return lng_x(lng) >= lng_x(min_lng) or lng_x(lng) <= lng_x(max_lng)
+    return lng_x(min_lng) <= lng_x(lng) <= lng_x(max_lng)
+
+
+def reference_clusters(index, levels, points, box, zoom):
+    nodes = levels[max(index.min_zoom, min(int(zoom), index.max_zoom + 1))]
+    clusters, leaves = [], []
+    for x, y, count, point in nodes:
+        if not in_box(y_lat(y), x_lng(x), box):
+            continue
+        if point is None:
+            clusters.append((round(y_lat(y), 6), round(x_lng(x), 6), count))
+        else:
+            leaves.append(points[point][2]["id"])
+    return sorted(clusters), sorted(leaves)
+
+
+def summarize(result):
+    clusters, points = result
+    return (sorted((round(c["latitude"], 6), round(c["longitude"], 6), c["count"]) for c in clusters),
+            sorted(p["id"] for p in points))
+
+
+def test_levels_match_brute_force_clustering():
+    rng = random.Random(3)
+    points = random_points(rng, 600)
+    index = Supercluster(max_zoom=10).load(points)
+    levels = reference_levels(index, points)
+    for zoom, nodes in levels.items():
+        level = index._levels[zoom]
+        got = sorted(zip(level.xs, level.ys, level.counts, level.points), key=lambda n: (n[2], n[0], n[1]))
+        expected = sorted(nodes, key=lambda n: (n[2], n[0], n[1]))
+        assert len(got) == len(expected)
+        for (x, y, count, point), (ex, ey, ecount, epoint) in zip(got, expected):
+            assert (count, point) == (ecount, epoint)
+            assert x == pytest.approx(ex) and y == pytest.approx(ey)
+        # Every point is counted exactly once at every zoom
+        assert sum(level.counts) == len(points)
+
+
+def test_viewports_match_brute_force():
+    rng = random.Random(4)
+    points = random_points(rng, 800)
+    index = Supercluster(max_zoom=12).load(points)
+    levels = reference_levels(index, points)
+    boxes = [(-180, -85, 180, 85), (170, -10, -170, 10), (2.0, 48.5, 2.7, 49.2), (130, 30, 150, 40)]
+    for _ in range(40):
+        lng0, lat0 = rng.uniform(-180, 180), rng.uniform(-80, 70)
+        boxes.append((lng0, lat0, (lng0 + rng.uniform(0.1, 60) + 180) % 360 - 180, lat0 + rng.uniform(0.1, 15)))
+    for box in boxes:
+        for zoom in (0, 3, 7.5, 12, 13, 20):
+            assert summarize(index.get_clusters(*box, zoom)) == reference_clusters(index, levels, points, box, zoom)
+
+
+def test_limit_caps_leaves_above_max_zoom():
+    rng = random.Random(5)
+    points = random_points(rng, 500)
+    index = Supercluster(max_zoom=8).load(points)
+    world = (-180, -85, 180, 85)
+    clusters, leaves = index.get_clusters(*world, 15)
+    assert not clusters and len(leaves) == len(points)
+    everything = {p["id"] for p in leaves}
+    for limit in (1, 37, 499, 500, 501):
+        clusters, leaves = index.get_clusters(*world, 15, limit=limit)
+        assert len(leaves) == min(limit, len(points))
+        assert {p["id"] for p in leaves} <= everything
+    # Across the antimeridian the cap spans both halves
+    clusters, leaves = index.get_clusters(0.0, -85, -0.1, 85, 15, limit=300)
+    assert len(clusters) + len(leaves) == 300
+
+
+def test_empty_index():
+    index = Supercluster().load([])
+    assert index.get_clusters(-180, -85, 180, 85, 3) == ([], [])
@@ -0,0 +1,102 @@
+import base64
+import json
+import random
+
+import pytest
+
+server = pytest.importorskip("server")
+
+
+def matches(doc, query):
+    """Evaluate the subset of Mongo filters the pagination helpers produce."""
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif isinstance(cond, dict):
+            for op, value in cond.items():
+                if op == "$lt" and not doc[key] < value:
+                    return False
+                if op == "$gt" and not doc[key] > value:
+                    return False
+        elif doc.get(key) != cond:
+            return False
+    return True
+
+
+class FakeResponse:
+    def __init__(self):
+        self.headers = {}
+
+
+def pages(docs, sort_field, descending, limit):
+    """Page through docs as the list routes do: filter, sort, fetch limit + 1, paginate."""
+    ordered = sorted(docs, key=lambda d: (d[sort_field], d["id"]), reverse=descending)
+    cursor, seen = None, []
+    while True:
+        query = server.after_cursor({"visible": True}, cursor, sort_field, descending)
+        batch = [d for d in ordered if matches(d, query)][:limit + 1]
+        response = FakeResponse()
+        page = server.paginate(response, batch, limit, sort_field)
+        assert len(page) <= limit
+        seen.extend(page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return seen
+
+
+def test_paging_visits_every_item_once_in_order():
+    rng = random.Random(6)
+    for trial in range(60):
+        # Few distinct sort values, so many items tie and the id decides
+        docs = [
+            {"id": f"{rng.randrange(10 ** 6):06d}-{i}", "created_at": f"2024-01-0{rng.randrange(1, 4)}",
+             "score": rng.choice([0, 1.5, 2, -3]), "visible": rng.random() < 0.8}
+            for i in range(rng.randrange(0, 40))
+        ]
+        for sort_field in ("created_at", "score"):
+            for descending in (True, False):
+                limit = rng.randrange(1, 8)
+                expected = sorted((d for d in docs if d["visible"]),
+                                  key=lambda d: (d[sort_field], d["id"]), reverse=descending)
+                assert pages(docs, sort_field, descending, limit) == expected
+
+
+def test_cursor_round_trip():
+    for values in [("2024-01-01T00:00:00+00:00", "abc"), (3, "x"), (-1.5, "y"), ("", "")]:
+        cursor = server.encode_cursor(*values)
+        assert "=" not in cursor
+        assert server.decode_cursor(cursor, 2) == list(values)
+    assert server.decode_cursor(server.encode_cursor("only-id"), 1) == ["only-id"]
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"\xff\xfe").decode("ascii"),
+    raw_cursor({"created_at": "x", "id": "y"}),
+    raw_cursor(["2024", "id", "extra"]),
+    raw_cursor(["2024"]),
+    raw_cursor([{"$ne": None}, "id"]),
+    raw_cursor(["2024", {"$gt": ""}]),
+    raw_cursor([None, "id"]),
+    raw_cursor([True, "id"]),
+    raw_cursor([["2024"], "id"]),
+    raw_cursor(["2024", 5]),
+])
+def test_rejects_malformed_cursors(cursor):
+    with pytest.raises(server.HTTPException) as err:
+        server.decode_cursor(cursor, 2)
+    assert err.value.status_code == 400
+
+
+def test_no_cursor_leaves_the_query_alone():
+    query = {"user_id": "u"}
+    assert server.after_cursor(query, None, "created_at", True) is query
+    assert server.after_cursor(query, "", "created_at", True) is query
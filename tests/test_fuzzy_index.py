@@ -0,0 +1,127 @@
+import heapq
+import random
+
+from fuzzy_index import MAX_WORD_MATCHES, SIMILARITY_THRESHOLD, FuzzyIndex, trigrams
+from suggest_index import normalize
+from text_search import STOPWORDS, words
+
+WEIGHTS = {"title": 10, "description": 4}
+VOCABULARY = [
+    "paris", "parris", "pariss", "london", "londn", "lisbon", "sunset", "sunsets", "sunrise",
+    "Café", "cafe", "coffee", "beach", "beaches", "bench", "the", "and", "a", "x", "Ünter",
+]
+
+
+class Reference:
+    """Every document kept as {word: best weight}; queries compare against every word."""
+
+    def __init__(self):
+        self.vocabulary = []  # in first-seen order, like word ids; never shrinks
+        self.docs = {}  # doc id -> {word: weight}
+
+    def add(self, doc_id, doc):
+        best = {}
+        for field, weight in WEIGHTS.items():
+            for word in words(normalize(doc.get(field) or "")):
+                if word not in STOPWORDS and best.get(word, 0) < weight:
+                    best[word] = weight
+        for word in best:
+            if word not in self.vocabulary:
+                self.vocabulary.append(word)
+        self.docs[doc_id] = best
+
+    def remove(self, doc_id):
+        self.docs.pop(doc_id, None)
+
+    def similar(self, word):
+        q = trigrams(word)
+        scored = []
+        for wid, other in enumerate(self.vocabulary):
+            g = trigrams(other)
+            similarity = len(q & g) / len(q | g)
+            if similarity >= SIMILARITY_THRESHOLD:
+                scored.append((similarity, wid))
+        return {self.vocabulary[wid]: sim for sim, wid in heapq.nlargest(MAX_WORD_MATCHES, scored)}
+
+    def scores(self, query):
+        query_words = {w for w in words(normalize(query)) if w not in STOPWORDS and len(w) >= 2}
+        if not query_words:
+            return {}
+        matches = [self.similar(w) for w in query_words]
+        if not all(matches):
+            return {}
+        scores = {}
+        for doc_id, best in self.docs.items():
+            per_word = [max((sim * best[w] for w, sim in m.items() if w in best), default=0) for m in matches]
+            if all(per_word):
+                scores[doc_id] = sum(per_word)
+        return scores
+
+
+def random_text(rng):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(rng.randrange(0, 5)))
+
+
+def check(index, reference, query, limit):
+    expected = reference.scores(query)
+    got = index.search(query, limit)
+    assert len(got) == len(set(got)) == min(limit, len(expected))
+    assert all(doc_id in expected for doc_id in got)
+    # Best first, and nothing better left out (scores summed in another order may differ in the last bits)
+    got_scores = [expected[doc_id] for doc_id in got]
+    assert all(a >= b - 1e-9 for a, b in zip(got_scores, got_scores[1:]))
+    if got:
+        left_out = [score for doc_id, score in expected.items() if doc_id not in set(got)]
+        assert all(score <= got_scores[-1] + 1e-9 for score in left_out)
+
+
+def test_search_matches_brute_force_through_updates():
+    rng = random.Random(11)
+    index, reference = FuzzyIndex(WEIGHTS), Reference()
+    for step in range(2500):
+        doc_id = f"d{rng.randrange(150)}"
+        if rng.random() < 0.2:
+            index.remove(doc_id)
+            reference.remove(doc_id)
+        else:
+            doc = {field: random_text(rng) for field in WEIGHTS if rng.random() < 0.9}
+            index.add(doc_id, doc)
+            reference.add(doc_id, doc)
+        if step % 50 == 0:
+            assert len(index) == len(reference.docs)
+            for query in ["pariss", "sunset beach", "cofee", "lond", "cafe paris", "Unter", random_text(rng)]:
+                check(index, reference, query, rng.randrange(1, 40))
+
+
+def test_paging_is_consistent():
+    rng = random.Random(12)
+    index = FuzzyIndex(WEIGHTS)
+    for i in range(300):
+        index.add(f"d{i}", {"title": random_text(rng), "description": random_text(rng)})
+    for query in ["paris", "sunset", "beach cafe"]:
+        everything = index.search(query, 1000)
+        for offset in (0, 3, 17):
+            assert index.search(query, 5, offset) == everything[offset:offset + 5]
+
+
+def test_unmatched_word_empties_the_result():
+    index = FuzzyIndex(WEIGHTS)
+    index.add("1", {"title": "Paris sunset"})
+    assert index.search("pariss", 10) == ["1"]
+    assert index.search("zzzz paris", 10) == []
+    # Stop words and single letters are ignored rather than required
+    assert index.search("the paris x", 10) == ["1"]
+    assert index.search("the", 10) == []
+
+
+def test_rare_word_probes_common_postings():
+    rng = random.Random(13)
+    index, reference = FuzzyIndex(WEIGHTS), Reference()
+    for i in range(3000):
+        doc = {"title": rng.choice(["sunset", "sunset beach", "beach"]), "description": random_text(rng)}
+        if i % 500 == 0:
+            doc["title"] += " lisbon"
+        index.add(f"d{i}", doc)
+        reference.add(f"d{i}", doc)
+    for query in ["lisbon sunset", "lisbn beach", "lisbon sunset beach"]:
+        check(index, reference, query, 50)
@@ -0,0 +1,134 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from message_buckets import PageCollector, bucket_append, bucket_query
+
+
+def make_messages(count, conversations, seed):
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    messages = []
+    for i in range(count):
+        # Whole seconds, so some messages share a created_at and the id breaks ties
+        created_at = (start + timedelta(seconds=i // 3)).isoformat()
+        messages.append({
+            "id": f"m{rng.randrange(10 ** 6):06d}-{i}",
+            "conversation_id": rng.choice(conversations),
+            "content": "x",
+            "created_at": created_at,
+        })
+    return messages
+
+
+def matches(doc, query):
+    """Enough of MongoDB's filter semantics for bucket_append and bucket_query."""
+    for field, condition in query.items():
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            for op, operand in condition.items():
+                if value is None:
+                    return False
+                if op == "$lt" and not value < operand:
+                    return False
+                if op == "$lte" and not value <= operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def store(buckets, message, bucket_size):
+    query, update = bucket_append(message, bucket_size)
+    bucket = next((b for b in buckets if matches(b, query)), None)
+    if bucket is None:
+        bucket = {"conversation_id": message["conversation_id"], "count": 0, "messages": []}
+        buckets.append(bucket)
+    bucket["messages"] += [update["$push"]["messages"]]
+    bucket["count"] += update["$inc"]["count"]
+    bucket["start"] = min(bucket.get("start", update["$min"]["start"]), update["$min"]["start"])
+    bucket["end"] = max(bucket.get("end", update["$max"]["end"]), update["$max"]["end"])
+
+
+def read_page(buckets, conversation, size, before=None):
+    collector = PageCollector(size, before)
+    candidates = [b for b in buckets if matches(b, bucket_query(conversation, before))]
+    for bucket in sorted(candidates, key=lambda b: b["end"], reverse=True):
+        if collector.add(bucket):
+            break
+    return collector.page()
+
+
+def expected_page(messages, conversation, size, before=None):
+    ordered = sorted(
+        (m for m in messages if m["conversation_id"] == conversation),
+        key=lambda m: (m["created_at"], m["id"]),
+        reverse=True,
+    )
+    if before:
+        ordered = [m for m in ordered if (m["created_at"], m["id"]) < tuple(before)]
+    return ordered[:size]
+
+
+def check_all_pages(buckets, messages, conversation, size):
+    before, pages = None, 0
+    while True:
+        page = read_page(buckets, conversation, size, before)
+        assert page == expected_page(messages, conversation, size, before)
+        if len(page) < size:
+            return pages
+        pages += 1
+        before = (page[-1]["created_at"], page[-1]["id"])
+
+
+def test_pages_match_brute_force():
+    conversations = ["a:b", "a:c", "b:c"]
+    messages = make_messages(1000, conversations, seed=1)
+    buckets = []
+    for message in messages:
+        store(buckets, message, 37)
+
+    assert all(b["count"] <= 37 for b in buckets)
+    for conversation in conversations:
+        for size in (1, 20, 37, 50, 400):
+            check_all_pages(buckets, messages, conversation, size)
+
+
+def test_overlapping_buckets_match_brute_force():
+    # Concurrent sends can open two buckets at once; interleave two sets of
+    # buckets for one conversation so their time ranges overlap
+    messages = make_messages(600, ["a:b"], seed=2)
+    buckets, other = [], []
+    for i, message in enumerate(messages):
+        store(buckets if i % 2 else other, message, 25)
+    buckets += other
+
+    assert check_all_pages(buckets, messages, "a:b", 30) > 5
+
+
+def test_collector_stops_once_older_buckets_cannot_contribute():
+    messages = make_messages(300, ["a:b"], seed=3)
+    buckets = []
+    for message in messages:
+        store(buckets, message, 50)
+
+    collector = PageCollector(10)
+    fed = 0
+    for bucket in sorted(buckets, key=lambda b: b["end"], reverse=True):
+        fed += 1
+        if collector.add(bucket):
+            break
+    assert fed == 2  # the newest bucket fills the page; the next one ends too early
+    assert collector.page() == expected_page(messages, "a:b", 10)
+
+
+def test_bucket_query_skips_buckets_starting_after_the_cursor():
+    assert bucket_query("a:b") == {"conversation_id": "a:b"}
+    assert bucket_query("a:b", ("2026-01-01T00:00:00+00:00", "m1")) == {
+        "conversation_id": "a:b",
+        "start": {"$lte": "2026-01-01T00:00:00+00:00"},
+    }
+
+
+def test_empty_conversation_has_no_messages():
+    assert read_page([], "a:b", 10) == []
+    assert read_page([], "a:b", 10, ("2026-01-01T00:00:00+00:00", "m1")) == []
@@ -0,0 +1,156 @@
+import random
+import struct
+
+import pytest
+
+from spatial_index import KEY_SIZE, SpatialIndex, haversine_km
+
+
+def f32(value):
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def key(i):
+    return i.to_bytes(KEY_SIZE, "big")
+
+
+class Reference:
+    """The same points in a dict, queried by scanning all of them."""
+
+    def __init__(self):
+        self.points = {}
+
+    def add(self, k, lat, lng, created):
+        self.points[k] = (f32(lat), f32(lng), created)
+
+    def within_bbox(self, min_lat, min_lng, max_lat, max_lng):
+        wraps = min_lng > max_lng
+        return {
+            k: created for k, (lat, lng, created) in self.points.items()
+            if min_lat <= lat <= max_lat
+            and ((lng >= min_lng or lng <= max_lng) if wraps else min_lng <= lng <= max_lng)
+        }
+
+    def nearby(self, lat, lng, radius_km):
+        found = {}
+        for k, (plat, plng, _) in self.points.items():
+            distance = haversine_km(lat, lng, plat, plng)
+            if distance <= radius_km:
+                found[k] = distance
+        return found
+
+
+def churn(index, reference, rng, operations):
+    """Random adds, moves and removals, applied to both."""
+    for _ in range(operations):
+        k = key(rng.randrange(3000))
+        if rng.random() < 0.3:
+            assert index.remove(k) == (reference.points.pop(k, None) is not None)
+        else:
+            # Clustered around a few cities, so cells hold many points
+            lat0, lng0 = rng.choice([(48.85, 2.35), (40.71, -74.0), (-33.87, 151.21), (0.0, 179.95)])
+            lat, lng = lat0 + rng.gauss(0, 0.3), lng0 + rng.gauss(0, 0.3)
+            lng = (lng + 540) % 360 - 180
+            created = rng.randrange(1000)
+            index.add(k, lat, lng, created)
+            reference.add(k, lat, lng, created)
+    assert len(index) == len(reference.points)
+
+
+def check_bbox(index, reference, box, limit):
+    keys = index.within_bbox(*box, limit)
+    expected = reference.within_bbox(*box)
+    assert len(keys) == len(set(keys)) == min(limit, len(expected))
+    assert all(k in expected for k in keys)
+    # Newest first, and nothing newer was left out
+    times = [expected[k] for k in keys]
+    assert times == sorted(times, reverse=True)
+    if keys:
+        assert sum(1 for t in expected.values() if t > times[-1]) <= len(keys)
+
+
+def test_queries_match_brute_force_through_churn():
+    rng = random.Random(1)
+    index, reference = SpatialIndex(cell_deg=0.1, max_cells=10 ** 6, max_scan=10 ** 6), Reference()
+    for _ in range(6):
+        churn(index, reference, rng, 2500)
+        for lat0, lng0 in [(48.85, 2.35), (40.71, -74.0), (-33.87, 151.21)]:
+            box = (lat0 - 0.4, lng0 - 0.5, lat0 + 0.2, lng0 + 0.3)
+            check_bbox(index, reference, box, 10 ** 6)
+            check_bbox(index, reference, box, 7)
+            for radius in (1, 15, 60):
+                hits = index.nearby(lat0, lng0, radius, 10 ** 6)
+                expected = reference.nearby(lat0, lng0, radius)
+                assert {k: round(d, 9) for k, d in hits} == {k: round(d, 9) for k, d in expected.items()}
+                assert [d for _, d in hits] == sorted(d for _, d in hits)
+        # Across the antimeridian
+        check_bbox(index, reference, (-0.8, 179.5, 0.8, -179.5), 10 ** 6)
+
+
+def test_compaction_keeps_every_point():
+    rng = random.Random(2)
+    index, reference = SpatialIndex(cell_deg=1.0, max_cells=10 ** 6, max_scan=10 ** 6), Reference()
+    churn(index, reference, rng, 5000)
+    before = sorted(index.within_bbox(-90, -180, 90, 180, 10 ** 6))
+    index.compact()
+    assert not index._pending and not index._dead
+    assert sorted(index.within_bbox(-90, -180, 90, 180, 10 ** 6)) == before == sorted(reference.points)
+
+
+def test_bulk_load_compacts_once():
+    rng = random.Random(7)
+    index, reference = SpatialIndex(cell_deg=1.0, max_cells=10 ** 6, max_scan=10 ** 6), Reference()
+    index.auto_compact = False
+    churn(index, reference, rng, 20000)
+    assert index._pending and not index._order
+    check_bbox(index, reference, (-90, -180, 90, 180), 10 ** 6)
+    index.compact()
+    index.auto_compact = True
+    assert not index._pending
+    check_bbox(index, reference, (-90, -180, 90, 180), 10 ** 6)
+
+
+def test_moving_a_key_replaces_it():
+    index = SpatialIndex(cell_deg=1.0)
+    assert index.add(key(1), 10.0, 10.0)
+    assert not index.add(key(1), 10.2, 10.2)  # same cell, updated in place
+    assert index.within_bbox(10.1, 10.1, 10.3, 10.3, 10) == [key(1)]
+    assert index.add(key(1), 20.0, 20.0)
+    assert len(index) == 1
+    assert index.within_bbox(9, 9, 11, 11, 10) == []
+    assert index.within_bbox(19, 19, 21, 21, 10) == [key(1)]
+    assert index.remove(key(1)) and not index.remove(key(1))
+    assert len(index) == 0
+
+
+def test_with_ties_returns_the_whole_last_second():
+    index = SpatialIndex(cell_deg=1.0)
+    for i in range(5):
+        index.add(key(i), 1.0, 1.0 + i / 10, created_at=100 if i else 200)
+    assert len(index.within_bbox(0, 0, 2, 2, 2)) == 2
+    assert len(index.within_bbox(0, 0, 2, 2, 2, with_ties=True)) == 5
+
+
+def test_oversized_queries_fall_back():
+    index = SpatialIndex(cell_deg=0.1, max_cells=100, max_scan=50)
+    assert index.within_bbox(-10, -10, 10, 10, 10) is None
+    assert index.nearby(0, 0, 500, 10) is None
+    for i in range(60):
+        index.add(key(i), 0.01, 0.01)
+    assert index.within_bbox(0, 0, 0.05, 0.05, 10) is None
+
+
+def test_rejects_malformed_keys():
+    with pytest.raises(ValueError):
+        SpatialIndex().add(b"short", 0, 0)
+
+
+def test_memory_is_compact():
+    rng = random.Random(3)
+    index = SpatialIndex(cell_deg=0.1)
+    count = 200000
+    for i in range(count):
+        index.add(key(i), rng.uniform(-60, 70), rng.uniform(-180, 180), i)
+    index.compact()
+    # Columns, CSR and key table, with array over-allocation; no per-pin objects
+    assert index.memory_bytes() / count < 60
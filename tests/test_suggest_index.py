@@ -0,0 +1,94 @@
+import random
+
+from suggest_index import SCAN_LIMIT, SEP, TOP_CACHE_SIZE, SuggestIndex, normalize
+
+
+class Reference:
+    """(normalized label, ref) -> (label, score), queried by scanning everything."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def set(self, label, ref, score):
+        norm = normalize(label)
+        if norm:
+            self.entries[(norm, ref)] = (label, max(0, score))
+
+    def add(self, label, ref, delta):
+        norm = normalize(label)
+        current = self.entries.get((norm, ref), (label, 0))[1]
+        self.set(label, ref, current + delta)
+
+    def remove(self, label, ref):
+        return self.entries.pop((normalize(label), ref), None) is not None
+
+    def suggest(self, query, k):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        found = [
+            (score, f"{norm}{SEP}{ref}{SEP}{label}", (label, ref, score))
+            for (norm, ref), (label, score) in self.entries.items() if norm.startswith(prefix)
+        ]
+        found.sort(reverse=True)
+        return [row for _, _, row in found[:min(k, TOP_CACHE_SIZE)]]
+
+
+def random_label(rng):
+    # A tiny alphabet with case, accent and spacing variants, so prefixes are
+    # shared widely and different labels normalize alike
+    return "".join(rng.choice(["a", "b", "A", "á", " ", "c"]) for _ in range(rng.randrange(1, 6)))
+
+
+def test_suggestions_match_brute_force_through_updates():
+    rng = random.Random(9)
+    index, reference = SuggestIndex(), Reference()
+    for step in range(20000):
+        label, ref = random_label(rng), f"r{rng.randrange(400)}"
+        action = rng.random()
+        if action < 0.5:
+            delta = rng.randrange(-3, 6)
+            index.add(label, ref, delta)
+            reference.add(label, ref, delta)
+        elif action < 0.8:
+            score = rng.randrange(0, 50)
+            index.set(label, ref, score)
+            reference.set(label, ref, score)
+        else:
+            assert index.remove(label, ref) == reference.remove(label, ref)
+        if step % 200 == 0:
+            assert len(index) == len(reference.entries)
+            for query in ["a", "A", "á", "b", "ab", " a", "aa", "c", "zz", "", random_label(rng)]:
+                k = rng.randrange(1, TOP_CACHE_SIZE + 5)
+                assert index.suggest(query, k) == reference.suggest(query, k)
+    # The cached top lists were exercised
+    assert len(index) > SCAN_LIMIT and index._top
+
+
+def test_bulk_build_matches_incremental():
+    rng = random.Random(10)
+    entries = [(random_label(rng), f"r{rng.randrange(300)}", rng.randrange(-5, 100)) for _ in range(3000)]
+    bulk, incremental = SuggestIndex.from_entries(entries), SuggestIndex()
+    for label, ref, score in entries:
+        incremental.set(label, ref, score)
+    assert bulk._keys == incremental._keys and bulk._scores == incremental._scores
+    for query in ["a", "b", "ab", "c", "bá"]:
+        assert bulk.suggest(query, 20) == incremental.suggest(query, 20)
+
+
+def test_score_and_label_changes():
+    index = SuggestIndex()
+    index.set("Café", "1", 5)
+    assert index.score("cafe", "1") == 5
+    index.set("CAFE", "1", 7)  # same normalized form: replaces the label
+    assert index.suggest("caf") == [("CAFE", "1", 7)]
+    index.add("cafe", "1", -100)
+    assert index.score("Café", "1") == 0
+    assert not index.remove("tea", "1")
+    assert index.remove("café", "1") and len(index) == 0
+
+
+def test_normalize():
+    assert normalize("  Crème   Brûlée ") == "creme brulee"
+    assert normalize("STRASSE") == normalize("strasse")
+    assert normalize(None) == ""
@@ -0,0 +1,69 @@
+import random
+
+from text_search import STOPWORDS, InvertedIndex, stem, terms, words
+
+WEIGHTS = {"title": 10, "description": 5, "location_name": 3}
+VOCABULARY = [
+    "paris", "Paris!", "cafe", "cafes", "walking", "walked", "walk", "berries", "berry",
+    "glass", "the", "and", "sunset", "sunsets", "Beach", "beaches", "x", "élan", "straße", "o'clock",
+]
+
+
+def random_text(rng):
+    return " ".join(rng.choice(VOCABULARY) for _ in range(rng.randrange(0, 6)))
+
+
+def reference_search(docs, query, limit, offset=0):
+    """Score every document directly from its fields."""
+    query_terms = set(terms(query))
+    scored = []
+    for doc_id, doc in docs.items():
+        score = sum(
+            weight
+            for field, weight in WEIGHTS.items()
+            for term in terms(doc.get(field) or "")
+            if term in query_terms
+        )
+        if score:
+            scored.append((score, doc_id))
+    scored.sort(reverse=True)
+    return [doc_id for _, doc_id in scored[offset:offset + limit]]
+
+
+def test_search_matches_brute_force_through_updates():
+    rng = random.Random(8)
+    index, docs = InvertedIndex(WEIGHTS), {}
+    for step in range(3000):
+        doc_id = f"d{rng.randrange(200)}"
+        if rng.random() < 0.2:
+            index.remove(doc_id)
+            docs.pop(doc_id, None)
+        else:
+            doc = {field: random_text(rng) for field in WEIGHTS if rng.random() < 0.8}
+            index.add(doc_id, doc)
+            docs[doc_id] = doc
+        if step % 50 == 0:
+            assert len(index) == len(docs)
+            for _ in range(5):
+                query = random_text(rng)
+                limit, offset = rng.randrange(1, 30), rng.randrange(0, 10)
+                assert index.search(query, limit, offset) == reference_search(docs, query, limit, offset)
+
+
+def test_removed_documents_leave_no_postings():
+    index = InvertedIndex(WEIGHTS)
+    index.add("a", {"title": "Sunset beach", "description": "walking"})
+    index.add("a", {"title": "Cafe"})
+    assert index.search("sunset", 10) == []
+    assert index.search("cafes", 10) == ["a"]
+    index.remove("a")
+    index.remove("missing")
+    assert len(index) == 0 and not index._postings
+
+
+def test_terms():
+    assert words("Hello, WORLD_wide! 42") == ["hello", "world", "wide", "42"]
+    assert words(None) == []
+    assert terms("The berries and the cafes") == ["berry", "cafe"]
+    assert all(w not in STOPWORDS for w in terms(" ".join(STOPWORDS) + " sunset"))
+    assert [stem(w) for w in ["walking", "walked", "glass", "bus", "ties", "sing"]] == ["walk", "walk", "glass", "bus", "tie", "sing"]
@@ -0,0 +1,226 @@
+import struct
+
+from vector_tiles import (
+    EXTENT,
+    DiskTileCache,
+    _varint,
+    _zigzag,
+    encode_layer,
+    encode_tile,
+    point_features,
+    tile_bounds,
+    tiles_for_point,
+)
+
+
+# A minimal protobuf reader, enough to take tiles apart again
+def read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def read_fields(data):
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        else:
+            raise AssertionError(f"unexpected wire type {wire_type}")
+        fields.append((number, value))
+    return fields
+
+
+def read_packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_value(data):
+    (number, raw), = read_fields(data)
+    if number == 1:
+        return raw.decode("utf-8")
+    if number == 3:
+        return struct.unpack("<d", raw)[0]
+    if number == 6:
+        return unzigzag(raw)
+    if number == 7:
+        return bool(raw)
+    raise AssertionError(f"unexpected value field {number}")
+
+
+def decode_layer(data):
+    layer = {"features": [], "keys": [], "values": []}
+    for number, value in read_fields(data):
+        if number == 1:
+            layer["name"] = value.decode("utf-8")
+        elif number == 2:
+            layer["features"].append(read_fields(value))
+        elif number == 3:
+            layer["keys"].append(value.decode("utf-8"))
+        elif number == 4:
+            layer["values"].append(decode_value(value))
+        elif number == 5:
+            layer["extent"] = value
+        elif number == 15:
+            layer["version"] = value
+    return layer
+
+
+def feature_points(layer):
+    """[(id, x, y, properties)] for every point feature in a decoded layer."""
+    points = []
+    for fields in layer["features"]:
+        feature = dict(fields)
+        assert feature[3] == 1  # POINT
+        command, x, y = read_packed(feature[4])
+        assert command == (1 << 3) | 1  # MoveTo, count 1
+        tags = read_packed(feature[2])
+        props = {layer["keys"][k]: layer["values"][v] for k, v in zip(tags[::2], tags[1::2])}
+        points.append((feature[1], unzigzag(x), unzigzag(y), props))
+    return points
+
+
+def test_varint_round_trip():
+    for value in (0, 1, 127, 128, 300, 16383, 16384, 2 ** 32, 2 ** 63 - 1):
+        out = bytearray()
+        _varint(value, out)
+        assert read_varint(out, 0) == (value, len(out))
+    out = bytearray()
+    _varint(300, out)
+    assert bytes(out) == b"\xac\x02"
+
+
+def test_zigzag_round_trip():
+    assert [_zigzag(v) for v in (0, -1, 1, -2, 2)] == [0, 1, 2, 3, 4]
+    for value in (0, 5, -5, EXTENT, -EXTENT, 2 ** 40, -(2 ** 40), 2 ** 63 - 1, -(2 ** 63)):
+        assert unzigzag(_zigzag(value)) == value
+
+
+def test_layer_geometry_and_properties_round_trip():
+    features = [
+        (0, 0, {"id": "a", "title": "Pier", "media_count": 3}),
+        (4096, 17, {"id": "b", "title": "Pier", "point_count": 2, "score": 1.5, "open": True}),
+        (-64, 4160, {"id": "c", "missing": None}),
+    ]
+    layer = decode_layer(encode_layer("pins", features))
+
+    assert layer["name"] == "pins"
+    assert layer["version"] == 2
+    assert layer["extent"] == EXTENT
+    assert feature_points(layer) == [
+        (1, 0, 0, {"id": "a", "title": "Pier", "media_count": 3}),
+        (2, 4096, 17, {"id": "b", "title": "Pier", "point_count": 2, "score": 1.5, "open": True}),
+        (3, -64, 4160, {"id": "c"}),
+    ]
+
+
+def test_layer_deduplicates_keys_and_values():
+    features = [(i, i, {"title": "same", "kind": "pin"}) for i in range(5)]
+    layer = decode_layer(encode_layer("pins", features))
+    assert layer["keys"] == ["title", "kind"]
+    assert layer["values"] == ["same", "pin"]
+    for fields in layer["features"]:
+        assert read_packed(dict(fields)[2]) == [0, 0, 1, 1]
+
+
+def test_layer_keeps_values_of_different_types_apart():
+    # 1, 1.0 and True compare equal in Python but are distinct MVT values
+    features = [(0, 0, {"v": 1}), (0, 0, {"v": 1.0}), (0, 0, {"v": True}), (0, 0, {"v": "1"})]
+    layer = decode_layer(encode_layer("pins", features))
+    assert [props["v"] for *_, props in feature_points(layer)] == [1, 1.0, True, "1"]
+    assert [type(v) for v in layer["values"]] == [int, float, bool, str]
+
+
+def test_tile_omits_empty_layers():
+    tile = encode_tile([("pins", [(1, 2, {"id": "a"})]), ("events", [])])
+    layers = [decode_layer(value) for number, value in read_fields(tile)]
+    assert [layer["name"] for layer in layers] == ["pins"]
+    assert encode_tile([("pins", []), ("events", [])]) == b""
+
+
+def test_tile_bounds():
+    assert tile_bounds(0, 0, 0) == (-180.0, -85.0511287798066, 180.0, 85.0511287798066)
+    west, south, east, north = tile_bounds(1, 1, 0)
+    assert (west, east) == (0.0, 180.0)
+    assert south == 0.0
+    assert round(north, 6) == 85.051129
+    # Neighbouring tiles share edges
+    assert tile_bounds(5, 10, 11)[2] == tile_bounds(5, 11, 11)[0]
+    assert tile_bounds(5, 10, 11)[1] == tile_bounds(5, 10, 12)[3]
+
+
+def test_tiles_for_point_contain_the_point():
+    for lat, lng in [(51.5074, -0.1278), (-33.8688, 151.2093), (0.0, 0.0), (89.9, 179.99), (-89.9, -180.0)]:
+        tiles = list(tiles_for_point(lat, lng, 14))
+        assert [z for z, _, _ in tiles] == list(range(15))
+        clamped = min(max(lat, -85.05112878), 85.05112878)
+        for z, x, y in tiles:
+            west, south, east, north = tile_bounds(z, x, y)
+            assert west <= lng <= east
+            assert south - 1e-9 <= clamped <= north + 1e-9
+        # Each tile is a child of the one above it
+        for (_, px, py), (_, x, y) in zip(tiles, tiles[1:]):
+            assert (x // 2, y // 2) == (px, py)
+
+
+def test_point_features_project_into_the_tile():
+    z, x, y = next((t for t in tiles_for_point(51.5074, -0.1278, 12) if t[0] == 12))
+    features = point_features([(51.5074, -0.1278, {"id": "in"}), (10.0, 10.0, {"id": "out"})], z, x, y, 10)
+    assert [props["id"] for _, _, props in features] == ["in"]
+    px, py, _ = features[0]
+    assert 0 <= px <= EXTENT and 0 <= py <= EXTENT
+
+
+def test_point_features_snap_collapses_into_the_first_point():
+    points = [(40 + 0.0001 * i, 45 + 0.0001 * i, {"id": str(i)}) for i in range(4)]
+    features = point_features(points, 2, 2, 1, 10, snap=64)
+    assert len(features) == 1
+    assert features[0][2] == {"id": "0", "point_count": 4}
+    assert points[0][2] == {"id": "0"}  # callers' dicts are left alone
+
+
+def test_cache_round_trip_and_invalidate(tmp_path):
+    cache = DiskTileCache(str(tmp_path), max_bytes=1 << 20, max_age=3600)
+    assert cache.get(3, 1, 2) is None
+    assert cache.put(3, 1, 2, b"tile")
+    assert cache.get(3, 1, 2) == b"tile"
+    cache.invalidate(3, 1, 2)
+    assert cache.get(3, 1, 2) is None
+
+
+def test_cache_drops_renders_that_raced_an_invalidation(tmp_path):
+    cache = DiskTileCache(str(tmp_path), max_bytes=1 << 20, max_age=3600)
+    generation = cache.generation(5, 10, 12)
+    # A pin write invalidates the tile while it is being rendered
+    cache.invalidate(5, 10, 12)
+    assert not cache.put(5, 10, 12, b"stale", generation)
+    assert cache.get(5, 10, 12) is None
+    assert not list(tmp_path.rglob("*.tmp"))
+    # The next render started after the write and is kept
+    assert cache.put(5, 10, 12, b"fresh", cache.generation(5, 10, 12))
+    assert cache.get(5, 10, 12) == b"fresh"
+    # Invalidating other tiles leaves it alone
+    generation = cache.generation(5, 10, 12)
+    cache.invalidate(5, 11, 12)
+    assert cache.put(5, 10, 12, b"again", generation)